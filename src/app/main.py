@@ -1,27 +1,41 @@
-from typing import Optional, Callable, List
+from typing import Optional, Callable, List, Union
 
 import numpy as np
 from PIL import Image
 from kivy import platform, Logger
 from kivy.app import App as KivyApp
+from kivy.clock import Clock
 from kivy.config import ConfigParser
 from kivy.uix.settings import SettingsWithSpinner, Settings
 
 from app.settings.manager import SettingsManager
+from app.settings.settings import SettingMetaOptions
 from app.ui.appui import AppUI
-from app.util.photo import save_image_to_pictures
+from app.util.coalescer import LatestCoalescer
+from app.util.controlloop import ControlLoop
+from app.util.photo import save_image_to_pictures, save_jpeg_to_pictures, new_video_path, new_flight_log_path
 from app.video.tracker import Tracker
 from autopilot.tracking.detector.api import Detection
 from drone.api.camera import Camera
 from drone.api.drone import Drone
+from drone.api.linearangular import LinearAngular
 from drone.api.status import Status
+from drone.api.telemetry import TelemetryStore
 from drone.registry import DroneRegistry
+from drone.replay.flightlog import FlightLogWriter
 from util.androidhacks import setup as androidhacks_setup
+from util.jpeg import JpegPhoto, PHOTO_WORKERS
+from util.metrics import Metrics
+from util.recorder import CONTAINERS
+from util.video import pyav_available
 
 
 class App(KivyApp, AppUI, SettingsManager):
     """Contains the core logic of the Drone Copilot application, leaving UI, controls and settings to superclasses."""
 
+    recording_section_name = 'Recording'
+    """The section name for the settings of the flight recordings"""
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         # Setup
@@ -38,10 +52,31 @@ class App(KivyApp, AppUI, SettingsManager):
         self._drone: Optional[Drone] = None
         self._tracker: Optional[Tracker] = None
         self._listen_status_stop: Optional[Callable[[], None]] = None
+        self._listen_telemetry_stop: Optional[Callable[[], None]] = None
+        self._flight_log: Optional[FlightLogWriter] = None
+        self._listen_flight_log_stop: Optional[Callable[[], None]] = None
         self._listen_video_stop: Optional[Callable[[], None]] = None
+        self._listen_tracker_video_stop: Optional[Callable[[], None]] = None
+        self._record_video_stop: Optional[Callable[..., None]] = None
         self._drone_cameras: Optional[List[Camera]] = None
         self._drone_camera: Optional[Camera] = None
         self._my_app_settings: Optional[SettingsWithSpinner] = None  # Cached settings
+        self.telemetry = TelemetryStore()
+        """The recent history of the drone status, recorded as it is received."""
+        # Deliver only the latest drone status to the main thread, at most once per frame (or the configured rate)
+        self._status_coalescer = LatestCoalescer(lambda status: self.dispatch('on_drone_status', status))
+        self.ui_status_rate_setting.bind(
+            self.section_name, lambda value: setattr(self._status_coalescer, 'max_rate', float(value)))
+        # Record the video of each flight, only offered if PyAV (which muxes it, see `util.recorder`) is installed
+        if pyav_available():
+            SettingsManager.instance()[self.recording_section_name] = [
+                SettingMetaOptions.create(
+                    'Video', 'Record the raw video of each flight (not re-encoded) in this container, or off',
+                    ['off'] + CONTAINERS, 'off'),
+            ]
+        # Send the stick inputs to the drone at a fixed rate, decoupled from the input events (one loop for the app)
+        self._control_loop = ControlLoop(self._apply_target_speed)
+        self._control_loop.setup_settings()
 
     @property
     def name(self):
@@ -98,6 +133,9 @@ class App(KivyApp, AppUI, SettingsManager):
         # UI Shortcuts
         self._tracker = self.ui_el('tracker')
 
+        # Periodically report the runtime metrics (e.g. of the video decoder)
+        Clock.schedule_interval(self._log_metrics, 10)
+
         if platform == 'android':
             androidhacks_setup()
 
@@ -109,13 +147,26 @@ class App(KivyApp, AppUI, SettingsManager):
         drones.drone_connect_auto(self.config, lambda drone: AppUI.on_drone_connect_result(self, drone) or (
             self.dispatch('on_drone_connected', drone) if drone else None))
 
+    # noinspection PyMethodMayBeStatic
+    def _log_metrics(self, _dt: float):
+        metrics = str(Metrics.instance())
+        if metrics:
+            Logger.info('DroneCopilotApp: metrics: %s' % metrics)
+
     def on_drone_connected(self, drone: Drone):
         AppUI.on_drone_connected(self, drone)  # Call the parent method
         Logger.info('DroneCopilotApp: on_drone_connected()')
         self._drone = drone
+        if self._control_loop.ident is None:  # Once, it serves every connection
+            self._control_loop.start()
 
         # Start listening for events
-        self._listen_status_stop = self._drone.listen_status(lambda status: self.dispatch('on_drone_status', status))
+        self._listen_status_stop = self._drone.listen_status(self._status_coalescer.put)
+        self._listen_telemetry_stop = self.telemetry.listen(self._drone)
+        if self.config.get(DroneRegistry.section_name, 'flight_log') == 'on':
+            self._flight_log = FlightLogWriter(new_flight_log_path())
+            self._flight_log.start()
+            self._listen_flight_log_stop = self._drone.listen_status(self._flight_log.log_status)
         self._tracker.bind(on_track=lambda *args: self.dispatch('on_drone_tracker_update', *args[1:]))
 
         # Connect to video camera (if available)
@@ -125,38 +176,65 @@ class App(KivyApp, AppUI, SettingsManager):
             # TODO: Multi-camera views!
             resolution = self._drone_camera.resolutions_video[0] \
                 if len(self._drone_camera.resolutions_video) > 0 else (640, 480)  # TODO: Configurable
+            pixel_format = self.config.get(self.ui_el('video').section_name, 'pixel_format')
             self._listen_video_stop = self._drone_camera.listen_video(
-                resolution, lambda frame: self.dispatch('on_drone_video_frame', frame))
+                resolution, lambda frame: self.dispatch('on_drone_video_frame', frame), pixel_format)
 
     def on_drone_status(self, drone_status: Status):
         AppUI.on_drone_status(self, drone_status)  # Call the parent method
         # Logger.info('DroneCopilotApp: on_drone_status(%s)' % drone_status)
+        # Record the video of each flight, from takeoff to landing
+        if drone_status.flying and not self._record_video_stop and self._drone_camera and pyav_available():
+            container = self.config.get(self.recording_section_name, 'video')
+            if container != 'off':
+                self._record_video_stop = self._drone_camera.record_video(new_video_path('flight', container))
+        elif not drone_status.flying and self._record_video_stop:
+            self._record_video_stop()
+            self._record_video_stop = None
 
     def on_drone_video_frame(self, frame: np.ndarray):
         AppUI.on_drone_video_frame(self, frame)  # Call the parent method
         # Logger.info('DroneCopilotApp: on_drone_video_frame(%s)' % frame)
-        if self._tracker.is_running():  # Also update the tracker's frame, if it's running
-            # AI algorithms actually want the image in height x width x channels format, not width x height x channels
-            # TODO: why is this needed???! (test-only?)
-            width, height, channels = frame.shape
-            reshape = frame.ravel(order='K').reshape((height, width, channels))
-            self._tracker.feed(reshape)
+
+    def _on_tracker_video_frame(self, frame: np.ndarray):
+        """Feeds the tracker with its own variant of the video frames (RGB, at the resolution of the detector)."""
+        # AI algorithms actually want the image in height x width x channels format, not width x height x channels
+        # TODO: why is this needed???! (test-only?)
+        width, height, channels = frame.shape
+        reshape = frame.ravel(order='K').reshape((height, width, channels))
+        self._tracker.feed(reshape)
 
     # noinspection PyMethodMayBeStatic
-    def on_drone_photo(self, frame: np.ndarray):
-        Logger.info('DroneCopilotApp: received photo frame')
-        save_image_to_pictures(Image.fromarray(frame, 'RGB'), 'picture')
+    def on_drone_photo(self, photo: Union[JpegPhoto, np.ndarray]):
+        Logger.info('DroneCopilotApp: received photo')
+        # Save it in the background, so that a burst of photos does not stall the thread that received them
+        if isinstance(photo, JpegPhoto):
+            PHOTO_WORKERS.submit(save_jpeg_to_pictures, photo, 'picture')  # As is, without decoding or re-encoding it
+        else:
+            PHOTO_WORKERS.submit(save_image_to_pictures, Image.fromarray(photo, 'RGB'), 'picture')
 
     def on_drone_tracker_update(self, detection: Optional[Detection], all_detections: List[Detection]):
         # Logger.info('DroneCopilotApp: received tracker results')
-        pass
+        if self._flight_log:
+            self._flight_log.log_detections(detection, all_detections)
 
     def on_stop(self):
         Logger.info('DroneCopilotApp: on_stop()')
         if self._listen_status_stop:
             self._listen_status_stop()
+        if self._listen_telemetry_stop:
+            self._listen_telemetry_stop()
+        if self._listen_flight_log_stop:
+            self._listen_flight_log_stop()
+        self._control_loop.stop()
+        if self._flight_log:
+            self._flight_log.close(timeout=5.0)  # Write the end of the flight before exiting, which kills the writer
         if self._tracker.is_running():
             self._tracker.stop()
+        if self._listen_tracker_video_stop:
+            self._listen_tracker_video_stop()
+        if self._record_video_stop:
+            self._record_video_stop(timeout=5.0)  # Finalize the file before exiting, which kills the recorder thread
         if self._listen_video_stop:
             self._listen_video_stop()
         if self._drone:
@@ -170,20 +248,17 @@ class App(KivyApp, AppUI, SettingsManager):
         # Logger.debug('DroneCopilotApp: action_joysticks: {} {} {} {}'.format(
         #     joystick_left_x, joystick_left_y, joystick_right_x, joystick_right_y))
 
-        if self._drone and self._drone.status.flying:
-            # Actually apply them to the drone
-            max_speed_m_per_s = 1.5  # TODO: Configurable
-            target_speed_to_update = self._drone.target_speed
-            if joystick_right_y is not None:
-                target_speed_to_update.linear_local_x = joystick_right_y * max_speed_m_per_s
-            if joystick_right_x is not None:
-                target_speed_to_update.linear_local_y = joystick_right_x * max_speed_m_per_s
-            if joystick_left_y is not None:
-                target_speed_to_update.linear_local_z = -joystick_left_y * max_speed_m_per_s
-            max_speed_angular = 1.0  # TODO: Configurable
-            if joystick_left_x is not None:
-                target_speed_to_update.yaw = joystick_left_x * max_speed_angular
-            self._drone.target_speed = target_speed_to_update  # Actually update the target speed
+        # Only store them: the control loop sends them to the drone on its next tick
+        self._control_loop.set_sticks(joystick_left_x, joystick_left_y, joystick_right_x, joystick_right_y)
+
+    def _apply_target_speed(self, speed: LinearAngular) -> bool:
+        """Sends a target speed from the control loop to the drone, only while flying."""
+        if not (self._drone and self._drone.status.flying):
+            return False
+        self._drone.target_speed = speed  # Actually update the target speed
+        if self._flight_log:
+            self._flight_log.log_control(speed)
+        return True
 
     def action_takeoff_land(self):
         def action_callback(taking_off: bool, success: bool):
@@ -213,7 +288,13 @@ class App(KivyApp, AppUI, SettingsManager):
         # Actually start/stop the tracking
         if set_enabled:
             self._tracker.start()
+            if self._drone_camera:  # The tracker gets its own frames, so that the UI keeps its pixel format and size
+                self._listen_tracker_video_stop = self._drone_camera.listen_video(
+                    self._tracker.video_resolution, self._on_tracker_video_frame, 'rgb24')
         else:
+            if self._listen_tracker_video_stop:
+                self._listen_tracker_video_stop()
+                self._listen_tracker_video_stop = None
             self._tracker.stop()
 
         # Update the UI
@@ -224,8 +305,8 @@ class App(KivyApp, AppUI, SettingsManager):
         if self._drone_camera:
             resolution = self._drone_camera.resolutions_photo[0] if len(self._drone_camera.resolutions_photo) > 0 else (
                 640, 480)  # TODO: Configurable
-            self._listen_video_stop = self._drone_camera.take_photo(
-                resolution, lambda frame: self.dispatch('on_drone_photo', frame))
+            if not self._drone_camera.take_photo_jpeg(resolution, lambda photo: self.dispatch('on_drone_photo', photo)):
+                self._drone_camera.take_photo(resolution, lambda frame: self.dispatch('on_drone_photo', frame))
         else:
             # TODO: Unsupported photo message
             Logger.error('DroneCopilotApp: unsupported photo request')
@@ -1,7 +1,7 @@
 import glob
 import logging
 from abc import abstractmethod
-from typing import Optional
+from typing import Dict, Optional
 
 import numpy as np
 from PIL import Image
@@ -31,19 +31,25 @@ class AppUI(Controls):
     _ui_el_root: Optional[Widget] = None
     _ui_drone: Optional[Drone] = None
     _ui_status_last_battery: float = -1.0
+    _ui_status_flying: Optional[bool] = None
     _ui_resizing: Optional[ClockEvent] = None
 
     def __init__(self):
         super().__init__()
+        self._ui_status_texts: Dict[str, str] = {}  # The last text of each status widget
         # Dynamically resize the UI when the window is resized or the scale is changed
         Window.bind(on_resize=lambda _dt, width, height: self.ui_on_resize(width, height))
         # Settings
         Logger.info('AppUI: UI settings...')
         settings = SettingsManager.instance()
         self.section_name = 'UI'
+        self.ui_status_rate_setting = SettingMetaNumeric.create(
+            'Status rate', 'The maximum updates per second of the drone status (0 for once per frame)', 0.0)
+        """Read by the app, which delivers the status updates to the UI."""
         settings[self.section_name] = [
             SettingMetaNumeric.create('Scale', 'The scale multiplier of the UI elements', 1.0),
-            SettingMetaNumeric.create('Opacity', 'The opacity multiplier of the UI elements', 1.0)
+            SettingMetaNumeric.create('Opacity', 'The opacity multiplier of the UI elements', 1.0),
+            self.ui_status_rate_setting,
         ]
         settings[self.section_name][0].bind(
             self.section_name, lambda _val: self.ui_on_resize(Window.width, Window.height), False)
@@ -186,34 +192,45 @@ class AppUI(Controls):
         else:
             self.ui_el('video').set_frame_text('No video available')
 
-    @mainthread
+    def _ui_set_status_text(self, _id: str, text: str):
+        """Sets the text of a status widget, only if it changed (each change triggers a new text texture)."""
+        if self._ui_status_texts.get(_id) != text:
+            widget = self.ui_el(_id)
+            if widget is not None:
+                widget.text = text
+                self._ui_status_texts[_id] = text
+
     def on_drone_status(self, drone_status: Status):
+        """Shows the latest drone status. It runs on the main thread, coalesced to the configured status rate."""
         # BATTERY
         if self._ui_status_last_battery != drone_status.battery:
             self._ui_status_last_battery = drone_status.battery
-            self.ui_el('battery_label').text = '{}%'.format(int(self._ui_status_last_battery * 100))
+            self._ui_set_status_text('battery_label', '{}%'.format(int(self._ui_status_last_battery * 100)))
             Logger.info('DroneCopilotApp: battery: {}%'.format(int(self._ui_status_last_battery * 100)))
         # TEMPERATURE
         if len(drone_status.temperatures) > 0:
             cur_max_temp_c = max(drone_status.temperatures.values()) - 273.15  # Kelvin to Celsius.
-            self.ui_el('temperature_label').text = '{:.1f}ºC'.format(cur_max_temp_c)  # TODO: Configure display units
+            self._ui_set_status_text('temperature_label', '{:.1f}ºC'.format(cur_max_temp_c))  # TODO: Display units
         # SIGNAL
-        self.ui_el('signal_label').text = str(int(drone_status.signal_strength * 100)) + '%'
+        self._ui_set_status_text('signal_label', str(int(drone_status.signal_strength * 100)) + '%')
         # HEIGHT
-        self.ui_el('height_label').text = '{:.2f}m'.format(drone_status.height)
+        self._ui_set_status_text('height_label', '{:.2f}m'.format(drone_status.height))
         # ENABLED UI ELEMENTS AND CONTENTS
-        self.ui_el('joystick_left').disabled = not self._ui_drone.status.flying
-        self.ui_el('joystick_right').disabled = not self._ui_drone.status.flying
-        if self._ui_drone.status.flying:
+        flying = drone_status.flying
+        if flying == self._ui_status_flying:
+            return
+        self._ui_status_flying = flying
+        self.ui_el('joystick_left').disabled = not flying
+        self.ui_el('joystick_right').disabled = not flying
+        if flying:
             self.ui_el('takeoff_land_button').background_color = (1, 1, 0, 1)
             self.ui_el('takeoff_land_button').text = 'Land'  # TODO: Icons?
         else:
             self.ui_el('takeoff_land_button').background_color = (1, 1, 1, 1)
             self.ui_el('takeoff_land_button').text = 'Takeoff'
 
-    @mainthread
     def on_drone_video_frame(self, frame: np.ndarray):
-        self.ui_el('video').update_texture(frame)
+        self.ui_el('video').update_texture(frame)  # Retains the frame and uploads it on the main thread
 
     @mainthread
     def action_joysticks(self, joystick_left_x: Optional[float], joystick_left_y: Optional[float],
@@ -0,0 +1,51 @@
+import threading
+import time
+from typing import Callable, Generic, Optional, TypeVar
+
+from kivy.clock import Clock
+
+T = TypeVar('T')
+
+
+class LatestCoalescer(Generic[T]):
+    """Delivers values produced on any thread (e.g. status updates) to the main thread, keeping only the latest one.
+
+    Unlike `kivy.clock.mainthread`, which queues a callback per value, at most one flush is pending at a time, so a
+    fast producer can't grow the queue of the main thread (and its input latency): intermediate values are skipped.
+    """
+
+    def __init__(self, callback: Callable[[T], None], max_rate: float = 0.0):
+        """
+        :param callback: the function to run on the main thread with the latest value.
+        :param max_rate: the maximum flushes per second, or 0 to flush at most once per frame.
+        """
+        self.callback = callback
+        self.max_rate = max_rate
+        self._lock = threading.Lock()
+        self._value: Optional[T] = None
+        self._pending = False
+        self._last_flush_time = 0.0
+        # Stats & debug
+        self.stats_received = 0
+        self.stats_flushed = 0
+
+    def put(self, value: T):
+        """Sets the latest value, scheduling a flush if none is pending. It never blocks, and may run on any thread."""
+        with self._lock:
+            self._value = value
+            self.stats_received += 1
+            if self._pending:
+                return  # The pending flush will deliver this value instead
+            self._pending = True
+        delay = 0.0
+        if self.max_rate > 0:
+            delay = max(0.0, self._last_flush_time + 1 / self.max_rate - time.time())
+        Clock.schedule_once(self._flush, delay)
+
+    def _flush(self, _dt: float):
+        with self._lock:
+            value, self._value = self._value, None
+            self._pending = False
+        self._last_flush_time = time.time()
+        self.stats_flushed += 1
+        self.callback(value)
@@ -0,0 +1,109 @@
+import threading
+import time
+from typing import Callable, Optional
+
+import numpy as np
+from kivy import Logger
+
+from app.settings.manager import SettingsManager
+from app.settings.settings import SettingMetaNumeric
+from drone.api.linearangular import LinearAngular
+from util.metrics import Metrics
+
+
+def shape_stick(value: np.ndarray, deadzone: float, expo: float) -> np.ndarray:
+    """Applies a deadzone and an exponential curve to stick values in [-1, 1].
+
+    :param value: the stick values.
+    :param deadzone: the values closer than this to 0 become 0, and the rest are rescaled to still reach -1 and 1.
+    :param expo: the weight of the cubic curve in [0, 1], for finer control around the center (0 is linear).
+    :return: the shaped values.
+    """
+    magnitude = np.clip((np.abs(value) - deadzone) / max(1e-9, 1 - deadzone), 0, 1)
+    shaped = np.sign(value) * magnitude
+    return (1 - expo) * shaped + expo * shaped ** 3
+
+
+class ControlLoop(threading.Thread):
+    """Sends the target speed to the drone at a fixed rate, from the latest stick inputs.
+
+    Inputs only store their latest value, so a storm of input events (e.g. gamepad axes at hundreds of Hz) costs
+    almost nothing: each tick shapes the sticks (see `shape_stick`) and sends the result to the drone only if it
+    changed since the last command that was sent.
+    """
+
+    section_name = 'Control'
+
+    def __init__(self, apply: Callable[[LinearAngular], bool], rate: float = 20.0):
+        """
+        :param apply: sends the target speed to the drone, returning whether it was sent (e.g. only while flying).
+        :param rate: the ticks per second.
+        """
+        super().__init__(name='ControlLoop', daemon=True)
+        self.apply = apply
+        self.rate = rate
+        self.deadzone = 0.05
+        self.expo = 0.25
+        self.max_speed = 1.5
+        self.max_speed_angular = 1.0
+        self._lock = threading.Lock()
+        self._sticks = np.zeros(4)  # left x, left y, right x, right y
+        self._last_command = np.zeros(4)  # Idle sticks don't interfere with the drone (e.g. while taking off)
+        self._stopping = threading.Event()
+        # Stats & debug
+        self.stats_ticks = 0
+        self.stats_sent = 0
+        self.metric_jitter = Metrics.instance().metric('control.jitter', 'ms')
+        """How late each tick runs, compared to its schedule."""
+
+    def setup_settings(self):
+        """Registers the settings of the loop, and applies their values."""
+        settings = SettingsManager.instance()
+        settings[self.section_name] = [
+            SettingMetaNumeric.create('Rate', 'The target speed updates per second sent to the drone', self.rate),
+            SettingMetaNumeric.create('Deadzone', 'The stick values closer to the center are ignored', self.deadzone),
+            SettingMetaNumeric.create('Expo', 'Finer control around the stick center, from 0 (linear) to 1', self.expo),
+            SettingMetaNumeric.create('Max speed', 'The speed in m/s at full stick', self.max_speed),
+            SettingMetaNumeric.create('Max angular speed', 'The yaw speed in rad/s at full stick',
+                                      self.max_speed_angular),
+        ]
+        for setting, attribute in zip(settings[self.section_name],
+                                      ['rate', 'deadzone', 'expo', 'max_speed', 'max_speed_angular']):
+            setting.bind(self.section_name, lambda value, a=attribute: setattr(self, a, float(value)))
+
+    def set_sticks(self, left_x: Optional[float], left_y: Optional[float], right_x: Optional[float],
+                   right_y: Optional[float]):
+        """Sets the latest stick values in [-1, 1] (None keeps the previous value), see `Controls.action_joysticks`."""
+        with self._lock:
+            for i, value in enumerate((left_x, left_y, right_x, right_y)):
+                if value is not None:
+                    self._sticks[i] = value
+
+    def _command(self) -> np.ndarray:
+        """Computes the target [x, y, z, yaw] speed from the latest inputs."""
+        with self._lock:
+            sticks = self._sticks.copy()
+        left_x, left_y, right_x, right_y = shape_stick(sticks, self.deadzone, self.expo)
+        return np.array([right_y * self.max_speed, right_x * self.max_speed, -left_y * self.max_speed,
+                         left_x * self.max_speed_angular])
+
+    def run(self):
+        Logger.info('ControlLoop: started at %.1f Hz' % self.rate)
+        next_tick = time.perf_counter()
+        while not self._stopping.is_set():
+            self.metric_jitter.record((time.perf_counter() - next_tick) * 1000)
+            self.stats_ticks += 1
+            command = self._command()
+            if not np.allclose(command, self._last_command, rtol=0, atol=1e-3):
+                speed = LinearAngular(command[:3], np.array([0.0, 0.0, command[3]]))
+                if self.apply(speed):  # Otherwise, retry on the next tick
+                    self._last_command = command
+                    self.stats_sent += 1
+            next_tick = max(next_tick + 1 / max(0.1, self.rate), time.perf_counter())  # Skip missed ticks
+            self._stopping.wait(max(0.0, next_tick - time.perf_counter()))
+        Logger.info('ControlLoop: stopped after %d ticks, %d commands sent, jitter %s' % (
+            self.stats_ticks, self.stats_sent, self.metric_jitter))
+
+    def stop(self):
+        """Stops the loop, after the current tick."""
+        self._stopping.set()
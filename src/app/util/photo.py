@@ -5,15 +5,40 @@ import plyer
 from PIL import Image
 from kivy import Logger
 
+from util.jpeg import JpegPhoto
+
+
+def _new_media_path(media_dir: str, kind: str, extension: str) -> str:
+    """Returns a new timestamped file path in the DroneCopilot/<kind> subdirectory of media_dir, creating it if needed.
+    """
+    if 'DroneCopilot' not in os.listdir(media_dir):
+        os.mkdir(os.path.join(media_dir, 'DroneCopilot'))
+    if kind not in os.listdir(os.path.join(media_dir, 'DroneCopilot')):
+        os.mkdir(os.path.join(media_dir, 'DroneCopilot', kind))
+    filename = time.strftime('%Y%m%d-%H%M%S') + '.' + extension
+    return os.path.join(media_dir, 'DroneCopilot', kind, filename)
+
 
 def save_image_to_pictures(img: Image, kind='screenshot'):
     start_time = time.time()
-    pictures_dir = plyer.storagepath.get_pictures_dir()
-    if 'DroneCopilot' not in os.listdir(pictures_dir):
-        os.mkdir(os.path.join(pictures_dir, 'DroneCopilot'))
-    if kind not in os.listdir(os.path.join(pictures_dir, 'DroneCopilot')):
-        os.mkdir(os.path.join(pictures_dir, 'DroneCopilot', kind))
-    filename = time.strftime('%Y%m%d-%H%M%S') + '.jpg'
-    filepath = os.path.join(pictures_dir, 'DroneCopilot', kind, filename)
+    filepath = _new_media_path(plyer.storagepath.get_pictures_dir(), kind, 'jpg')
     img.save(filepath)
     Logger.info('DroneCopilotApp: App screenshot saved at "%s" in %f seconds' % (filepath, time.time() - start_time))
+
+
+def save_jpeg_to_pictures(photo: JpegPhoto, kind='picture'):
+    """Saves a photo as received from the camera, without re-encoding it."""
+    start_time = time.time()
+    filepath = _new_media_path(plyer.storagepath.get_pictures_dir(), kind, 'jpg')
+    photo.save(filepath)
+    Logger.info('DroneCopilotApp: photo saved at "%s" in %f seconds' % (filepath, time.time() - start_time))
+
+
+def new_flight_log_path(kind='flight') -> str:
+    """Returns the path of a new flight log (a directory, see `drone.replay.flightlog`) in the documents directory."""
+    return _new_media_path(plyer.storagepath.get_documents_dir(), kind, 'flightlog')
+
+
+def new_video_path(kind='flight', extension='mkv') -> str:
+    """Returns the path of a new video file in the videos directory, to record it."""
+    return _new_media_path(plyer.storagepath.get_videos_dir(), kind, extension)
@@ -1,5 +1,5 @@
 from threading import Thread, Event, Lock
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 import numpy as np
 from kivy import Logger
@@ -16,8 +16,11 @@ from app.settings.settings import SettingMetaOptions, SettingMetaNumeric
 from app.video.video import MyVideo
 from autopilot.tracking.detector.api import Detection
 from autopilot.tracking.detector.registry import build_registry as detector_registry
+from autopilot.tracking.detector.tflite import TF_LITE_RUNTIMES, set_tf_lite_runtime
 from autopilot.tracking.tracker.api import Tracker as TrackerAPI
 from autopilot.tracking.tracker.registry import build_registry as tracker_registry
+from autopilot.tracking.tracker.smoothing import DetectionSmoother
+from util.frames import frame_pixel_format, yuv420p_to_rgb, retain_frame, release_frame
 
 
 class Tracker(Widget):
@@ -41,6 +44,9 @@ class Tracker(Widget):
         self._new_img_lock = Lock()
         self._img = None
         self._load_progress: Optional[float] = None
+        self._smoother = DetectionSmoother()
+        self._detection_interval = 1  # Only track every N fed frames
+        self._feed_counter = 0
         # Events
         self.register_event_type('on_track')
         # Settings
@@ -71,10 +77,24 @@ class Tracker(Widget):
             if first_time:
                 detector_selector.bind(self._section_name, self._on_change_tracker_detector, True)
 
+        # The TFLite runtime is always imported in the background at startup, as it is slow
+        runtime_selector = SettingMetaOptions.create(
+            'TFLite runtime', 'The TensorFlow Lite implementation (tensorflow may use the GPU, but loads slower)',
+            TF_LITE_RUNTIMES, TF_LITE_RUNTIMES[0])
+        if first_time:
+            runtime_selector.bind(self._section_name, set_tf_lite_runtime, True)
+        current_settings += [runtime_selector]
+
         # Common detector/tracker settings (read from the tracker thread on each frame)
         current_settings += [
             SettingMetaNumeric.create('Confidence', 'The minimum confidence to detect/track', 0.5),
             SettingMetaNumeric.create('Max results', 'The maximum number of objects to detect', -1),
+            SettingMetaNumeric.create(
+                'Smoothing', 'Temporal smoothing of the detections in [0, 1) (0 to disable)', 0.5),
+            SettingMetaNumeric.create(
+                'Confidence hysteresis', 'How much lower the confidence of a smoothed detection may get', 0.25),
+            SettingMetaNumeric.create(
+                'Detection interval', 'Only detect/track every N video frames (smoothing hides the gaps)', 1),
         ]
 
         # Update the settings and force refresh their UI
@@ -119,14 +139,50 @@ class Tracker(Widget):
         :param img: the image to feed the tracker with, in the format [height, width, channels(3)].
             Note that the implementation will resize and crop the image if required.
             It should also adapt the data type, assuming floats to be in the range [0, 1].
+            It may also be a yuv420p video frame (see `util.frames.PIXEL_FORMATS`), which is only converted to RGB
+            (at the input resolution of the detector) if it is processed.
         """
-        self._feed(img)
+        self._feed_counter += 1
+        if self._feed_counter >= self._detection_interval:
+            self._feed_counter = 0
+            self._feed(img)
 
     def _feed(self, img: Optional[np.ndarray]):
+        if img is not None:
+            retain_frame(img)  # Video frames are read-only and shared, so they can be kept without copying them
         with self._new_img_lock:
-            self._img = img
+            previous_img, self._img = self._img, img
+        if previous_img is not None:
+            release_frame(previous_img)
         self._new_img_event.set()
 
+    def _track(self, img: np.ndarray) -> (Optional[Detection], List[Detection]):
+        """Runs the tracking algorithm on the image, with the current settings."""
+        config = App.get_running_app().config
+        confidence = float(config.get(self._section_name, 'confidence'))
+        max_results = int(config.get(self._section_name, 'max_results'))
+        smoothing = float(config.get(self._section_name, 'smoothing'))
+        self._detection_interval = max(1, int(config.get(self._section_name, 'detection_interval')))
+        if smoothing > 0:
+            # Ask for less confident detections, and let the smoother decide when they appear or disappear
+            self._smoother.smoothing = smoothing
+            self._smoother.appear_confidence = confidence
+            self._smoother.disappear_confidence = max(
+                0.0, confidence - float(config.get(self._section_name, 'confidence_hysteresis')))
+            detection, all_detections = self._tracker.track(img, self._smoother.disappear_confidence, max_results)
+            return self._smoother.update(detection, all_detections)
+        return self._tracker.track(img, confidence, max_results)
+
+    @property
+    def video_resolution(self) -> (int, int):
+        """The maximum (width, height) of the video frames worth feeding, as larger ones would be scaled down anyway."""
+        return self._input_size() or (640, 640)
+
+    def _input_size(self) -> Optional[Tuple[int, int]]:
+        """The (width, height) of the images that the detector processes, if known."""
+        input_size = getattr(self._tracker.detector, 'input_size', (0, 0))
+        return input_size if input_size[0] > 0 and input_size[1] > 0 else None
+
     def on_touch_down(self, touch):
         return super().on_touch_down(touch)  # Passthrough the event to child widgets
         # TODO: Receive wanted object to track from UI (click on any rectangle)
@@ -177,25 +233,22 @@ class Tracker(Widget):
                 else:
                     Color(0, 1, 0, 1)
 
-                # Render the bounding box
+                # Render the bounding box (without modifying the detection, that is shared with other listeners)
                 bb = det.bounding_box
-                # Flip the y coordinates
-                bb.y_min = 1 - bb.y_min
-                bb.y_max = 1 - bb.y_max
-                # Convert bounding box to screen pixel coordinates
-                bb.x_min = bb.x_min * sw + sx
-                bb.x_max = bb.x_max * sw + sx
-                bb.y_min = bb.y_min * sh + sy
-                bb.y_max = bb.y_max * sh + sy
+                # Flip the y coordinates and convert bounding box to screen pixel coordinates
+                x_min = bb.x_min * sw + sx
+                x_max = bb.x_max * sw + sx
+                y_min = (1 - bb.y_min) * sh + sy
+                y_max = (1 - bb.y_max) * sh + sy
                 # Draw the bounding box
-                Line(points=[bb.x_min, bb.y_min, bb.x_max, bb.y_min, bb.x_max, bb.y_max, bb.x_min, bb.y_max,
-                             bb.x_min, bb.y_min], width=pt(2 if is_tracked else 1))
+                Line(points=[x_min, y_min, x_max, y_min, x_max, y_max, x_min, y_max,
+                             x_min, y_min], width=pt(2 if is_tracked else 1))
 
                 # Render the label
                 msg = f'{det.category.label} ({det.confidence * 100:.0f}%)'
                 label = CoreLabel(text=msg, font_size=pt(16))
                 label.refresh()  # The label is usually not drawn until needed, so force it to draw.
-                Rectangle(texture=label.texture, pos=(bb.x_min + pt(4), bb.y_min - pt(16 + 4)), size=label.texture.size)
+                Rectangle(texture=label.texture, pos=(x_min + pt(4), y_min - pt(16 + 4)), size=label.texture.size)
 
             PopState()
 
@@ -213,6 +266,7 @@ class Tracker(Widget):
             if self.is_running(False):
                 self.stop()
             # Start the thread
+            self._smoother.reset()
             self._thread = Thread(target=self._bg_thread)
             self._thread.start()
 
@@ -248,16 +302,21 @@ class Tracker(Widget):
             self._new_img_event.clear()
             start_time = Clock.time()
 
-            # Detect stop condition and copy the new image
+            # Detect stop condition and take the new image (read-only, so it needs no copy)
             with self._new_img_lock:  # Avoid races with the feed() method
                 if self._img is None:
                     break
-                img = self._img.copy()  # Avoid blocking or reading new data while processing
-
-            # Run the tracking algorithm
-            confidence = float(App.get_running_app().config.get(self._section_name, 'confidence'))
-            max_results = int(App.get_running_app().config.get(self._section_name, 'max_results'))
-            detection, all_detections = self._tracker.track(img, confidence, max_results)
+                frame = self._img
+                retain_frame(frame)
+            try:
+                if frame_pixel_format(frame) == 'yuv420p':
+                    img = yuv420p_to_rgb(frame, self._input_size())  # A new image, at a lower resolution
+                else:
+                    img = frame
+                # Run the tracking algorithm
+                detection, all_detections = self._track(img)
+            finally:
+                release_frame(frame)
 
             # Run any bound event listeners, including the default one which updates the UI
             # NOTE: This runs them on the background thread, blocking further processing until they are done.
@@ -1,14 +1,91 @@
+from typing import Optional
+
 import numpy as np
+from kivy import Logger
+from kivy.app import App
 from kivy.clock import mainthread
 from kivy.core.text import Label as CoreLabel
+from kivy.graphics import Fbo, BindTexture, Rectangle
 from kivy.graphics.texture import Texture
 from kivy.uix.image import Image
 
+from app.settings.manager import SettingsManager
+from app.settings.settings import SettingMetaOptions, SettingMetaNumeric
+from util.frames import PIXEL_FORMATS, frame_pixel_format, yuv420p_planes, retain_frame, release_frame
+from util.video import StreamingVideoSource, VideoDecoderOptions, DECODER_PRESETS, THREAD_TYPES, available_decoders
+
+# Converts the yuv420p planes (limited range BT.601, like H.264 video) to RGB, see VideoFFPy
+_YUV420P_TO_RGB_FS = """$HEADER$
+uniform sampler2D tex_y;
+uniform sampler2D tex_u;
+uniform sampler2D tex_v;
+
+void main(void) {
+    float y = 1.164 * (texture2D(tex_y, tex_coord0).r - 0.0625);
+    float u = texture2D(tex_u, tex_coord0).r - 0.5;
+    float v = texture2D(tex_v, tex_coord0).r - 0.5;
+    gl_FragColor = vec4(y + 1.596 * v, y - 0.392 * u - 0.813 * v, y + 2.017 * u, 1.0);
+}
+"""
+
 
 class MyVideo(Image):
+    section_name = 'Video'
+    """The section name for settings"""
+    decoder_section_name = 'Video decoder'
+    """The section name for the settings of the video decoder"""
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs, nocache=True, allow_stretch=True)
+        self._fbo: Optional[Fbo] = None
+        self._tex_planes: Optional[(Texture, Texture, Texture)] = None
+        # Settings
+        SettingsManager.instance()[self.section_name] = [
+            SettingMetaOptions.create(
+                'Pixel format', 'The decoded video format (yuv420p is converted to RGB on the GPU), used on connect',
+                PIXEL_FORMATS, PIXEL_FORMATS[0]),
+        ]
+        decoder_settings = [
+            SettingMetaOptions.create(
+                'Backend', 'The decoder implementation (pyav is only listed if installed), used on connect',
+                available_decoders(), StreamingVideoSource.DECODERS[0]),
+            SettingMetaOptions.create(
+                'Preset', 'FFmpeg defaults, the lowest latency (may not open every stream), the highest throughput or '
+                          'custom options, used on connect',
+                list(DECODER_PRESETS.keys()) + ['custom'], 'default'),
+            SettingMetaNumeric.create('Threads', 'Custom: the number of decoding threads, or 0 for automatic', 0),
+            SettingMetaOptions.create(
+                'Thread type', 'Custom: slice threading adds no latency, frame threading scales better',
+                THREAD_TYPES, THREAD_TYPES[0]),
+            SettingMetaOptions.create(
+                'Low delay', 'Custom: output frames as soon as possible, without buffering the input', ['off', 'on'],
+                'off'),
+            SettingMetaNumeric.create(
+                'Probe size', 'Custom: the bytes of the stream to probe before decoding (ffpyplayer)', 5000000),
+        ]
+        SettingsManager.instance()[self.decoder_section_name] = decoder_settings
+        for setting in decoder_settings:
+            setting.bind(self.decoder_section_name, lambda _value: self._on_change_decoder_options(),
+                         setting is decoder_settings[0])
+
+    def _on_change_decoder_options(self):
+        """Sets the options of the video decoders created from now on (e.g. on the next connection)."""
+        config = App.get_running_app().config
+        backend = config.get(self.decoder_section_name, 'backend')
+        if backend not in available_decoders():  # e.g. PyAV was uninstalled
+            backend = StreamingVideoSource.DECODERS[0]
+        StreamingVideoSource.default_decoder = backend
+        preset = config.get(self.decoder_section_name, 'preset')
+        if preset in DECODER_PRESETS:
+            options = DECODER_PRESETS[preset]
+        else:
+            options = VideoDecoderOptions(
+                threads=int(float(config.get(self.decoder_section_name, 'threads'))),
+                thread_type=config.get(self.decoder_section_name, 'thread_type'),
+                low_delay=config.get(self.decoder_section_name, 'low_delay') == 'on',
+                probe_size=int(float(config.get(self.decoder_section_name, 'probe_size'))))
+        StreamingVideoSource.default_options = options
+        Logger.info('MyVideo: video decoder %s, options: %s' % (backend, options))
 
     def set_frame_text(self, msg: str, **kwargs):
         """Generates a new frame that only contains the given text.
@@ -22,20 +99,70 @@ class MyVideo(Image):
         # Now access the texture of the label and use it wherever and however you may please.
         self.texture = label.texture
 
-    @mainthread
     def update_texture(self, frame: np.ndarray):
         """
         Queues an update of the texture on the main UI thread (work should be minimal).
         It also forces to redraw of the widget soon.
 
-        :param frame: the image to update the texture with, as a numpy.ndarray of (width, height, 3) in RGB format.
+        :param frame: the image to update the texture with, as a numpy.ndarray of (width, height, 3) in RGB format,
+            a gray frame of (width, height, 1), or a yuv420p frame (see `util.frames.PIXEL_FORMATS`) that is converted
+            to RGB on the GPU.
         """
+        retain_frame(frame)  # Until it is uploaded
+        self._update_texture(frame)
+
+    @mainthread
+    def _update_texture(self, frame: np.ndarray):
+        try:
+            if frame_pixel_format(frame) == 'yuv420p':
+                self._update_texture_yuv420p(frame)
+            else:
+                self._update_texture_rgb24(frame)
+        finally:
+            release_frame(frame)
+
+    def _update_texture_rgb24(self, frame: np.ndarray):
         # Update the texture with the vertically-flipped next frame and ask to be redrawn
         new_size = tuple(frame.shape[:2])
-        if not self.texture or self.texture.size != new_size:  # Create a new texture only if the size changed
-            self.texture = Texture.create(size=new_size, colorfmt='rgb', bufferfmt='ubyte', mipmap=False)
+        colorfmt = 'rgb' if frame.shape[2] == 3 else 'luminance'  # Also renders gray frames
+        if not self.texture or self.texture.size != new_size or self.texture.colorfmt != colorfmt or \
+                (self._fbo is not None and self.texture is self._fbo.texture):  # Only if the size/format changed
+            self.texture = Texture.create(size=new_size, colorfmt=colorfmt, bufferfmt='ubyte', mipmap=False)
             self.texture.flip_vertical()
-        self.texture.blit_buffer(frame.flatten(), colorfmt='rgb', bufferfmt='ubyte', mipmap_generation=False)
+        # Upload directly from the frame's buffer (a view, unless the frame is not contiguous)
+        buffer = np.ascontiguousarray(frame).reshape(-1)
+        try:
+            self.texture.blit_buffer(buffer, colorfmt=colorfmt, bufferfmt='ubyte', mipmap_generation=False)
+        except ValueError:  # Some Kivy versions can't read from read-only buffers
+            self.texture.blit_buffer(buffer.tobytes(), colorfmt=colorfmt, bufferfmt='ubyte', mipmap_generation=False)
+        self.canvas.ask_update()
+
+    def _update_texture_yuv420p(self, frame: np.ndarray):
+        """Uploads the planes as luminance textures and renders them to an RGB texture with a shader."""
+        planes = yuv420p_planes(frame)
+        new_size = (planes[0].shape[1], planes[0].shape[0])
+        if self._fbo is None or tuple(self._fbo.size) != new_size:  # Create new textures only if the size changed
+            self._tex_planes = tuple(Texture.create(size=(plane.shape[1], plane.shape[0]), colorfmt='luminance',
+                                                    bufferfmt='ubyte', mipmap=False) for plane in planes)
+            self._tex_planes[0].flip_vertical()  # Its texture coordinates are also used to sample the other planes
+            self._fbo = Fbo(size=new_size)
+            with self._fbo:
+                BindTexture(texture=self._tex_planes[1], index=1)
+                BindTexture(texture=self._tex_planes[2], index=2)
+                Rectangle(size=new_size, texture=self._tex_planes[0])
+            self._fbo.shader.fs = _YUV420P_TO_RGB_FS
+            self._fbo['tex_y'], self._fbo['tex_u'], self._fbo['tex_v'] = 0, 1, 2
+        for texture, plane in zip(self._tex_planes, planes):
+            buffer = np.ascontiguousarray(plane).reshape(-1)
+            try:
+                texture.blit_buffer(buffer, colorfmt='luminance', bufferfmt='ubyte', mipmap_generation=False)
+            except ValueError:  # Some Kivy versions can't read from read-only buffers
+                texture.blit_buffer(buffer.tobytes(), colorfmt='luminance', bufferfmt='ubyte',
+                                    mipmap_generation=False)
+        self._fbo.ask_update()
+        self._fbo.draw()
+        if self.texture is not self._fbo.texture:
+            self.texture = self._fbo.texture
         self.canvas.ask_update()
 
     def get_screen_bounds(self) -> (int, int, int, int):
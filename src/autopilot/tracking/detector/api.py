@@ -2,7 +2,7 @@
 
 import abc
 from dataclasses import dataclass
-from typing import List, Callable
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple, Union
 
 import numpy as np
 
@@ -11,6 +11,8 @@ import numpy as np
 class Rect:
     """A rectangle in 2D space."""
 
+    __slots__ = ('x_min', 'y_min', 'x_max', 'y_max')
+
     x_min: float
     """The horizontal start in the range [0, 1], relative of the input size"""
 
@@ -24,9 +26,13 @@ class Rect:
     """The vertical end in the range [0, 1], relative of the input size"""
 
 
-@dataclass
+@dataclass(frozen=True)
 class Category:
-    """A result of a classification task."""
+    """A result of a classification task.
+
+    It is immutable, as detectors intern a single instance per category that all detections share."""
+
+    __slots__ = ('id', 'label')
 
     id: int
     """The unique ID of the category"""
@@ -35,10 +41,21 @@ class Category:
     """The display name of the category"""
 
 
+def build_categories(labels: Sequence[str]) -> Tuple[Category, ...]:
+    """Builds the table of interned categories for a model, indexed by category ID.
+
+    :param labels: the display name of each category, indexed by ID.
+    :return: the category table, to be built once when the model is loaded.
+    """
+    return tuple(Category(id=i, label=label) for i, label in enumerate(labels))
+
+
 @dataclass
 class Detection:
     """A detected object in an image."""
 
+    __slots__ = ('bounding_box', 'confidence', 'category')
+
     bounding_box: Rect
     """The bounding box of the detection (smallest rect that contains the detection)"""
 
@@ -51,10 +68,71 @@ class Detection:
     # TODO: segmentations, features/key points and other kinds of detection metadata
 
 
+class DetectionBatch:
+    """A NumPy-backed view over all the detections of an image, SORTED by descending detection confidence.
+
+    :class:`Detection` objects are only built when accessed, so consumers that work with the arrays directly do not
+    allocate anything per detection."""
+
+    __slots__ = ('boxes', 'confidences', 'category_ids', 'categories')
+
+    def __init__(self, boxes: np.ndarray, confidences: np.ndarray, category_ids: np.ndarray,
+                 categories: Union[Sequence[Category], Dict[int, Category]] = ()):
+        """
+        :param boxes: the bounding boxes, with shape [N, 4] as (x_min, y_min, x_max, y_max), see :class:`Rect`.
+        :param confidences: the confidence of each detection, with shape [N].
+        :param category_ids: the category ID of each detection, with shape [N].
+        :param categories: the interned category table of the model, indexed by category ID.
+        """
+        self.boxes = boxes
+        self.confidences = confidences
+        self.category_ids = category_ids
+        self.categories = categories
+
+    @staticmethod
+    def empty(categories: Union[Sequence[Category], Dict[int, Category]] = ()) -> 'DetectionBatch':
+        """Returns a batch without detections."""
+        return DetectionBatch(np.zeros((0, 4), dtype=np.float32), np.zeros(0, dtype=np.float32),
+                              np.zeros(0, dtype=np.int32), categories)
+
+    @staticmethod
+    def from_list(detections: List[Detection]) -> 'DetectionBatch':
+        """Builds a batch from a list of detections (already sorted by descending confidence)."""
+        boxes = np.array([(d.bounding_box.x_min, d.bounding_box.y_min, d.bounding_box.x_max, d.bounding_box.y_max)
+                          for d in detections], dtype=np.float32).reshape((-1, 4))
+        confidences = np.array([d.confidence for d in detections], dtype=np.float32)
+        category_ids = np.array([d.category.id for d in detections], dtype=np.int32)
+        categories = {d.category.id: d.category for d in detections}
+        return DetectionBatch(boxes, confidences, category_ids, categories)
+
+    def category(self, category_id: int) -> Category:
+        """Returns the interned category for the given ID, or a new unlabeled one if the model does not know it."""
+        try:
+            return self.categories[category_id]
+        except (IndexError, KeyError):
+            return Category(id=category_id, label='')
+
+    def __len__(self) -> int:
+        return len(self.confidences)
+
+    def __getitem__(self, i: int) -> Detection:
+        x_min, y_min, x_max, y_max = self.boxes[i].tolist()
+        return Detection(bounding_box=Rect(x_min=x_min, y_min=y_min, x_max=x_max, y_max=y_max),
+                         confidence=float(self.confidences[i]), category=self.category(int(self.category_ids[i])))
+
+    def __iter__(self) -> Iterator[Detection]:
+        return (self[i] for i in range(len(self)))
+
+    def to_list(self) -> List[Detection]:
+        """Builds the :class:`Detection` objects for the whole batch."""
+        return list(self)
+
+
 class Detector(abc.ABC):
     """An object detector API that looks for matches in a single image."""
 
     _loaded = False
+    _categories: Tuple[Category, ...] = ()
 
     @property
     @abc.abstractmethod
@@ -62,6 +140,11 @@ class Detector(abc.ABC):
         """Returns the display name of the detector."""
         return "Unnamed"
 
+    @property
+    def categories(self) -> Tuple[Category, ...]:
+        """Returns the interned categories of the loaded model, indexed by category ID (empty if unknown)."""
+        return self._categories
+
     def selected(self, selected: bool):
         """Called when the detector is selected by the user (to register custom settings)."""
         pass
@@ -96,3 +179,9 @@ class Detector(abc.ABC):
         :return: the list of matches found, SORTED by descending detection confidence.
         """
         pass
+
+    def detect_batch(self, img: np.ndarray, min_confidence: float = 0.5, max_results: int = -1) -> DetectionBatch:
+        """Same as :func:`detect`, but returns a NumPy-backed view over the results.
+        Implementations should override this to avoid building :class:`Detection` objects that are not needed.
+        """
+        return DetectionBatch.from_list(self.detect(img, min_confidence, max_results))
@@ -0,0 +1,354 @@
+"""Common implementation of the object detectors that run a model with box, class and score outputs.
+
+The backend that actually runs the model (TFLite, OpenCV DNN...) only needs to implement the inference step, sharing
+the settings, the label handling and the vectorized pre- and post-processing.
+"""
+import abc
+import copy
+import multiprocessing
+import os
+import time
+import typing
+import zipfile
+from dataclasses import dataclass
+from typing import List, Optional
+
+import cv2
+import numpy as np
+from kivy import Logger
+
+from app.settings.manager import SettingsManager
+from app.settings.settings import SettingMetaNumeric, SettingMetaString
+from autopilot.tracking.detector.api import Detector, Detection, DetectionBatch, build_categories
+from util.filesystem import download
+
+
+@dataclass
+class ModelDetectorOptions:
+    """A config to initialize an object detector."""
+
+    label_allow_list: List[str] = None
+    """The optional allow list of labels. It is compiled into a class mask when the model is loaded."""
+
+    label_deny_list: List[str] = None
+    """The optional deny list of labels. It is compiled into a class mask when the model is loaded."""
+
+    num_threads: int = min(4, multiprocessing.cpu_count())  # 4 usually works better than more
+    """The number of CPU threads to be used."""
+
+    non_max_suppression_threshold: Optional[float] = 0.95
+    """The threshold for non-max suppression (removing duplicate detections)."""
+
+
+def resize_and_pad(img: np.ndarray, w: int, h: int) -> (np.ndarray, float, float, float, float):
+    """
+    Resize and pad (with gray) an image to a target size.
+    """
+    img_h, img_w = img.shape[:2]
+    scale = min(w / img_w, h / img_h)
+    resized = cv2.resize(img, (int(img_w * scale), int(img_h * scale)))
+    padded = np.full((h, w, 3), 128, dtype=np.uint8)
+    padded[:resized.shape[0], :resized.shape[1]] = resized
+    added_x, scaled_x, added_y, scaled_y = 0, 1, 0, 1  # Used to scale the bounding box back to the original image
+    if img_w > img_h:
+        scaled_y = scale / (h / img_h)
+        # added_y = (1 - scaled_y) / 2  # Actually, the padded image is not centered, so we don't need this
+    elif img_w < img_h:
+        scaled_x = scale / (w / img_w)
+        # added_x = (1 - scaled_x) / 2  # Actually, the padded image is not centered, so we don't need this
+    # Logger.info(f"resize_and_pad: {img_w}x{img_h} -> {resized.shape[1]}x{resized.shape[0]} -> {w}x{h}")
+    # Logger.info(f"resize_and_pad: added_x={added_x}, scaled_x={scaled_x}, added_y={added_y}, scaled_y={scaled_y}")
+    return padded, added_x, scaled_x, added_y, scaled_y
+
+
+class ModelDetector(Detector, abc.ABC):
+    """The backend-independent part of a detector that runs a model with box, class and score outputs."""
+
+    def __init__(self, model_path: str, labels: List[str] = None,
+                 options: ModelDetectorOptions = ModelDetectorOptions()) -> None:
+        """Initialize an object detection model.
+
+        :param model_path: Path or URL to the model.
+        :param labels: List of labels for the model. They will be automatically retrieved from the model if available.
+        :param options: The config to initialize an object detector.
+        """
+        self._model_path = model_path
+        self._labels = labels or []
+        self._options = copy.copy(options)  # Each detector is configured independently
+        self._class_mask: Optional[np.ndarray] = None
+        self.input_size = (0, 0)
+        self._dtype: Optional[any] = None
+        self._first_selection: bool = True
+        self._stats_inference_time = (0.0, 0)  # sum, count
+
+    def selected(self, selected: bool):
+        # Settings
+        settings = SettingsManager.instance()
+        section_name = f'Detector-{self.name}'
+        if selected:
+            settings[section_name] = [
+                SettingMetaNumeric.create(
+                    'non_max_suppression_threshold', 'Non-max suppression threshold (-1 to disable)',
+                    self._options.non_max_suppression_threshold),
+                SettingMetaString.create(
+                    'label_allow_list', 'Comma-separated labels to detect, ignoring the rest (empty for all)',
+                    ','.join(self._options.label_allow_list or [])),
+                SettingMetaString.create(
+                    'label_deny_list', 'Comma-separated labels to ignore (empty for none)',
+                    ','.join(self._options.label_deny_list or [])),
+            ]
+
+            def update_nms(value: str):
+                f = float(value)
+                if f < 0:
+                    f = None
+                self._options.non_max_suppression_threshold = f
+
+            def parse_labels(value: str) -> Optional[List[str]]:
+                labels = [label.strip() for label in value.split(',') if label.strip()]
+                return labels or None
+
+            def update_allow_list(value: str):
+                self._options.label_allow_list = parse_labels(value)
+                self._compile_class_mask()
+
+            def update_deny_list(value: str):
+                self._options.label_deny_list = parse_labels(value)
+                self._compile_class_mask()
+
+            if self._first_selection:
+                self._first_selection = False
+                settings[section_name][0].bind(section_name, on_change=update_nms)
+                settings[section_name][1].bind(section_name, on_change=update_allow_list)
+                settings[section_name][2].bind(section_name, on_change=update_deny_list)
+        else:
+            del settings[section_name]
+
+    def _fetch_model(self, callback: typing.Callable[[float], None]) -> str:
+        """Downloads the model if it's a remote URL, reporting progress in [0, 0.9].
+
+        :return: the local path to the model.
+        """
+        callback(0.01)
+        if self._model_path.startswith('http'):
+            model_path = download(url=self._model_path, progress=lambda p: callback(p * 0.9))
+        else:
+            model_path = self._model_path
+        callback(0.9)
+        return model_path
+
+    def _load_labels(self, model_path: str):
+        """Loads the label list from the metadata of the model, or from a sidecar text file with one label per line
+        (same path without extension, plus `.txt`), and builds the interned category table."""
+        labels_path = os.path.splitext(model_path)[0] + '.txt'
+        try:
+            with zipfile.ZipFile(model_path) as model_with_metadata:
+                if not model_with_metadata.namelist():
+                    raise ValueError('Invalid model: no label file found.')
+
+                file_name = model_with_metadata.namelist()[0]
+                with model_with_metadata.open(file_name) as label_file:
+                    label_list = label_file.read().splitlines()
+                    self._labels = [label.decode('ascii') for label in label_list]
+        except zipfile.BadZipFile:
+            if os.path.isfile(labels_path):
+                with open(labels_path, 'r') as label_file:
+                    self._labels = label_file.read().splitlines()
+            else:
+                Logger.warn('No metadata found in the model, using the provided label list or no labels.')
+                self._labels = self._labels or []
+
+        Logger.info("ModelDetector: model labels: %s" % self._labels)
+        self._categories = build_categories(self._labels)  # Interned, shared by all detections of this model
+        self._compile_class_mask()
+
+    def _compile_class_mask(self):
+        """Compiles the label allow/deny lists into a boolean mask over the class IDs of the model."""
+        allow_list, deny_list = self._options.label_allow_list, self._options.label_deny_list
+        if allow_list is None and deny_list is None:
+            self._class_mask = None  # No filtering
+            return
+        labels = np.array(self._labels + [''], dtype=str)  # The last element represents any unknown class
+        mask = np.ones(len(labels), dtype=bool)
+        if allow_list is not None:
+            mask &= np.isin(labels, allow_list)
+        if deny_list is not None:
+            mask &= ~np.isin(labels, deny_list)
+        self._class_mask = mask
+        Logger.info(f'ModelDetector: Detecting {np.count_nonzero(mask[:-1])}/{len(mask) - 1} classes')
+
+    def detect(self, img: np.ndarray, min_confidence: float = 0.5, max_results: int = -1) -> List[Detection]:
+        return self.detect_batch(img, min_confidence, max_results).to_list()
+
+    def detect_batch(self, img: np.ndarray, min_confidence: float = 0.5, max_results: int = -1) -> DetectionBatch:
+        if not self.is_loaded():
+            raise ValueError('The model is not loaded yet.')
+
+        # Prepare input tensor.
+        input_tensor, add_x, scale_x, add_y, scale_y = self._preprocess(img)
+
+        # Run inference.
+        start_time = time.perf_counter()
+        boxes, classes, scores, count = self._infer(input_tensor)
+        self._update_stats(time.perf_counter() - start_time)
+
+        # Postprocess detections and return the result.
+        return self._postprocess(boxes, classes, scores, count, min_confidence, max_results,
+                                 add_x, scale_x, add_y, scale_y)
+
+    @abc.abstractmethod
+    def _infer(self, input_tensor: np.ndarray) -> (np.ndarray, np.ndarray, np.ndarray, int):
+        """Runs the model on the preprocessed input (without batch dimension).
+
+        :return: the raw boxes, classes, scores and count (see `_decode_boxes`).
+        """
+        pass
+
+    def _update_stats(self, inference_time: float):
+        """Updates and reports the mean inference time of every 100 inferences, to compare backends."""
+        total, count = self._stats_inference_time[0] + inference_time, self._stats_inference_time[1] + 1
+        if count == 100:
+            mean = total / count
+            Logger.info('ModelDetector: %s: Avg inference time: %.3f (%.1f max FPS)' % (self.name, mean, 1 / mean))
+            total, count = 0.0, 0
+        self._stats_inference_time = (total, count)
+
+    def _preprocess(self, input_image: np.ndarray) -> (np.ndarray, float, float, float, float):
+        """Preprocess the input image as required by the model."""
+
+        # Resize the input (if needed)
+        added_x, scaled_x, added_y, scaled_y = 0, 1, 0, 1
+        if input_image.shape[:2] == self.input_size:
+            preprocessed = input_image
+        else:
+            preprocessed, added_x, scaled_x, added_y, scaled_y = resize_and_pad(
+                input_image, self.input_size[0], self.input_size[1])
+
+        if self._dtype == np.float32 and preprocessed.dtype == np.uint8:
+            preprocessed = (np.float32(preprocessed) - 127.5) / 127.5  # uint8 --> float32 [0, 1]
+        elif self._dtype == np.uint8 and preprocessed.dtype == np.float32:
+            preprocessed = (preprocessed * 127.5 + 127.5).astype(np.uint8)  # float32 [0, 1] --> uint8
+        elif self._dtype != preprocessed.dtype:
+            raise ValueError('The dtype of the input image is not supported by the model.')
+
+        return preprocessed, added_x, scaled_x, added_y, scaled_y
+
+    def _decode_boxes(self, boxes: np.ndarray) -> np.ndarray:
+        """Converts the raw boxes of the model to the (y_min, x_min, y_max, x_max) format.
+        Only the boxes that passed the score and class filters are decoded."""
+        return boxes
+
+    def _postprocess(self, boxes: np.ndarray, classes: np.ndarray, scores: np.ndarray, count: int,
+                     min_confidence: float, max_results: int,
+                     added_x: float, scaled_x: float, added_y: float, scaled_y: float) -> DetectionBatch:
+        """Post-process the output of the model into a batch of detections, without building Detection objects.
+
+        :param boxes: Bounding boxes of detected objects from the model.
+        :param classes: Class index of the detected objects from the model.
+        :param scores: Confidence scores of the detected objects from the model.
+        :param count: Number of detected objects from the model.
+        :param min_confidence: Minimum confidence score of the detected objects.
+        :param max_results: Maximum number of the detected objects.
+
+        :return A batch of detections found by the model.
+        """
+        # Keep only the confident detections of the allowed classes, before decoding any box
+        scores = scores[:count]
+        class_ids = classes[:count].astype(np.int32)
+        keep = scores >= min_confidence
+        class_mask = self._class_mask
+        if class_mask is not None:  # The last element of the mask is used for classes without a label
+            keep &= class_mask[np.where((class_ids >= 0) & (class_ids < len(class_mask) - 1), class_ids, -1)]
+        keep = np.flatnonzero(keep)
+        scores = scores[keep].astype(np.float32)
+        class_ids = class_ids[keep]
+        boxes = self._decode_boxes(boxes[:count][keep])
+
+        # Sort detection results by descending score (stable, like the previous sorted(..., reverse=True))
+        order = np.argsort(-scores, kind='stable')
+        scores, class_ids, boxes = scores[order], class_ids[order], boxes[order]
+
+        # Move the bounding boxes according to the padding and scaling, from (y_min, x_min, y_max, x_max)
+        xyxy = np.empty((len(boxes), 4), dtype=np.float32)
+        xyxy[:, 0] = (boxes[:, 1] - added_x) / scaled_x
+        xyxy[:, 1] = (boxes[:, 0] - added_y) / scaled_y
+        xyxy[:, 2] = (boxes[:, 3] - added_x) / scaled_x
+        xyxy[:, 3] = (boxes[:, 2] - added_y) / scaled_y
+
+        # Execute non-maximum suppression to remove overlapping bounding boxes, if enabled.
+        if self._options.non_max_suppression_threshold is not None and len(xyxy) > 0:
+            # Last element is prioritized in non-max suppression, so feed the boxes in reverse order
+            _, picked = non_max_suppression_fast(xyxy[::-1], self._options.non_max_suppression_threshold)
+            keep = np.sort(len(xyxy) - 1 - np.asarray(picked, dtype=np.intp))  # Back to descending confidence
+            scores, class_ids, xyxy = scores[keep], class_ids[keep], xyxy[keep]
+
+        # Only return maximum of max_results detection.
+        if max_results > 0:
+            scores, class_ids, xyxy = scores[:max_results], class_ids[:max_results], xyxy[:max_results]
+
+        return DetectionBatch(xyxy, scores, class_ids, self._categories)
+
+
+def yolo_v5_split_output(output_data: np.ndarray) -> (np.ndarray, np.ndarray, np.ndarray, int):
+    """Splits the single output of a YoloV5 model into raw boxes, classes, scores and count.
+
+    :param output_data: the output without batch dimension, with shape [N, 5 + classes].
+    """
+    xywh = output_data[..., :4]  # boxes  [25200, 4]
+    conf = np.ravel(output_data[..., 4:5])  # confidences  [25200]
+    cls = np.argmax(output_data[..., 5:], axis=1)  # [25200]
+    return xywh, cls, conf, xywh.shape[0]
+
+
+def yolo_v5_decode_boxes(boxes: np.ndarray) -> np.ndarray:
+    """Decodes the raw boxes of a YoloV5 model, see `ModelDetector._decode_boxes`."""
+    # Convert nx4 boxes from [x, y, w, h] to [x1, y1, x2, y2] where xy1=top-left, xy2=bottom-right
+    x, y, w, h = boxes[..., 0], boxes[..., 1], boxes[..., 2], boxes[..., 3]  # xywh
+    return np.column_stack([y - h / 2, x - w / 2, y + h / 2, x + w / 2])  # xywh to xyxy   [n, 4]
+
+
+# Malisiewicz et al.
+def non_max_suppression_fast(boxes: np.ndarray, overlapThresh: float) -> (np.ndarray, np.ndarray):
+    # if there are no boxes, return an empty list
+    if len(boxes) == 0:
+        return np.array([]), np.array([])
+    # if the bounding boxes integers, convert them to floats --
+    # this is important since we'll be doing a bunch of divisions
+    if boxes.dtype.kind == "i":
+        boxes = boxes.astype("float")
+    # initialize the list of picked indexes
+    pick = []
+    # grab the coordinates of the bounding boxes
+    x1 = boxes[:, 0]
+    y1 = boxes[:, 1]
+    x2 = boxes[:, 2]
+    y2 = boxes[:, 3]
+    # compute the area of the bounding boxes and sort the bounding
+    # boxes by the bottom-right y-coordinate of the bounding box
+    area = (x2 - x1 + 1) * (y2 - y1 + 1)
+    idxs = np.argsort(y2)
+    # keep looping while some indexes still remain in the indexes
+    # list
+    while len(idxs) > 0:
+        # grab the last index in the indexes list and add the
+        # index value to the list of picked indexes
+        last = len(idxs) - 1
+        i = idxs[last]
+        pick.append(i)
+        # find the largest (x, y) coordinates for the start of
+        # the bounding box and the smallest (x, y) coordinates
+        # for the end of the bounding box
+        xx1 = np.maximum(x1[i], x1[idxs[:last]])
+        yy1 = np.maximum(y1[i], y1[idxs[:last]])
+        xx2 = np.minimum(x2[i], x2[idxs[:last]])
+        yy2 = np.minimum(y2[i], y2[idxs[:last]])
+        # compute the width and height of the bounding box
+        w = np.maximum(0, xx2 - xx1 + 1)
+        h = np.maximum(0, yy2 - yy1 + 1)
+        # compute the ratio of overlap
+        overlap = (w * h) / area[idxs[:last]]
+        # delete all indexes from the index list that have
+        idxs = np.delete(idxs, np.concatenate(([last], np.where(overlap > overlapThresh)[0])))
+    # return only the bounding boxes that were picked using the
+    # integer data type
+    return boxes[pick], pick
@@ -0,0 +1,206 @@
+"""A module to run object detection with the OpenCV DNN module, which does not require TensorFlow at all.
+
+It loads ONNX exports of the same models used by the TFLite detectors, for example converted with
+`python -m tf2onnx.convert --tflite <model>.tflite --output <model>.onnx`. As ONNX models do not include the labels,
+they are read from a `<model>.txt` file next to the model, with one label per line. The dtype of the input is read
+from the model, and its outputs are matched by name (see `OpenCVDetector.__init__`), as the DNN module exposes neither.
+"""
+import abc
+import os
+import typing
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+from kivy import Logger
+
+from autopilot.tracking.detector.model import ModelDetector, ModelDetectorOptions, yolo_v5_split_output, \
+    yolo_v5_decode_boxes
+from util.filesystem import cache
+
+_ONNX_DTYPES: Dict[int, typing.Any] = {1: np.float32, 2: np.uint8, 3: np.int8, 10: np.float16}
+"""The numpy dtypes of the supported `onnx.TensorProto.DataType` values."""
+
+
+def _protobuf_varint(data: bytes, pos: int) -> (int, int):
+    value, shift = 0, 0
+    while True:
+        byte = data[pos]
+        value |= (byte & 0x7F) << shift
+        pos, shift = pos + 1, shift + 7
+        if byte < 0x80:
+            return value, pos
+
+
+def _protobuf_fields(data: bytes, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, typing.Any]]:
+    """Yields the (field number, value) of a serialized protobuf message, where each length-delimited value is the
+    (start, end) range of its bytes, so that nested messages are parsed lazily and large tensors are skipped."""
+    pos, end = start, len(data) if end is None else end
+    while pos < end:
+        key, pos = _protobuf_varint(data, pos)
+        wire_type = key & 0x7
+        if wire_type == 0:
+            value, pos = _protobuf_varint(data, pos)
+        elif wire_type == 2:
+            length, pos = _protobuf_varint(data, pos)
+            value, pos = (pos, pos + length), pos + length
+        elif wire_type in (1, 5):
+            value, pos = None, pos + (8 if wire_type == 1 else 4)
+        else:
+            raise ValueError('Unsupported protobuf wire type %d' % wire_type)
+        yield key >> 3, value
+
+
+def onnx_input_dtype(model_path: str) -> Optional[typing.Any]:
+    """Reads the dtype of the (first) input of an ONNX model, without requiring the `onnx` package.
+
+    :param model_path: the path to the ONNX model.
+    :return: the numpy dtype, or None if it is not supported (see `_ONNX_DTYPES`).
+    """
+    with open(model_path, 'rb') as f:
+        data = f.read()
+    graph = next(value for number, value in _protobuf_fields(data) if number == 7)  # ModelProto.graph
+    initializers, inputs = set(), []
+    for number, value in _protobuf_fields(data, *graph):
+        if number == 5:  # GraphProto.initializer, listed as inputs by old exporters
+            initializers.update(data[v[0]:v[1]] for n, v in _protobuf_fields(data, *value) if n == 8)
+        elif number == 11:  # GraphProto.input
+            inputs.append(value)
+    for value_info in inputs:
+        fields = dict(_protobuf_fields(data, *value_info))  # ValueInfoProto: name, type
+        if data[fields[1][0]:fields[1][1]] in initializers:
+            continue
+        tensor_type = dict(_protobuf_fields(data, *fields[2]))[1]  # TypeProto.tensor_type
+        return _ONNX_DTYPES.get(dict(_protobuf_fields(data, *tensor_type)).get(1))  # TypeProto.Tensor.elem_type
+    return None
+
+
+class OpenCVDetector(ModelDetector):
+    """A wrapper class for an ONNX object detection model, run by the OpenCV DNN module."""
+
+    def __init__(self, model_path: str, input_size: (int, int), dtype: typing.Any = np.float32,
+                 channels_first: bool = False, output_names: Optional[Sequence[str]] = None,
+                 labels: List[str] = None, options: ModelDetectorOptions = ModelDetectorOptions()) -> None:
+        """Initialize an ONNX object detection model.
+
+        :param model_path: Path or URL to the ONNX model.
+        :param input_size: The (width, height) of the input of the model, as OpenCV can't read it from the model.
+        :param dtype: The data type of the input, if it can't be read from the model.
+        :param channels_first: Whether the model expects NCHW inputs (e.g. native PyTorch exports) instead of NHWC.
+        :param output_names: The names of the outputs, in the order expected by `_split_outputs`, or None if the
+            model has a single output.
+        :param labels: List of labels for the model. They will be automatically retrieved from `<model>.txt`.
+        :param options: The config to initialize an object detector.
+        """
+        super().__init__(model_path, labels, options)
+        self._net: Optional[cv2.dnn.Net] = None
+        self._output_names: List[str] = list(output_names or [])
+        self._model_input_size = input_size
+        self._model_dtype = dtype
+        self._channels_first = channels_first
+
+    def is_available(self) -> bool:
+        """Whether the model can be loaded: it is a remote URL or it exists locally (they are not bundled)."""
+        return self._model_path.startswith('http') or os.path.isfile(self._model_path)
+
+    def load(self, callback: typing.Callable[[float], None] = None):
+        # Load the model
+        Logger.info(f'OpenCVDetector: Loading model from {self._model_path}')
+        callback = callback or (lambda x: None)
+
+        # Download the model if it's a remote URL.
+        _model_path = self._fetch_model(callback)
+        if not os.path.isfile(_model_path):
+            raise FileNotFoundError(f'ONNX model not found at {_model_path}, see {__name__} to export it.')
+
+        # Load label list from the sidecar file.
+        self._load_labels(_model_path)
+
+        # Initialize the OpenCV DNN model.
+        cv2.setNumThreads(self._options.num_threads)
+        self._net = cv2.dnn.readNetFromONNX(_model_path)
+        self._net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self._net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        available_outputs = list(self._net.getUnconnectedOutLayersNames())
+        Logger.info("OpenCVDetector: Model outputs: %s" % available_outputs)
+        if not self._output_names and len(available_outputs) == 1:
+            self._output_names = available_outputs
+        missing_outputs = [name for name in self._output_names if name not in available_outputs]
+        if not self._output_names or missing_outputs:
+            raise ValueError('ONNX model %s: expected outputs %s, but it has %s' % (
+                _model_path, self._output_names or 'a single one', available_outputs))
+
+        model_dtype = onnx_input_dtype(_model_path)
+        if model_dtype is None:
+            Logger.warning('OpenCVDetector: Unsupported input dtype, assuming %s' % self._model_dtype)
+        self.input_size, self._dtype = self._model_input_size, model_dtype or self._model_dtype
+        Logger.info('OpenCVDetector: Input size: %s, dtype: %s' % (str(self.input_size), self._dtype))
+        super().load(callback)
+
+    def unload(self):
+        self._net = None
+        super().unload()
+
+    def _infer(self, input_tensor: np.ndarray) -> (np.ndarray, np.ndarray, np.ndarray, int):
+        blob = np.expand_dims(input_tensor, axis=0)  # Add batch dimension
+        if self._channels_first:
+            blob = blob.transpose((0, 3, 1, 2))
+        self._net.setInput(np.ascontiguousarray(blob))  # Already in the dtype of the model, see `_preprocess`
+        outputs = self._net.forward(self._output_names)
+        return self._split_outputs([np.squeeze(output) for output in outputs])  # Remove batch dimension
+
+    @abc.abstractmethod
+    def _split_outputs(self, outputs: List[np.ndarray]) -> (np.ndarray, np.ndarray, np.ndarray, int):
+        """Returns the raw boxes, classes, scores and count (see `_decode_boxes`) from the outputs of the model."""
+        pass
+
+
+class OpenCVEfficientDetLiteDetector(OpenCVDetector):
+    """An OpenCV DNN detector for ONNX exports of the EfficientDet-Lite models."""
+
+    _input_sizes = {'0': 320, '1': 384, '2': 448, '3': 512, '3x': 640, '4': 640}
+    # As named by tf2onnx: boxes, classes, scores, count
+    _tf2onnx_output_names = ['StatefulPartitionedCall:3', 'StatefulPartitionedCall:2', 'StatefulPartitionedCall:1',
+                             'StatefulPartitionedCall:0']
+
+    def __init__(self, model_path: str = None, options=ModelDetectorOptions(), model_override: int = 0):
+        model_id = str(model_override) if model_override >= 0 else "3x"
+        if model_path is None:  # Default to the export of the TFHub model, that must be placed in the cache
+            model_path = cache(f'efficientdet-lite{model_id}.onnx')
+            self._display_name = f"EfficientDet-Lite{model_id} (OpenCV)"
+        else:
+            self._display_name = "EfficientDet-Lite (OpenCV, %s)" % model_path
+        size = self._input_sizes[model_id]
+        super().__init__(model_path, (size, size), np.uint8, False, self._tf2onnx_output_names, None,
+                         options)
+
+    @property
+    def name(self) -> str:
+        return self._display_name
+
+    def _split_outputs(self, outputs: List[np.ndarray]) -> (np.ndarray, np.ndarray, np.ndarray, int):
+        boxes, classes, scores, count = outputs
+        return boxes, classes, scores, int(count)
+
+
+class OpenCVYoloV5Detector(OpenCVDetector):
+    """An OpenCV DNN detector for ONNX exports of the YoloV5 models."""
+
+    def __init__(self, model_path: str = None, options=ModelDetectorOptions(), input_size: int = 640,
+                 channels_first: bool = False):
+        if model_path is None:  # Default to the export of the TFHub model, that must be placed in the cache
+            model_path = cache('yolo-v5.onnx')
+            self._display_name = "YoloV5 (OpenCV)"
+        else:
+            self._display_name = "YoloV5 (OpenCV, %s)" % model_path
+        super().__init__(model_path, (input_size, input_size), np.float32, channels_first, None, None, options)
+
+    @property
+    def name(self) -> str:
+        return self._display_name
+
+    def _split_outputs(self, outputs: List[np.ndarray]) -> (np.ndarray, np.ndarray, np.ndarray, int):
+        return yolo_v5_split_output(outputs[0])
+
+    def _decode_boxes(self, boxes: np.ndarray) -> np.ndarray:
+        return yolo_v5_decode_boxes(boxes)
@@ -1,10 +1,17 @@
 from typing import List
 
 from autopilot.tracking.detector.api import Detector
+from autopilot.tracking.detector.opencv import OpenCVEfficientDetLiteDetector, OpenCVYoloV5Detector
 from autopilot.tracking.detector.tflite import TFLiteEfficientDetLiteDetector, TFLiteYoloV5Detector
 
 
 def build_registry() -> List[Detector]:
+    opencv_detectors = [
+        OpenCVEfficientDetLiteDetector(model_override=0),
+        OpenCVEfficientDetLiteDetector(model_override=2),
+        OpenCVEfficientDetLiteDetector(model_override=4),
+        OpenCVYoloV5Detector(),
+    ]
     return [
         TFLiteEfficientDetLiteDetector(tfhub_model_override=0),
         TFLiteEfficientDetLiteDetector(tfhub_model_override=1),
@@ -13,5 +20,7 @@ def build_registry() -> List[Detector]:
         TFLiteEfficientDetLiteDetector(tfhub_model_override=-1),  # 3x
         TFLiteEfficientDetLiteDetector(tfhub_model_override=4),
         TFLiteYoloV5Detector(),
+        # OpenCV DNN backend (no TensorFlow required), running ONNX exports of the same models (if placed in the cache)
+        *[detector for detector in opencv_detectors if detector.is_available()],
         # TODO: Implement more detectors (https://tfhub.dev/s?deployment-format=lite&module-type=image-object-detection)
     ]
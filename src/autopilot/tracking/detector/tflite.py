@@ -19,62 +19,86 @@
 
 """A module to run object detection with a TensorFlow Lite model."""
 import abc
-import multiprocessing
+import threading
+import time
 import typing
-import zipfile
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
-import cv2
 import numpy as np
 from kivy import Logger
 from kivy.utils import platform
 
-from app.settings.manager import SettingsManager
-from app.settings.settings import SettingMetaNumeric
-from autopilot.tracking.detector.api import Detector, Detection, Category, Rect
-from util.filesystem import download
+from autopilot.tracking.detector.model import ModelDetector, ModelDetectorOptions, yolo_v5_split_output, \
+    yolo_v5_decode_boxes
+
+
+TF_LITE_RUNTIMES = ['tflite_runtime', 'tensorflow']
+"""The supported TensorFlow Lite implementations, the first one being the default (much faster to import)."""
+
+_tf_lite_runtime = TF_LITE_RUNTIMES[0]
+_tf_lite_loaded: Dict[str, Tuple[typing.Any, typing.Any]] = {}
+_tf_lite_lock = threading.Lock()
+
+
+def set_tf_lite_runtime(runtime: str, preload: bool = True):
+    """Selects the TensorFlow Lite implementation to use (see `TF_LITE_RUNTIMES`).
+
+    :param runtime: the name of the package that provides the implementation.
+    :param preload: import it on a background thread, so that the first model load does not wait for it.
+    """
+    global _tf_lite_runtime
+    _tf_lite_runtime = runtime
+    if preload:
+        threading.Thread(target=load_tf_lite, name='TFLitePreload', daemon=True).start()
 
 
 def load_tf_lite():
-    """Loads the TensorFlow Lite library. This is implemented as a function to avoid slowing down startup."""
-    try:
-        # Try to import the TFLite interpreter from the tensorflow package first (GPU support!)
+    """Loads the TensorFlow Lite library. This is implemented as a function to avoid slowing down startup.
+
+    The runtime selected by `set_tf_lite_runtime` is tried first, falling back to the other ones if not installed.
+    Only the first call actually imports it (which may take several seconds for tensorflow), later calls wait for it.
+    """
+    with _tf_lite_lock:
+        for runtime in [_tf_lite_runtime] + [r for r in TF_LITE_RUNTIMES if r != _tf_lite_runtime]:
+            if runtime in _tf_lite_loaded:
+                return _tf_lite_loaded[runtime]
+            start_time = time.perf_counter()
+            try:
+                _tf_lite_loaded[runtime] = _import_tf_lite(runtime)
+            except ImportError as e:
+                Logger.warning(f'TFLite: {runtime} is not available ({e})')
+                continue
+            Logger.info(f'TFLite: Imported {runtime} in {time.perf_counter() - start_time:.3f}s')
+            return _tf_lite_loaded[runtime]
+        raise ImportError(f'No TensorFlow Lite implementation is available (tried {TF_LITE_RUNTIMES})')
+
+
+def _import_tf_lite(runtime: str) -> (typing.Any, typing.Any):
+    """Imports the Interpreter and load_delegate of the given TensorFlow Lite implementation."""
+    if runtime == 'tensorflow':
+        # The full tensorflow package may have GPU support, but it is really slow to import
         import tensorflow as tf
-        Logger.info("Using tensorflow implementation with devices: %s" % tf.config.list_physical_devices())
+        Logger.debug("Using tensorflow implementation with devices: %s" % tf.config.list_physical_devices())
         # NOTE: importing these classes directly instead of through tf seems to disable optimizations (why?!)
-        Interpreter = tf.lite.Interpreter
-        load_delegate = tf.lite.experimental.load_delegate
-    except ImportError:
-        # Otherwise, import the TFLite interpreter from tflite_runtime package that should be available.
+        return tf.lite.Interpreter, tf.lite.experimental.load_delegate
+    elif runtime == 'tflite_runtime':
         from tflite_runtime.interpreter import Interpreter
         from tflite_runtime.interpreter import load_delegate
-
-    return Interpreter, load_delegate
+        return Interpreter, load_delegate
+    raise ValueError(f'Unknown TensorFlow Lite implementation: {runtime}')
 
 
 # pylint: enable=g-import-not-at-top
 
 
 @dataclass
-class TFLiteDetectorOptions:
-    """A config to initialize an object detector."""
+class TFLiteDetectorOptions(ModelDetectorOptions):
+    """A config to initialize a TFLite object detector."""
 
     enable_edgetpu: bool = False
     """Enable the model to run on EdgeTPU."""
 
-    label_allow_list: List[str] = None
-    """The optional allow list of labels."""
-
-    label_deny_list: List[str] = None
-    """The optional deny list of labels."""
-
-    num_threads: int = min(4, multiprocessing.cpu_count())  # 4 usually works better than more
-    """The number of CPU threads to be used."""
-
-    non_max_suppression_threshold: Optional[float] = 0.95
-    """The threshold for non-max suppression (removing duplicate detections)."""
-
 
 def libedgetpu_name():
     """Returns the library name of EdgeTPU in the current platform."""
@@ -85,28 +109,7 @@ def libedgetpu_name():
     }.get(platform.system(), None)
 
 
-def resize_and_pad(img: np.ndarray, w: int, h: int) -> (np.ndarray, float, float, float, float):
-    """
-    Resize and pad (with gray) an image to a target size.
-    """
-    img_h, img_w = img.shape[:2]
-    scale = min(w / img_w, h / img_h)
-    resized = cv2.resize(img, (int(img_w * scale), int(img_h * scale)))
-    padded = np.full((h, w, 3), 128, dtype=np.uint8)
-    padded[:resized.shape[0], :resized.shape[1]] = resized
-    added_x, scaled_x, added_y, scaled_y = 0, 1, 0, 1  # Used to scale the bounding box back to the original image
-    if img_w > img_h:
-        scaled_y = scale / (h / img_h)
-        # added_y = (1 - scaled_y) / 2  # Actually, the padded image is not centered, so we don't need this
-    elif img_w < img_h:
-        scaled_x = scale / (w / img_w)
-        # added_x = (1 - scaled_x) / 2  # Actually, the padded image is not centered, so we don't need this
-    # Logger.info(f"resize_and_pad: {img_w}x{img_h} -> {resized.shape[1]}x{resized.shape[0]} -> {w}x{h}")
-    # Logger.info(f"resize_and_pad: added_x={added_x}, scaled_x={scaled_x}, added_y={added_y}, scaled_y={scaled_y}")
-    return padded, added_x, scaled_x, added_y, scaled_y
-
-
-class TFLiteDetector(Detector):
+class TFLiteDetector(ModelDetector):
     """A wrapper class for a TFLite object detection model."""
 
     def __init__(self, model_path: str, labels: List[str] = None,
@@ -117,39 +120,11 @@ class TFLiteDetector(Detector):
         :param labels: List of labels for the model. They will be automatically retrieved from the model if available.
         :param options: The config to initialize an object detector.
         """
-        self._model_path = model_path
-        self._labels = labels or []
-        self._options = options
+        super().__init__(model_path, labels, options)
         self._interpreter: Optional['Interpreter'] = None
-        self.input_size = (0, 0)
-        self._dtype: Optional[any] = None
-        self._first_selection: bool = True
-
-    def selected(self, selected: bool):
-        # Settings
-        settings = SettingsManager.instance()
-        section_name = f'Detector-{self.name}'
-        if selected:
-            settings[section_name] = [SettingMetaNumeric.create(
-                'non_max_suppression_threshold', 'Non-max suppression threshold (-1 to disable)',
-                self._options.non_max_suppression_threshold)]
-
-            def update_nms(value: str):
-                f = float(value)
-                if f < 0:
-                    f = None
-                self._options.non_max_suppression_threshold = f
-
-            if self._first_selection:
-                self._first_selection = False
-                settings[section_name][0].bind(section_name, on_change=update_nms)
-        else:
-            del settings[section_name]
 
     def __del__(self):
         Logger.info(f"TFLiteDetector: Destroying {self.name} detector")
-        settings = SettingsManager.instance()
-        section_name = f'Detector-{self.name}'
 
     def load(self, callback: typing.Callable[[float], None] = None):
         # Load the model
@@ -159,28 +134,10 @@ class TFLiteDetector(Detector):
         Interpreter, load_delegate = load_tf_lite()
 
         # Download the model if it's a remote URL.
-        callback(0.01)
-        if self._model_path.startswith('http'):
-            _model_path = download(url=self._model_path, progress=lambda p: callback(p * 0.9))
-        else:
-            _model_path = self._model_path
-        callback(0.9)
+        _model_path = self._fetch_model(callback)
 
         # Load label list from metadata.
-        try:
-            with zipfile.ZipFile(_model_path) as model_with_metadata:
-                if not model_with_metadata.namelist():
-                    raise ValueError('Invalid TFLite model: no label file found.')
-
-                file_name = model_with_metadata.namelist()[0]
-                with model_with_metadata.open(file_name) as label_file:
-                    label_list = label_file.read().splitlines()
-                    self._labels = [label.decode('ascii') for label in label_list]
-        except zipfile.BadZipFile:
-            Logger.warn('No metadata found in the model, using the provided label list or no labels.')
-            self._labels = self._labels or []
-
-        Logger.info("TFLiteDetector: model labels: %s" % self._labels)
+        self._load_labels(_model_path)
 
         # Initialize TFLite model.
         if self._options.enable_edgetpu:
@@ -204,43 +161,10 @@ class TFLiteDetector(Detector):
         input_detail = interpreter.get_input_details()[0]
         return (input_detail['shape'][2], input_detail['shape'][1]), input_detail['dtype']
 
-    def detect(self, img: np.ndarray, min_confidence: float = 0.5, max_results: int = -1) -> List[Detection]:
-        if self._interpreter is None:
-            raise ValueError('The model is not loaded yet.')
-
-        # Prepare input tensor.
-        input_tensor, add_x, scale_x, add_y, scale_y = self._preprocess(img)
+    def _infer(self, input_tensor: np.ndarray) -> (np.ndarray, np.ndarray, np.ndarray, int):
         self._set_input_tensor(input_tensor)
-
-        # Run inference.
         self._interpreter.invoke()
-
-        # Get all output details
-        boxes, classes, scores, count = self._get_output_tensors()
-
-        # Postprocess detections and return the result.
-        return self._postprocess(boxes, classes, scores, count, min_confidence, max_results,
-                                 add_x, scale_x, add_y, scale_y)
-
-    def _preprocess(self, input_image: np.ndarray) -> (np.ndarray, float, float, float, float):
-        """Preprocess the input image as required by the TFLite model."""
-
-        # Resize the input (if needed)
-        added_x, scaled_x, added_y, scaled_y = 0, 1, 0, 1
-        if input_image.shape[:2] == self.input_size:
-            preprocessed = input_image
-        else:
-            preprocessed, added_x, scaled_x, added_y, scaled_y = resize_and_pad(
-                input_image, self.input_size[0], self.input_size[1])
-
-        if self._dtype == np.float32 and preprocessed.dtype == np.uint8:
-            preprocessed = (np.float32(preprocessed) - 127.5) / 127.5  # uint8 --> float32 [0, 1]
-        elif self._dtype == np.uint8 and preprocessed.dtype == np.float32:
-            preprocessed = (preprocessed * 127.5 + 127.5).astype(np.uint8)  # float32 [0, 1] --> uint8
-        elif self._dtype != preprocessed.dtype:
-            raise ValueError('The dtype of the input image is not supported by the model.')
-
-        return preprocessed, added_x, scaled_x, added_y, scaled_y
+        return self._get_output_tensors()
 
     def _set_input_tensor(self, image):
         """Sets the input tensor."""
@@ -259,74 +183,9 @@ class TFLiteDetector(Detector):
 
     @abc.abstractmethod
     def _get_output_tensors(self) -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray):
-        """Returns the output tensors."""
+        """Returns the output tensors: the raw boxes, classes, scores and count (see `_decode_boxes`)."""
         pass
 
-    def _postprocess(self, boxes: np.ndarray, classes: np.ndarray, scores: np.ndarray, count: int,
-                     min_confidence: float, max_results: int,
-                     added_x: float, scaled_x: float, added_y: float, scaled_y: float) -> List[Detection]:
-        """Post-process the output of TFLite model into a list of Detection objects.
-
-        :param boxes: Bounding boxes of detected objects from the TFLite model.
-        :param classes: Class index of the detected objects from the TFLite model.
-        :param scores: Confidence scores of the detected objects from the TFLite model.
-        :param count: Number of detected objects from the TFLite model.
-        :param min_confidence: Minimum confidence score of the detected objects.
-        :param max_results: Maximum number of the detected objects.
-
-        :return A list of Detection objects detected by the TFLite model.
-        """
-        results = []
-
-        # Parse the model output into a list of Detection entities.
-        for i in range(count):
-            if scores[i] >= min_confidence:
-                y_min, x_min, y_max, x_max = boxes[i]
-                # Move the bounding box according to the padding and scaling.
-                x_min = ((x_min - added_x) / scaled_x)
-                x_max = ((x_max - added_x) / scaled_x)
-                y_min = ((y_min - added_y) / scaled_y)
-                y_max = ((y_max - added_y) / scaled_y)
-                # Append to the temporary results list.
-                bounding_box = Rect(x_min=x_min, y_min=y_min, x_max=x_max, y_max=y_max)
-                category_id = int(classes[i])
-                category_label = self._labels[category_id] if 0 <= category_id < len(self._labels) else ""
-                category = Category(label=category_label, id=category_id)
-                result = Detection(bounding_box=bounding_box, confidence=scores[i], category=category)
-                results.append(result)
-
-        # Sort detection results by score ascending
-        sorted_results = sorted(results, key=lambda detection: detection.confidence, reverse=True)
-
-        # Filter out detections in deny list
-        filtered_results = sorted_results
-        if self._options.label_deny_list is not None:
-            filtered_results = list(filter(
-                lambda detection: detection.categories[0].label not in self._options.label_deny_list, filtered_results))
-
-        # Keep only detections in allow list
-        if self._options.label_allow_list is not None:
-            filtered_results = list(filter(
-                lambda detection: detection.categories[0].label in self._options.label_allow_list, filtered_results))
-
-        # Execute non-maximum suppression to remove overlapping bounding boxes, if enabled.
-        if self._options.non_max_suppression_threshold is not None:
-            boxes_to_filter = np.ndarray(shape=(0, 4), dtype=np.float32)
-            for result in reversed(filtered_results):  # Last element is prioritized in non-max suppression
-                bb = result.bounding_box
-                boxes_to_filter = np.append(boxes_to_filter,
-                                            np.array([bb.x_min, bb.y_min, bb.x_max, bb.y_max]).reshape((1, 4)), axis=0)
-            _, picked = non_max_suppression_fast(boxes_to_filter, self._options.non_max_suppression_threshold)
-            tmp = [filtered_results[len(boxes_to_filter) - 1 - i] for i in picked]  # reversed
-            filtered_results = tmp
-
-        # Only return maximum of max_results detection.
-        if max_results > 0:
-            result_count = min(len(filtered_results), max_results)
-            filtered_results = filtered_results[:result_count]
-
-        return filtered_results
-
 
 class TFLiteEfficientDetLiteDetector(TFLiteDetector):
     """A TFLite detector for EfficientDet models."""
@@ -390,58 +249,7 @@ class TFLiteYoloV5Detector(TFLiteDetector):
         return super()._on_load_model(interpreter)
 
     def _get_output_tensors(self) -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray):
-        output_data = self._get_output_tensor(self._output_identity)
-        xywh = output_data[..., :4]  # boxes  [25200, 4]
-        conf = np.ravel(output_data[..., 4:5])  # confidences  [25200]
-        cls = np.argmax(output_data[..., 5:], axis=1).astype(np.float32)  # [25200]
-        # Convert nx4 boxes from [x, y, w, h] to [x1, y1, x2, y2] where xy1=top-left, xy2=bottom-right
-        x, y, w, h = xywh[..., 0], xywh[..., 1], xywh[..., 2], xywh[..., 3]  # xywh
-        yxyx = np.column_stack([y - h / 2, x - w / 2, y + h / 2, x + w / 2])  # xywh to xyxy   [25200, 4]`
-        return yxyx, cls, conf, yxyx.shape[0]
-
-
-# Malisiewicz et al.
-def non_max_suppression_fast(boxes: np.ndarray, overlapThresh: float) -> (np.ndarray, np.ndarray):
-    # if there are no boxes, return an empty list
-    if len(boxes) == 0:
-        return np.array([]), np.array([])
-    # if the bounding boxes integers, convert them to floats --
-    # this is important since we'll be doing a bunch of divisions
-    if boxes.dtype.kind == "i":
-        boxes = boxes.astype("float")
-    # initialize the list of picked indexes
-    pick = []
-    # grab the coordinates of the bounding boxes
-    x1 = boxes[:, 0]
-    y1 = boxes[:, 1]
-    x2 = boxes[:, 2]
-    y2 = boxes[:, 3]
-    # compute the area of the bounding boxes and sort the bounding
-    # boxes by the bottom-right y-coordinate of the bounding box
-    area = (x2 - x1 + 1) * (y2 - y1 + 1)
-    idxs = np.argsort(y2)
-    # keep looping while some indexes still remain in the indexes
-    # list
-    while len(idxs) > 0:
-        # grab the last index in the indexes list and add the
-        # index value to the list of picked indexes
-        last = len(idxs) - 1
-        i = idxs[last]
-        pick.append(i)
-        # find the largest (x, y) coordinates for the start of
-        # the bounding box and the smallest (x, y) coordinates
-        # for the end of the bounding box
-        xx1 = np.maximum(x1[i], x1[idxs[:last]])
-        yy1 = np.maximum(y1[i], y1[idxs[:last]])
-        xx2 = np.minimum(x2[i], x2[idxs[:last]])
-        yy2 = np.minimum(y2[i], y2[idxs[:last]])
-        # compute the width and height of the bounding box
-        w = np.maximum(0, xx2 - xx1 + 1)
-        h = np.maximum(0, yy2 - yy1 + 1)
-        # compute the ratio of overlap
-        overlap = (w * h) / area[idxs[:last]]
-        # delete all indexes from the index list that have
-        idxs = np.delete(idxs, np.concatenate(([last], np.where(overlap > overlapThresh)[0])))
-    # return only the bounding boxes that were picked using the
-    # integer data type
-    return boxes[pick], pick
+        return yolo_v5_split_output(self._get_output_tensor(self._output_identity))
+
+    def _decode_boxes(self, boxes: np.ndarray) -> np.ndarray:
+        return yolo_v5_decode_boxes(boxes)
@@ -0,0 +1,135 @@
+"""Temporal smoothing of the detections of a tracker, to stabilize them across frames."""
+
+from typing import Optional, List, Dict
+
+import numpy as np
+
+from autopilot.tracking.detector.api import Detection, DetectionBatch, Category
+
+
+class DetectionSmoother:
+    """Smooths the raw detections of each frame, following each object with a track ID.
+
+    Detections are associated to the previous tracks by category and intersection over union, and their bounding
+    boxes and confidences are exponentially smoothed (vectorized over all tracks). A track only appears once its
+    smoothed confidence reaches `appear_confidence`, and only disappears once it drops below `disappear_confidence`,
+    so that missed detections or lower detector duty cycles do not make the output flicker.
+    """
+
+    def __init__(self, smoothing: float = 0.5, appear_confidence: float = 0.5, disappear_confidence: float = 0.25,
+                 min_iou: float = 0.3):
+        """
+        :param smoothing: the weight of the previous state in [0, 1). 0 means no smoothing.
+        :param appear_confidence: the minimum smoothed confidence for a new track to be reported.
+        :param disappear_confidence: the smoothed confidence below which a reported track is hidden.
+            Raw detections should be requested with this minimum confidence.
+        :param min_iou: the minimum intersection over union to match a detection with a previous track.
+        """
+        self.smoothing = smoothing
+        self.appear_confidence = appear_confidence
+        self.disappear_confidence = disappear_confidence
+        self.min_iou = min_iou
+        self.reset()
+
+    def reset(self):
+        """Forgets all tracks, for example when the video source changes."""
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._boxes = np.zeros((0, 4), dtype=np.float32)
+        self._confidences = np.zeros(0, dtype=np.float32)
+        self._category_ids = np.zeros(0, dtype=np.int32)
+        self._visible = np.zeros(0, dtype=bool)
+        self._categories: Dict[int, Category] = {}
+        self._next_id = 0
+        self._tracked_id: Optional[int] = None
+
+    def update(self, detection: Optional[Detection], all_detections: List[Detection]) -> (
+            Optional[Detection], List[Detection]):
+        """Feeds the raw results of a frame and returns the smoothed ones, in the same format as `Tracker.track`.
+
+        :param detection: the tracked object, which must be one of `all_detections`, or None.
+        :param all_detections: the raw detections of the frame.
+        :return: the smoothed tracked object (or None) and all the visible smoothed detections.
+        """
+        batch = DetectionBatch.from_list(all_detections)
+        for d in all_detections:
+            self._categories.setdefault(d.category.id, d.category)
+        tracked_index = next((i for i, d in enumerate(all_detections) if d is detection), None)
+
+        # Associate the new detections with the previous tracks
+        track_of = self._associate(batch)
+        matched_d = np.flatnonzero(track_of >= 0)
+        matched_t = track_of[matched_d]
+
+        # Exponentially smooth all tracks: unmatched ones decay towards zero confidence
+        s = self.smoothing
+        self._confidences *= s
+        self._confidences[matched_t] += (1 - s) * batch.confidences[matched_d]
+        self._boxes[matched_t] = s * self._boxes[matched_t] + (1 - s) * batch.boxes[matched_d]
+
+        # Start new (not yet visible) tracks for the unmatched detections
+        new_d = np.flatnonzero(track_of < 0)
+        new_ids = np.arange(self._next_id, self._next_id + len(new_d), dtype=np.int64)
+        self._next_id += len(new_d)
+        self._ids = np.concatenate((self._ids, new_ids))
+        self._boxes = np.concatenate((self._boxes, batch.boxes[new_d]))
+        self._confidences = np.concatenate((self._confidences, (1 - s) * batch.confidences[new_d]))
+        self._category_ids = np.concatenate((self._category_ids, batch.category_ids[new_d]))
+        self._visible = np.concatenate((self._visible, np.zeros(len(new_d), dtype=bool)))
+        if tracked_index is not None:
+            is_new = track_of[tracked_index] < 0
+            self._tracked_id = int(new_ids[np.searchsorted(new_d, tracked_index)] if is_new
+                                   else self._ids[track_of[tracked_index]])
+
+        # Confidence hysteresis and removal of forgotten tracks
+        self._visible = (self._confidences >= self.appear_confidence) | \
+                        (self._visible & (self._confidences >= self.disappear_confidence))
+        keep = self._visible | (self._confidences >= self.disappear_confidence * (1 - s))
+        self._ids, self._boxes, self._confidences, self._category_ids, self._visible = \
+            self._ids[keep], self._boxes[keep], self._confidences[keep], self._category_ids[keep], self._visible[keep]
+
+        # Build the visible results, sorted by descending smoothed confidence
+        visible = np.flatnonzero(self._visible)
+        visible = visible[np.argsort(-self._confidences[visible], kind='stable')]
+        smoothed = DetectionBatch(self._boxes[visible], self._confidences[visible], self._category_ids[visible],
+                                  self._categories).to_list()
+        tracked = None
+        if self._tracked_id is not None:
+            tracked_visible = np.flatnonzero(self._ids[visible] == self._tracked_id)
+            if len(tracked_visible) > 0:
+                tracked = smoothed[tracked_visible[0]]
+            elif self._tracked_id not in self._ids:
+                self._tracked_id = None  # The tracked object was forgotten
+        return tracked, smoothed
+
+    def _associate(self, batch: DetectionBatch) -> np.ndarray:
+        """Greedily matches each detection of the batch with the previous track with the highest IoU.
+
+        :return: the index of the matched track for each detection, or -1 if unmatched.
+        """
+        track_of = np.full(len(batch), -1, dtype=np.intp)
+        if len(self._ids) == 0 or len(batch) == 0:
+            return track_of
+        iou = pairwise_iou(self._boxes, batch.boxes)
+        iou[self._category_ids[:, None] != batch.category_ids[None, :]] = -1  # Never match different categories
+        for _ in range(min(iou.shape)):
+            t, d = np.unravel_index(np.argmax(iou), iou.shape)
+            if iou[t, d] < self.min_iou:
+                break
+            track_of[d] = t
+            iou[t, :] = -1
+            iou[:, d] = -1
+        return track_of
+
+
+def pairwise_iou(boxes1: np.ndarray, boxes2: np.ndarray) -> np.ndarray:
+    """Computes the intersection over union of every pair of boxes, in (x_min, y_min, x_max, y_max) format.
+
+    :return: the matrix of shape [len(boxes1), len(boxes2)].
+    """
+    b1, b2 = boxes1[:, None, :], boxes2[None, :, :]
+    w = np.clip(np.minimum(b1[..., 2], b2[..., 2]) - np.maximum(b1[..., 0], b2[..., 0]), 0, None)
+    h = np.clip(np.minimum(b1[..., 3], b2[..., 3]) - np.maximum(b1[..., 1], b2[..., 1]), 0, None)
+    intersection = w * h
+    area1 = (b1[..., 2] - b1[..., 0]) * (b1[..., 3] - b1[..., 1])
+    area2 = (b2[..., 2] - b2[..., 0]) * (b2[..., 3] - b2[..., 1])
+    return intersection / np.maximum(area1 + area2 - intersection, 1e-9)
@@ -1,6 +1,6 @@
 from abc import abstractmethod, ABC
 from dataclasses import dataclass, field
-from typing import Callable, List, Tuple
+from typing import Callable, List, Tuple, Optional
 
 import numpy as np
 
@@ -32,16 +32,47 @@ class Camera(ABC):
         """
         return lambda: None
 
+    # noinspection PyUnresolvedReferences
+    def take_photo_jpeg(self, resolution: (int, int), callback: Callable[['JpegPhoto'], None]) -> bool:
+        """Like `take_photo`, but returns the photo as received from the camera, in JPEG format, so that it can be saved
+        without re-encoding it and only decoded if needed (see `util.jpeg.JpegPhoto`).
+
+        :param resolution: the requested resolution to use for the photo (only a hint).
+        :param callback: the function to call with the photo.
+        :return: whether this camera supports it, otherwise the callback is never run (use `take_photo` instead).
+        """
+        return False
+
     @abstractmethod
-    def listen_video(self, resolution: (int, int), callback: Callable[[np.ndarray], None]) -> Callable[[], None]:
+    def listen_video(self, resolution: (int, int), callback: Callable[[np.ndarray], None],
+                     pixel_format: str = 'rgb24', max_rate: Optional[float] = None) -> Callable[[], None]:
         """Connects to the camera and starts receiving frames on callback. It returns "immediately".
-        Each frame will be a numpy array of shape (width, height, 3) representing the RGB color for each pixel.
-        Multiple calls to listen should share the frames, so modifications may be visible to other listeners.
-        The callback may be run on the decoding thread, so long-running operations should be moved to another thread.
+        Each frame will be a numpy array of shape (width, height, 3) representing the RGB color for each pixel, or any
+        other of the `util.frames.PIXEL_FORMATS` if requested.
+        Multiple calls to listen should share the frames (computing each resolution and format only once), which may
+        be read-only: use `util.frames.writable_frame` to get a private copy (only if needed) before modifying them.
+        Frames may be recycled after the callback returns, so use `util.frames.retain_frame` and
+        `util.frames.release_frame` to keep them for longer.
+        The callback may be run on the decoding thread (or a delivery thread that drops frames while the callback is
+        busy), so long-running operations should be moved to another thread.
         Run the returned function to stop listening.
 
-        :param resolution: the requested resolution to use for the video stream (only a hint).
+        :param resolution: the maximum resolution of the frames for this listener: larger frames are scaled down,
+            keeping their aspect ratio (see `util.frames.fit_size`). None to receive them at their original size.
         :param callback: the function to call with each video frame.
+        :param pixel_format: the format of the frames, see `util.frames.PIXEL_FORMATS`.
+        :param max_rate: the maximum frames per second for this listener (others are skipped), or None for no limit.
         :return: a function to stop listening.
         """
         return lambda: None
+
+    def record_video(self, path: str) -> Optional[Callable[..., None]]:
+        """Starts recording the video stream, as received from the camera (without re-encoding it), to a file.
+        It returns "immediately", and does not affect the frames of the video listeners.
+        Run the returned function to stop recording, which finalizes the file in the background. Pass it a timeout in
+        seconds to wait for the file to be finalized instead, e.g. when the app exits.
+
+        :param path: the video file to write, whose extension selects the container (see `util.recorder.CONTAINERS`).
+        :return: a function to stop recording, or None if this camera does not support it.
+        """
+        return None
@@ -0,0 +1,81 @@
+import threading
+from typing import Callable, Generic, Tuple, TypeVar
+
+from kivy import Logger
+
+T = TypeVar('T', bound=Callable)
+
+
+class Listeners(Generic[T]):
+    """A thread-safe registry of listeners (callbacks), for drivers to notify from their own threads.
+
+    It is copy-on-write: adding or removing a listener replaces an immutable tuple under a lock, so notifying only
+    reads the current tuple without locking, and listeners can be added or removed from any thread (even from a
+    listener) without breaking or skipping an ongoing notification. Registrations are rare and notifications are
+    frequent (e.g. every status update), which is what this trades for.
+    """
+
+    def __init__(self, name: str = 'Listeners'):
+        """
+        :param name: the name of the registry, for logging.
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self._listeners: Tuple[T, ...] = ()
+
+    def add(self, listener: T) -> Callable[[], None]:
+        """Registers a listener, which may be registered several times to be notified once per registration.
+
+        :return: a function that removes (one registration of) the listener, doing nothing if it is not registered.
+        """
+        with self._lock:
+            self._listeners = self._listeners + (listener,)
+
+        def remove():
+            self.remove(listener)
+
+        return remove
+
+    def remove(self, listener: T) -> bool:
+        """Unregisters (once) a listener.
+
+        :return: whether it was registered.
+        """
+        with self._lock:
+            listeners = self._listeners
+            for i, registered in enumerate(listeners):
+                if registered == listener:  # Like `list.remove`, so bound methods work too
+                    self._listeners = listeners[:i] + listeners[i + 1:]
+                    return True
+        return False
+
+    def clear(self) -> Tuple[T, ...]:
+        """Unregisters all listeners at once.
+
+        :return: the listeners that were registered, e.g. to notify them one last time.
+        """
+        with self._lock:
+            listeners, self._listeners = self._listeners, ()
+        return listeners
+
+    @property
+    def snapshot(self) -> Tuple[T, ...]:
+        """The currently registered listeners, which won't change even if listeners are added or removed later."""
+        return self._listeners
+
+    def __len__(self):
+        return len(self._listeners)
+
+    def __iter__(self):
+        return iter(self._listeners)
+
+    def notify(self, *args, **kwargs):
+        """Runs every registered listener with the given arguments, on the calling thread. It never locks.
+
+        A failing listener is logged and does not prevent notifying the rest.
+        """
+        for listener in self._listeners:
+            try:
+                listener(*args, **kwargs)
+            except Exception as e:  # Keep notifying, like `util.fanout.Mailbox` does for video listeners
+                Logger.error('Listeners: %s: listener %s failed: %s' % (self.name, listener, e))
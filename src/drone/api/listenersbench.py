@@ -0,0 +1,65 @@
+"""Benchmarks the overhead of `drone.api.listeners.Listeners` against the plain lists that the drivers used before.
+
+Run it with `python main.py l [listeners] [notifications]`. It measures the time to notify every listener (the hot
+path of the drivers, e.g. for each status update) and to add and remove one, using listeners that do nothing, so
+that only the registry itself is measured.
+"""
+
+import time
+from typing import Callable, Dict
+
+from kivy import Logger
+
+from drone.api.listeners import Listeners
+
+
+def _time_per_call(function: Callable[[], None], calls: int) -> float:
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - start) / calls
+
+
+def benchmark_listeners(listeners: int = 4, notifications: int = 100000) -> Dict[str, float]:
+    """Benchmarks notifying, adding and removing listeners, with a plain list and with the registry.
+
+    :param listeners: how many listeners are registered while notifying.
+    :param notifications: how many times to repeat each operation.
+    :return: the measured time per operation, in microseconds.
+    """
+
+    def listener(_value: int):
+        pass
+
+    def extra_listener(_value: int):
+        pass
+
+    plain = [listener] * listeners
+    registry = Listeners('Bench')
+    for _ in range(listeners):
+        registry.add(listener)
+
+    def notify_plain():
+        for callback in plain:
+            callback(0)
+
+    def add_remove_plain():
+        plain.append(extra_listener)
+        plain.remove(extra_listener)
+
+    def add_remove_registry():
+        registry.add(extra_listener)()
+
+    return {
+        'notify_list_us': _time_per_call(notify_plain, notifications) * 1e6,
+        'notify_registry_us': _time_per_call(lambda: registry.notify(0), notifications) * 1e6,
+        'add_remove_list_us': _time_per_call(add_remove_plain, notifications) * 1e6,
+        'add_remove_registry_us': _time_per_call(add_remove_registry, notifications) * 1e6,
+    }
+
+
+def main(listeners: str = '4', notifications: str = '100000'):
+    stats = benchmark_listeners(int(listeners), int(notifications))
+    Logger.info('ListenersBench: %s listeners: notify %.3fus (list %.3fus), add+remove %.3fus (list %.3fus)' % (
+        listeners, stats['notify_registry_us'], stats['notify_list_us'], stats['add_remove_registry_us'],
+        stats['add_remove_list_us']))
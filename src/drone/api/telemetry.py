@@ -0,0 +1,153 @@
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple, Union
+
+import numpy as np
+
+from drone.api.drone import Drone
+from drone.api.linearangular import LinearAngular
+from drone.api.status import Status
+
+TELEMETRY_FIELDS: Dict[str, Tuple[int, ...]] = {
+    'battery': (), 'signal_strength': (), 'flying': (), 'height': (),
+    'position_attitude': (6,), 'velocity': (6,), 'acceleration': (6,),
+}
+"""The `Status` fields that are stored, with the shape of each sample: `LinearAngular` values are stored as
+[x, y, z, roll, pitch, yaw], and booleans as 0 or 1."""
+
+
+def _sample(value: Union[float, bool, LinearAngular]) -> Union[float, np.ndarray]:
+    if isinstance(value, LinearAngular):
+        return np.concatenate((value.linear_local, value.angular))
+    return float(value)
+
+
+def status_samples(status: Status) -> Dict[str, Union[float, np.ndarray]]:
+    """Returns the sample of each of the `TELEMETRY_FIELDS` of a status."""
+    return {name: _sample(getattr(status, name)) for name in TELEMETRY_FIELDS}
+
+
+def _ring_slice(array: np.ndarray, begin: int, count: int) -> np.ndarray:
+    """Copies count items of a ring buffer, from the begin index, wrapping around to its start."""
+    end = begin + count
+    if end <= len(array):
+        return array[begin:end].copy()
+    return np.concatenate((array[begin:], array[:end - len(array)]))
+
+
+class TelemetryStore:
+    """The recent history of the status of a drone, for controllers, latency compensation or plots.
+
+    Each field of `TELEMETRY_FIELDS` is a column in a fixed-capacity NumPy ring buffer, sharing a column of monotonic
+    timestamps, so recording a status never allocates and the windowed queries are vectorized. It is thread-safe:
+    statuses are usually recorded on the thread of the drone while other threads query them.
+    """
+
+    def __init__(self, capacity: int = 4096):
+        """
+        :param capacity: the number of statuses to keep, after which the oldest ones are overwritten.
+        """
+        self.capacity = capacity
+        self._times = np.zeros(capacity, dtype=np.float64)
+        self._columns = {name: np.zeros((capacity,) + shape, dtype=np.float64)
+                         for name, shape in TELEMETRY_FIELDS.items()}
+        self._count = 0  # Total recorded, the next one goes to _count % capacity
+        self._lock = threading.Lock()
+
+    def listen(self, drone: Drone) -> Callable[[], None]:
+        """Records every status update of the drone.
+
+        :return: a function to stop recording.
+        """
+        return drone.listen_status(self.record)
+
+    def record(self, status: Status, timestamp: Optional[float] = None):
+        """Appends a status.
+
+        :param status: the status to append.
+        :param timestamp: its monotonic time in seconds, or None for now (`time.monotonic`). It must not decrease.
+        """
+        samples = status_samples(status)  # Out of the lock
+        with self._lock:
+            i = self._count % self.capacity
+            self._times[i] = time.monotonic() if timestamp is None else timestamp
+            for name, sample in samples.items():
+                self._columns[name][i] = sample
+            self._count += 1
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def window(self, field: str, seconds: Optional[float] = None, now: Optional[float] = None) -> \
+            (np.ndarray, np.ndarray):
+        """Returns a copy of the recent samples of a field, in chronological order.
+
+        :param field: the name of the field, see `TELEMETRY_FIELDS`.
+        :param seconds: the duration of the window, ending at now, or None for all stored samples.
+        :param now: the end of the window, or None for `time.monotonic`.
+        :return: the timestamps, with shape (n,), and the samples, with shape (n,) + the shape of the field.
+        """
+        column = self._columns[field]
+        with self._lock:
+            n = min(self._count, self.capacity)
+            start = (self._count - n) % self.capacity
+            first = 0  # The first sample in the window, counting from the oldest one
+            if seconds is not None:
+                start_time = (time.monotonic() if now is None else now) - seconds
+                # The ring holds two sorted runs: the older one from start to the end of the arrays, and the newer one
+                # that wrapped around to their beginning. Only search the run that contains the start of the window.
+                older = self._times[start:min(start + n, self.capacity)]
+                newer = self._times[:max(0, start + n - self.capacity)]
+                if len(newer) > 0 and start_time > older[-1]:
+                    first = len(older) + int(np.searchsorted(newer, start_time, side='left'))
+                else:
+                    first = int(np.searchsorted(older, start_time, side='left'))
+            # Only copy the samples of the window
+            begin = (start + first) % self.capacity
+            return _ring_slice(self._times, begin, n - first), _ring_slice(column, begin, n - first)
+
+    def latest(self, field: str) -> Optional[Union[float, np.ndarray]]:
+        """Returns the last sample of a field, or None if nothing was recorded."""
+        with self._lock:
+            if self._count == 0:
+                return None
+            value = self._columns[field][(self._count - 1) % self.capacity]
+            return value.copy() if isinstance(value, np.ndarray) else float(value)
+
+    def mean(self, field: str, seconds: float, now: Optional[float] = None) -> Union[float, np.ndarray]:
+        """Returns the mean of a field over the window (NaN if there are no samples), see `window`."""
+        _, values = self.window(field, seconds, now)
+        if len(values) == 0:
+            return np.full(TELEMETRY_FIELDS[field], np.nan) if TELEMETRY_FIELDS[field] else np.nan
+        return np.mean(values, axis=0)
+
+    def derivative(self, field: str, seconds: float, now: Optional[float] = None) -> Union[float, np.ndarray]:
+        """Returns the rate of change per second of a field over the window, as the slope of the least-squares line
+        through its samples, which is less noisy than differentiating the last two. NaN if there are not enough
+        samples, see `window`.
+        """
+        times, values = self.window(field, seconds, now)
+        if len(times) < 2 or times[-1] == times[0]:
+            return np.full(TELEMETRY_FIELDS[field], np.nan) if TELEMETRY_FIELDS[field] else np.nan
+        dt = times - np.mean(times)
+        dv = values - np.mean(values, axis=0)
+        if dv.ndim > 1:
+            dt = dt[:, np.newaxis]
+        return np.sum(dt * dv, axis=0) / np.sum(dt * dt, axis=0)
+
+    def interpolate(self, field: str, at: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        """Returns the value of a field at the given time(s), linearly interpolated between the stored samples (and
+        clamped to the first and last ones), e.g. to match the status to a delayed video frame. NaN if there are none.
+
+        :param field: the name of the field, see `TELEMETRY_FIELDS`.
+        :param at: a monotonic time, or an array of them.
+        :return: the value at each time, with shape at.shape + the shape of the field.
+        """
+        times, values = self.window(field)
+        shape = np.shape(at) + TELEMETRY_FIELDS[field]
+        if len(times) == 0:
+            return np.full(shape, np.nan) if shape else np.nan
+        if values.ndim == 1:
+            return np.interp(at, times, values)
+        columns = [np.interp(at, times, values[:, j]) for j in range(values.shape[1])]
+        return np.stack(columns, axis=-1)
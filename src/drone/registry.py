@@ -4,15 +4,16 @@ from kivy import Logger
 from kivy.config import ConfigParser
 
 from app.settings.manager import SettingsManager
-from app.settings.settings import SettingMetaOptions, SettingMetaNumeric
+from app.settings.settings import SettingMetaOptions, SettingMetaNumeric, SettingMetaString
 from drone.api.drone import Drone
+from drone.replay.drone import ReplayDrone, LogReplayDrone, REPLAY_RATES
 from drone.tello.drone import TelloDrone
 from drone.test.drone import TestDrone
 
 
 class DroneRegistry:
     # Provide the drone connection initializer for each supported drone
-    _drone_classes: List[Type[Drone]] = [TestDrone, TelloDrone]
+    _drone_classes: List[Type[Drone]] = [TestDrone, TelloDrone, ReplayDrone, LogReplayDrone]
     section_name = 'Connection'
 
     def setup_settings(self):
@@ -24,6 +25,14 @@ class DroneRegistry:
             # SettingMetaString.create(
             #     'URL', 'The URL to connect to. Check the documentation of the drone.', 'tcp://192.168.10.1:8889'),
             SettingMetaNumeric.create('Timeout', 'The timeout in seconds to connect to the drone.', 12.0),
+            SettingMetaString.create('Replay video', 'The recorded video (.mkv, .mp4 or .h264) to replay.', ''),
+            SettingMetaString.create(
+                'Replay log', 'The flight log (directory) to replay, alone or along the replayed video.', ''),
+            SettingMetaOptions.create(
+                'Replay rate', 'Replay at the recorded rate, or as fast as possible', REPLAY_RATES, REPLAY_RATES[0]),
+            SettingMetaOptions.create(
+                'Flight log', 'Log the status, controls and detections of each session, to analyze or replay them',
+                ['on', 'off'], 'on'),
         ]
 
     def drone_connect_auto(self, config: ConfigParser, callback: Callable[[Optional[Drone]], None]):
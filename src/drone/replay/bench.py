@@ -0,0 +1,69 @@
+"""Benchmarks the video pipeline end to end (demuxing, decoding and delivering frames) by replaying a recording.
+
+Run it with `python main.py r <video> [realtime|max] [decoder] [pixel_format] [flight log]`. It needs no drone
+nor window, so the results are repeatable: at the max rate it measures the throughput of the pipeline, and in real
+time its CPU usage and the latency from feeding each packet until the next frame is delivered to a listener.
+"""
+
+import time
+from typing import Dict, Optional
+
+import numpy as np
+from kivy import Logger
+
+from drone.replay.drone import ReplayDrone, REPLAY_RATES
+from util.metrics import Metrics
+from util.video import StreamingVideoSource, DECODER_PRESETS
+
+
+def benchmark_replay(video_path: str, realtime: bool = False, decoder: str = StreamingVideoSource.DECODERS[0],
+                     pixel_format: str = 'rgb24', log_path: Optional[str] = None) -> Dict[str, float]:
+    """Replays a recording once through a video listener that only takes timestamps.
+
+    :param video_path: the recorded video, see `ReplayDrone`.
+    :param realtime: whether to replay at the recorded rate or as fast as possible.
+    :param decoder: the decoder backend, see `StreamingVideoSource.DECODERS`.
+    :param pixel_format: the format of the frames of the listener, see `util.frames.PIXEL_FORMATS`.
+    :param log_path: the flight log to replay along the video, if any.
+    :return: the measured stats.
+    """
+    drone = ReplayDrone(video_path, log_path, realtime, decoder)
+    camera = drone.cameras()[0]
+    delivery_times = []
+    latencies = []
+
+    def on_video_frame(_frame: np.ndarray):
+        now = time.perf_counter()
+        delivery_times.append(now)
+        latencies.append(now - camera.last_feed_time)
+
+    stop_listening = camera.listen_video(None, on_video_frame, pixel_format)
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    drone.start()
+    drone.finished.wait()
+    while delivery_times and time.perf_counter() - delivery_times[-1] < 0.5:
+        time.sleep(0.1)  # Let the pipeline flush the last frames
+    wall_end = delivery_times[-1] if delivery_times else time.perf_counter()
+    cpu = (time.process_time() - cpu_start) / max(1e-9, time.perf_counter() - wall_start)
+    dropped = sum(mailbox.stats_dropped for mailbox in camera.listeners_video.mailboxes)
+    drone.stop()
+    stop_listening()  # The last listener closes the decoder, waiting for its thread to stop
+
+    latencies_ms = np.array(latencies or [np.nan]) * 1000
+    return {
+        'packets': drone.stats_packets, 'frames': len(delivery_times), 'dropped': dropped,
+        'fps': len(delivery_times) / max(1e-9, wall_end - wall_start), 'cpu': cpu,
+        'latency_mean_ms': float(np.mean(latencies_ms)), 'latency_p95_ms': float(np.percentile(latencies_ms, 95)),
+    }
+
+
+def main(video_path: str, rate: str = REPLAY_RATES[1], decoder: str = StreamingVideoSource.DECODERS[0],
+         pixel_format: str = 'rgb24', log_path: Optional[str] = None):
+    realtime = rate == REPLAY_RATES[0]
+    StreamingVideoSource.default_options = DECODER_PRESETS['low latency' if realtime else 'throughput']
+    stats = benchmark_replay(video_path, realtime, decoder, pixel_format, log_path)
+    Logger.info('ReplayBench: %s/%s/%s: %d packets, %d frames (%d dropped), %.1f FPS, CPU %.1f%%, latency mean %.1fms, '
+                'p95 %.1fms' % (rate, decoder, pixel_format, stats['packets'], stats['frames'], stats['dropped'],
+                                stats['fps'], stats['cpu'] * 100, stats['latency_mean_ms'], stats['latency_p95_ms']))
+    Logger.info('ReplayBench: decoder options %s' % StreamingVideoSource.default_options)
+    Logger.info('ReplayBench: metrics: %s' % Metrics.instance())
@@ -0,0 +1,102 @@
+import time
+from typing import Callable, Optional, Iterator, Tuple
+
+import numpy as np
+from kivy import Logger
+
+from drone.api.camera import Camera
+from util.fanout import FrameFanout, Mailbox
+
+
+def read_video_size(path: str) -> (int, int):
+    """Returns the (width, height) of the video of a recording."""
+    import av
+    with av.open(path) as container:
+        stream = container.streams.video[0]
+        return stream.codec_context.width, stream.codec_context.height
+
+
+def iter_annexb_packets(path: str) -> Iterator[Tuple[float, bytes]]:
+    """Demuxes the H.264 video of a recording (MKV/MP4, see `util.recorder`, or a raw .h264 stream), as the Annex B
+    byte stream that live drones send.
+
+    :param path: the recording.
+    :return: the (presentation time in seconds since the first packet, Annex B bytes) of each packet, in order.
+    """
+    import av
+    with av.open(path) as container:
+        stream = container.streams.video[0]
+        bsf = None
+        if (stream.codec_context.extradata or b'')[:1] == b'\x01':  # AVCC: length-prefixed NAL units, SPS/PPS apart
+            from av.bitstream import BitStreamFilterContext
+            bsf = BitStreamFilterContext('h264_mp4toannexb', stream)
+        frame_duration = 1 / float(stream.average_rate or 30)  # Raw streams may have no timestamps
+        index, first_time = 0, None
+        for packet in container.demux(stream):
+            if packet.size == 0:  # Flushing packet
+                continue
+            for annexb_packet in (bsf.filter(packet) if bsf is not None else [packet]):
+                packet_time = float(annexb_packet.pts * annexb_packet.time_base) \
+                    if annexb_packet.pts is not None else index * frame_duration
+                if first_time is None:
+                    first_time = packet_time
+                yield packet_time - first_time, bytes(annexb_packet)
+                index += 1
+
+
+class ReplayCamera(Camera):
+    """The camera of a `ReplayDrone`, which decodes the replayed video exactly like the live drone cameras do."""
+    direction = np.array([1, 0, 0])
+
+    def __init__(self, size: (int, int), video_decoder: Optional[str] = None, video_low_latency: bool = True):
+        """
+        :param size: the (width, height) of the recorded video.
+        :param video_decoder: the backend of the shared video decoder (see `StreamingVideoSource.DECODERS`), or None for
+            the default one.
+        :param video_low_latency: only deliver the newest decoded frame, see `StreamingVideoSource`.
+        """
+        self.resolutions_video = [size]
+        self.resolutions_photo = []
+        self.video_decoder = video_decoder
+        self.video_low_latency = video_low_latency
+        self.listeners_video = FrameFanout('ReplayVideo')
+        self.decoder: Optional['StreamingVideoSource'] = None
+        # Stats & debug
+        self.last_feed_time = 0.0
+
+    def take_photo(self, resolution: (int, int), callback: Callable[[np.ndarray], None]):
+        Logger.warn('ReplayCamera: photos are not recorded')
+        return lambda: None
+
+    def listen_video(self, resolution: (int, int), callback: Callable[[np.ndarray], None],
+                     pixel_format: str = 'rgb24', max_rate: Optional[float] = None) -> Callable[[], None]:
+        # First listener sets up the shared video decoder
+        if len(self.listeners_video) == 0:
+            from util.video import StreamingVideoSource
+            decoder = StreamingVideoSource(decoder=self.video_decoder, low_latency=self.video_low_latency,
+                                           pixel_format=pixel_format)
+            decoder.start()
+            decoder.bind(on_video_frame=lambda _ignore, frame: self.listeners_video.publish(frame, decoder.frame_pool))
+            self.decoder = decoder
+
+        # Register the new listener
+        mailbox = self.listeners_video.subscribe(callback, pixel_format, resolution, max_rate)
+        return lambda: self._listen_stop_video(mailbox)
+
+    def _listen_stop_video(self, mailbox: Mailbox):
+        self.listeners_video.unsubscribe(mailbox)
+        if len(self.listeners_video) == 0:
+            decoder, self.decoder = self.decoder, None  # Stops decoding the replayed packets
+            if decoder is not None:
+                decoder.close()
+
+    def feed(self, data: bytes):
+        """Decodes the next bytes of the replayed H.264 stream, if anyone is listening."""
+        decoder = self.decoder
+        if decoder is not None:
+            self.last_feed_time = time.perf_counter()
+            decoder.feed(data)
+
+    def __del__(self):  # Clean up resources
+        for mailbox in self.listeners_video.mailboxes:
+            self._listen_stop_video(mailbox)
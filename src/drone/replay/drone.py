@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+import heapq
+import os
+import threading
+import time
+from typing import Callable, List, Optional
+
+import numpy as np
+from kivy import Logger
+from kivy.app import App
+
+from drone.api.camera import Camera
+from drone.api.drone import Drone
+from drone.api.linearangular import LinearAngular
+from drone.api.listeners import Listeners
+from drone.api.status import Status
+from drone.replay.camera import ReplayCamera, iter_annexb_packets, read_video_size
+from drone.replay.flightlog import read_flight_log
+from drone.replay.status import LogStatus, ReplayStatus
+from util.video import pyav_available
+
+REPLAY_RATES = ['realtime', 'max']
+"""How fast to replay: at the recorded rate (like a live drone), or as fast as the pipeline can consume the video."""
+
+
+class ReplayDrone(Drone):
+    """A drone that replays a recorded flight: its H.264 video (see `util.recorder`) and optionally the status of its
+    flight log (see `drone.replay.flightlog`), which is synchronized to the video at takeoff (when recording starts).
+
+    It needs neither a drone nor an OpenGL window, so the same recording can be replayed to benchmark the video
+    pipeline reproducibly (see `drone.replay.bench`). It can't be controlled.
+    """
+
+    section_name = 'Connection'
+    """The section of the replay settings, see `drone.registry.DroneRegistry`."""
+
+    @staticmethod
+    def connect(timeout_secs: float, callback: Callable[[any], None]):
+        config = App.get_running_app().config
+        video_path = config.get(ReplayDrone.section_name, 'replay_video')
+        log_path = config.get(ReplayDrone.section_name, 'replay_log') or None
+        realtime = config.get(ReplayDrone.section_name, 'replay_rate') == REPLAY_RATES[0]
+        if not pyav_available():
+            Logger.error('ReplayDrone: replaying a video needs PyAV (install the pyav extra)')
+            callback(None)
+            return
+        if not os.path.isfile(video_path):
+            Logger.error('ReplayDrone: recording not found: "%s"' % video_path)
+            callback(None)
+            return
+        if log_path is not None and not os.path.isdir(log_path):
+            Logger.error('ReplayDrone: flight log not found: "%s"' % log_path)
+            callback(None)
+            return
+
+        def connect_thread():
+            try:
+                drone = ReplayDrone(video_path, log_path, realtime)
+            except Exception as e:  # e.g. an unsupported recording or log, which must not leave the app connecting
+                Logger.exception('ReplayDrone: can\'t replay "%s": %s' % (video_path, e))
+                callback(None)
+                return
+            callback(drone)
+            drone.start()
+
+        threading.Thread(target=connect_thread, daemon=True).start()
+
+    @staticmethod
+    def get_name() -> str:
+        return "Replay"
+
+    def __init__(self, video_path: str, log_path: Optional[str] = None, realtime: bool = True,
+                 video_decoder: Optional[str] = None, video_low_latency: Optional[bool] = None):
+        """
+        :param video_path: the recorded video, see `drone.replay.camera.iter_annexb_packets`.
+        :param log_path: the directory of the flight log of the recording, see `drone.replay.flightlog`, or None.
+        :param realtime: whether to replay at the recorded rate or as fast as possible (see `REPLAY_RATES`).
+        :param video_decoder: the backend of the shared video decoder (see `StreamingVideoSource.DECODERS`), or None for
+            the default one.
+        :param video_low_latency: only deliver the newest decoded frame, see `StreamingVideoSource`.
+            By default, only when replaying in real time, so that no frame is skipped otherwise.
+        """
+        super().__init__()
+        self.video_path = video_path
+        self.log_path = log_path
+        self.realtime = realtime
+        self.log = read_flight_log(log_path) if log_path else None
+        """The memory-mapped columns of every stream of the flight log (if any), for analysis."""
+        self._camera = ReplayCamera(read_video_size(video_path), video_decoder,
+                                    realtime if video_low_latency is None else video_low_latency)
+        self._status: Status = ReplayStatus()  # The defaults, until the first record
+        self._status_listeners: Listeners[Callable[[Status], None]] = Listeners('ReplayStatus')
+        self._target_speed = LinearAngular()
+        self._thread = threading.Thread(target=self._run, name='ReplayDrone', daemon=True)
+        self._stopping = False
+        self.finished = threading.Event()
+        """Set when the whole recording has been replayed."""
+        # Stats & debug
+        self.stats_packets = 0
+        self.stats_updates = 0
+
+    def start(self):
+        """Starts replaying, after subscribing to the video and status to receive them from the start."""
+        self._thread.start()
+
+    def _run(self):
+        Logger.info('ReplayDrone: replaying %s (%s)' % (self.video_path, 'realtime' if self.realtime else 'max rate'))
+        video = ((packet_time, 0, data) for packet_time, data in iter_annexb_packets(self.video_path))
+        statuses = iter(())
+        if self.log is not None:
+            records = self.log['status']
+            flying = np.flatnonzero(records['flying'] > 0.5)  # The video is recorded from the first takeoff
+            times = records['time']
+            takeoff_time = float(times[flying[0] if len(flying) > 0 else 0]) if len(times) > 0 else 0.0
+            statuses = ((float(record_time) - takeoff_time, 1, i) for i, record_time in enumerate(times))
+        start_time = time.perf_counter()
+        for event_time, kind, payload in heapq.merge(video, statuses, key=lambda event: event[:2]):
+            if self._stopping:
+                break
+            if self.realtime:
+                time.sleep(max(0.0, start_time + event_time - time.perf_counter()))
+            if kind == 0:
+                self._camera.feed(payload)
+                self.stats_packets += 1
+            else:  # The records before takeoff are replayed at once
+                self._status = LogStatus(records, payload)
+                self.stats_updates += 1
+                self._status_listeners.notify(self._status)
+        Logger.info('ReplayDrone: replayed %d video packets and %d status updates in %.2fs' % (
+            self.stats_packets, self.stats_updates, time.perf_counter() - start_time))
+        self.finished.set()
+
+    def stop(self):
+        """Stops replaying, after the current packet or status update."""
+        self._stopping = True
+
+    def __del__(self):
+        self.stop()
+
+    def takeoff(self, callback: Callable[[bool], None]):
+        Logger.warn('ReplayDrone: a replay can\'t be controlled')
+        callback(False)
+
+    def land(self, callback: Callable[[bool], None]):
+        Logger.warn('ReplayDrone: a replay can\'t be controlled')
+        callback(False)
+
+    @property
+    def target_speed(self) -> LinearAngular:
+        return self._target_speed
+
+    @target_speed.setter
+    def target_speed(self, speed: LinearAngular):
+        self._target_speed = speed  # Ignored
+
+    @property
+    def status(self) -> Status:
+        return self._status
+
+    def listen_status(self, callback: Callable[[Status], None]) -> Callable[[], None]:
+        return self._status_listeners.add(callback)
+
+    def cameras(self) -> List[Camera]:
+        return [self._camera]
+
+
+class LogReplayDrone(Drone):
+    """A drone that replays the status of a flight log (see `drone.replay.flightlog`), e.g. to analyze a flight through
+    the app or to benchmark the consumers of the status reproducibly. It has no cameras, and can't be controlled.
+    """
+
+    section_name = 'Connection'
+    """The section of the replay settings, see `drone.registry.DroneRegistry`."""
+
+    @staticmethod
+    def connect(timeout_secs: float, callback: Callable[[any], None]):
+        config = App.get_running_app().config
+        log_path = config.get(LogReplayDrone.section_name, 'replay_log')
+        realtime = config.get(LogReplayDrone.section_name, 'replay_rate') == REPLAY_RATES[0]
+        if not os.path.isdir(log_path):
+            Logger.error('LogReplayDrone: flight log not found: "%s"' % log_path)
+            callback(None)
+            return
+
+        def connect_thread():
+            try:
+                drone = LogReplayDrone(log_path, realtime)
+            except Exception as e:  # e.g. a corrupt or unsupported log, which must not leave the app connecting
+                Logger.exception('LogReplayDrone: can\'t replay "%s": %s' % (log_path, e))
+                callback(None)
+                return
+            callback(drone)
+            drone.start()
+
+        threading.Thread(target=connect_thread, daemon=True).start()
+
+    @staticmethod
+    def get_name() -> str:
+        return "Flight log replay"
+
+    def __init__(self, log_path: str, realtime: bool = True):
+        """
+        :param log_path: the directory of the flight log, see `drone.replay.flightlog.read_flight_log`.
+        :param realtime: whether to replay at the recorded rate or as fast as possible (see `REPLAY_RATES`).
+        """
+        super().__init__()
+        self.log_path = log_path
+        self.realtime = realtime
+        self.log = read_flight_log(log_path)
+        """The memory-mapped columns of every stream of the log, for analysis."""
+        self._status: Status = ReplayStatus()  # The defaults, until the first record
+        self._status_listeners: Listeners[Callable[[Status], None]] = Listeners('LogReplayStatus')
+        self._target_speed = LinearAngular()
+        self._thread = threading.Thread(target=self._run, name='LogReplayDrone', daemon=True)
+        self._stopping = False
+        self.finished = threading.Event()
+        """Set when the whole log has been replayed."""
+        # Stats & debug
+        self.stats_updates = 0
+
+    def start(self):
+        """Starts replaying, after subscribing to the status to receive it from the start."""
+        self._thread.start()
+
+    def _run(self):
+        records = self.log['status']
+        times = records['time']
+        Logger.info('LogReplayDrone: replaying %d status records of %s (%s)' % (
+            len(times), self.log_path, 'realtime' if self.realtime else 'max rate'))
+        start_time = time.perf_counter()
+        first_time = float(times[0]) if len(times) > 0 else 0.0
+        for i, record_time in enumerate(times):
+            if self._stopping:
+                break
+            if self.realtime:
+                time.sleep(max(0.0, start_time + float(record_time) - first_time - time.perf_counter()))
+            self._status = LogStatus(records, i)
+            self.stats_updates += 1
+            self._status_listeners.notify(self._status)
+        Logger.info('LogReplayDrone: replayed %d status updates in %.2fs' % (
+            self.stats_updates, time.perf_counter() - start_time))
+        self.finished.set()
+
+    def stop(self):
+        """Stops replaying, after the current status update."""
+        self._stopping = True
+
+    def __del__(self):
+        self.stop()
+
+    def takeoff(self, callback: Callable[[bool], None]):
+        Logger.warn('LogReplayDrone: a replay can\'t be controlled')
+        callback(False)
+
+    def land(self, callback: Callable[[bool], None]):
+        Logger.warn('LogReplayDrone: a replay can\'t be controlled')
+        callback(False)
+
+    @property
+    def target_speed(self) -> LinearAngular:
+        return self._target_speed
+
+    @target_speed.setter
+    def target_speed(self, speed: LinearAngular):
+        self._target_speed = speed  # Ignored
+
+    @property
+    def status(self) -> Status:
+        return self._status
+
+    def listen_status(self, callback: Callable[[Status], None]) -> Callable[[], None]:
+        return self._status_listeners.add(callback)
+
+    def cameras(self) -> List[Camera]:
+        return []
@@ -0,0 +1,172 @@
+"""Compact binary flight logs: the status, control commands and detections of a session, for post-flight analysis and
+reproducible replays (see `drone.replay.drone.LogReplayDrone`).
+
+A log is a directory with one append-only file per field of each stream (see `STREAM_DTYPES`), e.g.
+`status.height.bin`, holding the raw values of that column, plus a small JSON file describing them. So an hour-long log
+is opened instantly with `read_flight_log`, which memory-maps the files instead of parsing them, and reading a field
+(e.g. `log['status']['height']`) only reads the bytes of that column from disk.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from kivy import Logger
+
+from drone.api.linearangular import LinearAngular
+from drone.api.status import Status
+from drone.api.telemetry import TELEMETRY_FIELDS, status_samples
+
+FORMAT_VERSION = 2
+
+STREAM_DTYPES: Dict[str, np.dtype] = {
+    'status': np.dtype([('time', '<f8')] + [(name, '<f4', shape) for name, shape in TELEMETRY_FIELDS.items()]),
+    'control': np.dtype([('time', '<f8'), ('target_speed', '<f4', (6,))]),
+    'detection': np.dtype([('time', '<f8'), ('bounding_box', '<f4', (4,)), ('confidence', '<f4'),
+                           ('category', '<i4'), ('tracked', 'u1')]),
+}
+"""The fields of the records of each stream (each stored as a column), whose time is in seconds since the log was
+opened. The status fields are the `drone.api.telemetry.TELEMETRY_FIELDS`, the target speed is [x, y, z, roll, pitch,
+yaw] and the bounding box is [x_min, y_min, x_max, y_max], relative to the size of the image. Each detection of a frame
+is a record, and the tracked one (if any) is flagged."""
+
+_META_FILE = 'meta.json'
+
+
+class FlightLogWriter(threading.Thread):
+    """Writes a flight log in the background.
+
+    The `log_*` methods only build a record and queue it, so they can be called from the threads of the drone or the
+    UI at almost no cost: this thread appends each field of the queued records to its file once per flush interval.
+    """
+
+    def __init__(self, directory: str, flush_interval: float = 1.0):
+        """
+        :param directory: the directory of the log, which is created if needed (overwriting an existing log).
+        :param flush_interval: the seconds between writes of the queued records, which are lost if the app crashes.
+        """
+        super().__init__(name='FlightLogWriter', daemon=True)
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._records: Dict[str, List[tuple]] = {stream: [] for stream in STREAM_DTYPES}
+        self._cond = threading.Condition()
+        self._closing = False
+        self._start_time = time.monotonic()
+        # Stats & debug
+        self.stats_records = 0
+
+    def _now(self, timestamp: Optional[float]) -> float:
+        return (time.monotonic() if timestamp is None else timestamp) - self._start_time
+
+    def _queue(self, stream: str, records: List[tuple]):
+        with self._cond:
+            if not self._closing:
+                self._records[stream].extend(records)
+
+    def log_status(self, status: Status, timestamp: Optional[float] = None):
+        """Queues a status snapshot.
+
+        :param status: the status to log.
+        :param timestamp: its monotonic time (`time.monotonic`), or None for now.
+        """
+        samples = status_samples(status)
+        self._queue('status', [(self._now(timestamp),) + tuple(samples[name] for name in TELEMETRY_FIELDS)])
+
+    def log_control(self, target_speed: LinearAngular, timestamp: Optional[float] = None):
+        """Queues a control command, see `log_status` for the timestamp."""
+        self._queue('control', [
+            (self._now(timestamp), np.concatenate((target_speed.linear_local, target_speed.angular)))])
+
+    # noinspection PyUnresolvedReferences
+    def log_detections(self, detection: Optional['Detection'], all_detections: List['Detection'],
+                       timestamp: Optional[float] = None):
+        """Queues the detections of a frame, see `autopilot.tracking.detector.api.Detection` and `log_status`.
+
+        :param detection: the tracked detection, if any.
+        :param all_detections: all the detections of the frame.
+        """
+        now = self._now(timestamp)
+        self._queue('detection', [
+            (now, (d.bounding_box.x_min, d.bounding_box.y_min, d.bounding_box.x_max, d.bounding_box.y_max),
+             d.confidence, d.category.id, d is detection) for d in all_detections])
+
+    def close(self, timeout: Optional[float] = None):
+        """Stops logging, after writing all the queued records in the background.
+
+        :param timeout: the seconds to wait for the records to be written, or None to return immediately. This thread
+            is a daemon, so it must be waited for when the app exits, or the end of the flight would be lost.
+        """
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        if timeout is not None and self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+            if self.is_alive():
+                Logger.warning('FlightLogWriter: %s was not written after %.1fs' % (self.directory, timeout))
+
+    def run(self):
+        Logger.info('FlightLogWriter: logging to %s' % self.directory)
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, _META_FILE), 'w') as f:
+            json.dump({'version': FORMAT_VERSION, 'start_time': time.time(),
+                       'streams': {stream: dtype.descr for stream, dtype in STREAM_DTYPES.items()}}, f)
+        files = {(stream, field): open(_field_path(self.directory, stream, field), 'wb')
+                 for stream, dtype in STREAM_DTYPES.items() for field in dtype.names}
+        try:
+            closing = False
+            while not closing:
+                with self._cond:
+                    if not self._closing:
+                        self._cond.wait(self.flush_interval)
+                    closing = self._closing
+                    queued = {stream: records for stream, records in self._records.items() if records}
+                    for stream in queued:
+                        self._records[stream] = []
+                for stream, records in queued.items():
+                    rows = np.array(records, dtype=STREAM_DTYPES[stream])
+                    for field in rows.dtype.names:
+                        np.ascontiguousarray(rows[field]).tofile(files[stream, field])
+                        files[stream, field].flush()
+                    self.stats_records += len(records)
+        except Exception as e:  # Never break the app, only this log
+            Logger.exception('FlightLogWriter: logging to %s failed: %s' % (self.directory, e))
+        finally:
+            for f in files.values():
+                f.close()
+            Logger.info('FlightLogWriter: logged %d records to %s' % (self.stats_records, self.directory))
+
+
+def _field_path(directory: str, stream: str, field: str) -> str:
+    return os.path.join(directory, '%s.%s.bin' % (stream, field))
+
+
+def read_flight_log(directory: str) -> Dict[str, Dict[str, np.ndarray]]:
+    """Opens a flight log without loading it, see `FlightLogWriter`.
+
+    :param directory: the directory of the log.
+    :return: the read-only (memory-mapped) columns of each field of each stream, see `STREAM_DTYPES`. The columns of a
+        stream have the same length: the values of a record that was being written when the app was killed are ignored.
+    """
+    with open(os.path.join(directory, _META_FILE), 'r') as f:
+        meta = json.load(f)
+    if meta['version'] != FORMAT_VERSION:
+        raise ValueError('Unsupported flight log version %s: %s' % (meta['version'], directory))
+    streams = {}
+    for stream, descr in meta['streams'].items():
+        dtype = np.dtype([tuple(field) for field in descr])
+        paths = {field: _field_path(directory, stream, field) for field in dtype.names}
+        count = min(os.path.getsize(path) // dtype.fields[field][0].itemsize if os.path.isfile(path) else 0
+                    for field, path in paths.items())
+        columns = {}
+        for field, path in paths.items():
+            field_dtype = dtype.fields[field][0]  # The shape of a value is part of its dtype, e.g. ('<f4', (6,))
+            shape = (count,) + field_dtype.shape
+            if count == 0:  # Can't map an empty file
+                columns[field] = np.empty(shape, dtype=field_dtype.base)
+            else:
+                columns[field] = np.memmap(path, dtype=field_dtype.base, mode='r', shape=shape)
+        streams[stream] = columns
+    return streams
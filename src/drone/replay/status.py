@@ -0,0 +1,90 @@
+from typing import Dict, Any
+
+import numpy as np
+
+from drone.api.linearangular import LinearAngular
+from drone.api.status import Status
+
+
+def _linear_angular(value: Any) -> LinearAngular:
+    return LinearAngular(np.array(value[0], dtype=float), np.array(value[1], dtype=float))
+
+
+class LogStatus(Status):
+    """A status record of a flight log, see `drone.replay.flightlog`. It is immutable, and reads its fields lazily."""
+
+    def __init__(self, columns: Dict[str, np.ndarray], index: int):
+        """
+        :param columns: the columns of the status stream, see `drone.replay.flightlog.read_flight_log`.
+        :param index: the index of the record.
+        """
+        self._columns = columns
+        self.index = index
+
+    @property
+    def battery(self) -> float:
+        return float(self._columns['battery'][self.index])
+
+    @property
+    def signal_strength(self) -> float:
+        return float(self._columns['signal_strength'][self.index])
+
+    @property
+    def temperatures(self) -> Dict[str, float]:
+        return {}  # Not logged
+
+    @property
+    def flying(self) -> bool:
+        return bool(self._columns['flying'][self.index] > 0.5)
+
+    @property
+    def height(self) -> float:
+        return float(self._columns['height'][self.index])
+
+    @property
+    def position_attitude(self) -> LinearAngular:
+        return _linear_angular(self._columns['position_attitude'][self.index].reshape(2, 3))
+
+    @property
+    def velocity(self) -> LinearAngular:
+        return _linear_angular(self._columns['velocity'][self.index].reshape(2, 3))
+
+    @property
+    def acceleration(self) -> LinearAngular:
+        return _linear_angular(self._columns['acceleration'][self.index].reshape(2, 3))
+
+
+class ReplayStatus(Status):
+    """The status of a replay before its first status record (see `LogStatus`): the defaults of a landed drone."""
+
+    @property
+    def battery(self) -> float:
+        return 1.0
+
+    @property
+    def signal_strength(self) -> float:
+        return 1.0
+
+    @property
+    def temperatures(self) -> Dict[str, float]:
+        return {}
+
+    @property
+    def flying(self) -> bool:
+        return False
+
+    @property
+    def height(self) -> float:
+        return -1.0
+
+    @property
+    def position_attitude(self) -> LinearAngular:
+        return LinearAngular()
+
+    @property
+    def velocity(self) -> LinearAngular:
+        return LinearAngular()
+
+    @property
+    def acceleration(self) -> LinearAngular:
+        return LinearAngular()
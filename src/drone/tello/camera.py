@@ -1,17 +1,22 @@
-import io
 import time
 from threading import Thread
 from typing import Callable, Optional
 
 import numpy as np
-from PIL import Image
 from kivy import Logger
 from tellopy import Tello
 
 from drone.api.camera import Camera
+from drone.api.listeners import Listeners
+from util.fanout import FrameFanout, Mailbox
+from util.h264 import NalCoalescer
+from util.jpeg import JpegPhoto
+from util.metrics import Metrics
+from util.recorder import H264Recorder
+from util.resync import KeyframeRequester
 
 
-class TelloCamera(Camera):  # TODO: Threadsafe implementation
+class TelloCamera(Camera):
     direction = np.array([1, 0, 0])
     resolutions_video = [
         (960, 720),
@@ -20,68 +25,127 @@ class TelloCamera(Camera):  # TODO: Threadsafe implementation
     resolutions_photo = [(2592, 1936)]  # 5MP photos!
 
     # noinspection PyUnresolvedReferences
-    def __init__(self, drone: 'TelloDrone', tello: Tello):
+    def __init__(self, drone: 'TelloDrone', tello: Tello, video_decoder: Optional[str] = None,
+                 video_low_latency: bool = True, video_batched_reads: bool = True):
+        """
+        :param drone: the drone that owns this camera.
+        :param tello: the connected TelloPy driver.
+        :param video_decoder: the backend of the shared video decoder (see `StreamingVideoSource.DECODERS`), or None for
+            the default one.
+        :param video_low_latency: only deliver the newest decoded frame, see `StreamingVideoSource`.
+        :param video_batched_reads: read all the queued video packets at once, and only pass whole NAL units to the
+            decoder and recorder. Otherwise, read and pass up to 2 KB at a time (the original behavior, kept for
+            benchmarking).
+        """
         self.drone = drone
         self.tello = tello
+        self.video_decoder = video_decoder
+        self.video_low_latency = video_low_latency
+        self.video_batched_reads = video_batched_reads
         # Photo
-        self.listeners_photo: [Callable[[np.ndarray], None]] = []
+        self.listeners_photo: Listeners[Callable[[JpegPhoto], None]] = Listeners('TelloPhoto')
         # Video
-        self.listeners_video: [Callable[[np.ndarray], None]] = []
-        self.last_video_sync_point: float = time.time()
+        self.listeners_video = FrameFanout('TelloVideo')  # Each listener receives the frames at its own pace
+        self.keyframes = KeyframeRequester(self.tello.start_video)  # Only when the decoder needs a sync point
         self.decoder: Optional[StreamingVideoSource] = None
+        self.recorder: Optional[H264Recorder] = None
+        self._video_stream_thread: Optional[Thread] = None
         # Configure tello listeners
         # self.tello.subscribe(Tello.EVENT_VIDEO_FRAME, lambda **kwargs: self._on_video_data_h264_bytes(kwargs['data']))
         self.tello.subscribe(Tello.EVENT_FILE_RECEIVED, lambda **kwargs: self._on_photo_jpeg_bytes(kwargs['data']))
         self.tello.video_enabled = False
 
     def take_photo(self, resolution: (int, int), callback: Callable[[np.ndarray], None]):
+        # Decode in the worker pool (never on the Tello thread), and only as much as the requested resolution needs
+        def on_photo(photo: JpegPhoto):
+            photo.decode_async(resolution).add_done_callback(lambda future: callback(future.result()))
+
+        self.take_photo_jpeg(resolution, on_photo)
+
+    def take_photo_jpeg(self, resolution: (int, int), callback: Callable[[JpegPhoto], None]) -> bool:
         if len(self.listeners_photo) == 0:
             self.tello.take_picture()
-        self.listeners_photo.append(callback)  # Register the new listener
-
-    def _listen_stop_photo(self, callback: Callable[[np.ndarray], None]):
-        self.listeners_photo.remove(callback)
+        self.listeners_photo.add(callback)  # Register the new listener
+        return True
 
     def _on_photo_jpeg_bytes(self, data: bytes):
-        if len(self.listeners_photo) == 0:
+        listeners = self.listeners_photo.clear()  # Each photo is only for the listeners that asked for it until now
+        if len(listeners) == 0:
             Logger.warn('Unexpected photo received with no listeners')
             return
-        # Decode the JPEG image to a numpy array
-        # noinspection PyTypeChecker
-        frame = np.asarray(Image.open(io.BytesIO(data), formats=['jpeg']))
-        # Notify all listeners
-        for listener in self.listeners_photo:
-            listener(frame)
-
-    def listen_video(self, resolution: (int, int), callback: Callable[[np.ndarray], None]) -> Callable[[], None]:
+        # Notify all listeners, sharing the (undecoded) photo
+        photo = JpegPhoto(data)
+        for listener in listeners:
+            listener(photo)
+
+    def listen_video(self, resolution: (int, int), callback: Callable[[np.ndarray], None],
+                     pixel_format: str = 'rgb24', max_rate: Optional[float] = None) -> Callable[[], None]:
         # First listener sets up the shared video decoder
         if len(self.listeners_video) == 0:
             from util.video import StreamingVideoSource
-            # Start the shared decoder
-            self.decoder = StreamingVideoSource()
-            self.decoder.start()
-
-            # Start the shared raw frame listener that filters and sends the frames to the decoder
-            Thread(target=TelloCamera._on_video_data_h264_bytes_thread, args=(self,), daemon=True).start()
+            # Start the shared decoder, directly producing the format of the first listener
+            decoder = StreamingVideoSource(decoder=self.video_decoder, low_latency=self.video_low_latency,
+                                           pixel_format=pixel_format)
+            decoder.start()
 
-            # Connect each frame decoded to notifying all listeners
+            # Connect each frame decoded to queueing it for all listeners (without blocking the decoder)
             def on_video_frame(_ignore, frame: np.ndarray):
-                for listener in self.listeners_video:
-                    listener(frame)
+                self.keyframes.on_frame()
+                self.listeners_video.publish(frame, decoder.frame_pool)
 
-            self.decoder.bind(on_video_frame=on_video_frame)
+            decoder.bind(on_video_frame=on_video_frame,
+                         on_video_error=lambda _ignore, _error: self.keyframes.on_error())
+            self.keyframes.reset()  # The new decoder waits for the sync point requested below
+            self.decoder = decoder
+            self._start_video_stream()
 
-        self.listeners_video.append(callback)  # Register the new listener
+        # Register the new listener
+        mailbox = self.listeners_video.subscribe(callback, pixel_format, resolution, max_rate)
         self.tello.start_video()  # Just sends another PPS/SPS pair to let clients start processing frames
 
         # Return the callable that removes this listener
-        return lambda: self._listen_stop_video(callback)
+        return lambda: self._listen_stop_video(mailbox)
 
-    def _listen_stop_video(self, callback: Callable[[np.ndarray], None]):
-        self.listeners_video.remove(callback)
+    def _listen_stop_video(self, mailbox: Mailbox):
+        self.listeners_video.unsubscribe(mailbox)
 
         # The last listener cleans up the video decoder and starts ignoring any future video packets
         if len(self.listeners_video) == 0:
+            decoder, self.decoder = self.decoder, None  # Even if still recording
+            if decoder is not None:
+                decoder.close()
+            self._stop_video_stream()
+
+    def record_video(self, path: str) -> Optional[Callable[..., None]]:
+        if self.recorder is not None:
+            Logger.warn('TelloCamera: already recording to %s' % self.recorder.path)
+            return None
+        recorder = H264Recorder(path)
+        recorder.start()
+        self.recorder = recorder  # The raw bytes are teed to it by the video stream thread
+        self._start_video_stream()
+        self.tello.start_video()  # Send a PPS/SPS pair to start recording as soon as possible
+        return lambda timeout=None: self._record_stop_video(recorder, timeout)
+
+    def _record_stop_video(self, recorder: H264Recorder, timeout: Optional[float] = None):
+        if self.recorder is recorder:
+            self.recorder = None
+            recorder.close(timeout)
+            if len(self.listeners_video) == 0:
+                self._stop_video_stream()
+
+    def _start_video_stream(self):
+        """Starts the shared raw video stream thread if it is not running, for the decoder and/or the recorder."""
+        self.tello.video_enabled = True  # Also keeps the thread running if it was about to stop
+        if self._video_stream_thread is None or not self._video_stream_thread.is_alive():
+            # Start the shared raw frame listener that filters and sends the frames to the decoder and recorder
+            self._video_stream_thread = Thread(target=TelloCamera._on_video_data_h264_bytes_thread, args=(self,),
+                                               daemon=True)
+            self._video_stream_thread.start()
+
+    def _stop_video_stream(self):
+        """Stops the shared raw video stream thread, unless it is still recording."""
+        if self.recorder is None:
             self.tello.video_enabled = False  # Will notify the thread to eventually stop
 
     @staticmethod
@@ -90,14 +154,29 @@ class TelloCamera(Camera):  # TODO: Threadsafe implementation
         The benefit is that it filters packets in the way that the TelloPy library recommends
         """
         video_stream = self.tello.get_video_stream()
+        coalescer = NalCoalescer() if self.video_batched_reads else None
+        reads, feeds = Metrics.instance().rate('video.stream_reads'), Metrics.instance().rate('video.stream_feeds')
         while self.tello.video_enabled:
-            self.decoder.feed(video_stream.read(2048))
-            # Help the decoder start & recover from artifacts by requesting a sync point continuously
-            if time.time() - self.last_video_sync_point > 0.34:  # FIXME
-                self.tello.start_video()
-                self.last_video_sync_point = time.time()
+            # TelloPy owns the socket and queues the received packets, so a large read drains them all at once
+            data = video_stream.read(1 << 20 if coalescer is not None else 2048)
+            reads.tick()
+            if coalescer is not None:
+                data = coalescer.push(data)
+                if data is None:
+                    continue  # No complete NAL unit yet
+            elif not data:
+                continue
+            feeds.tick()
+            decoder, recorder = self.decoder, self.recorder
+            if decoder is not None:
+                decoder.feed(data)
+            if recorder is not None:  # Tee the raw bytes, which only queues them for the recording thread
+                recorder.write(data)
+            # Help the decoder start & recover from artifacts by requesting a sync point, only if it needs one
+            self.keyframes.on_data(data)
+            if decoder is not None:
+                self.keyframes.poll()
         # final close
-        del self.decoder
         self.tello.video_stream = None
 
     # def _on_video_data_h264_bytes(self, data: bytes):
@@ -107,9 +186,10 @@ class TelloCamera(Camera):  # TODO: Threadsafe implementation
     #     self.decoder.feed(data)
 
     def __del__(self):  # Clean up resources
-        for listener in self.listeners_photo:
-            self._listen_stop_photo(listener)
-        for listener in self.listeners_video:
-            self._listen_stop_video(listener)
+        self.listeners_photo.clear()
+        if self.recorder is not None:
+            self._record_stop_video(self.recorder)
+        for mailbox in self.listeners_video.mailboxes:
+            self._listen_stop_video(mailbox)
         while self.tello.video_stream is not None:
             time.sleep(0.1)  # Wait for the video stream to be closed
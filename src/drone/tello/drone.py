@@ -14,6 +14,7 @@ from tellopy._internal.protocol import FlightData, LogData
 from drone.api.camera import Camera
 from drone.api.drone import Drone
 from drone.api.linearangular import LinearAngular
+from drone.api.listeners import Listeners
 from drone.api.status import Status
 from drone.tello.camera import TelloCamera
 from drone.tello.status import TelloStatus
@@ -66,7 +67,8 @@ class TelloDrone(Drone):
         # Status data
         self.last_flight_data: Optional[FlightData] = None
         self.last_log_data: Optional[LogData] = None
-        self.status_listeners: List[Callable[[Status], None]] = []
+        self._status = TelloStatus.snapshot(None, None)  # Shared by all listeners until the next packet
+        self.status_listeners: Listeners[Callable[[Status], None]] = Listeners('TelloStatus')
         # Finalizer (in case the user forgets to call del)
         weakref.finalize(self, self.__del__)
 
@@ -129,22 +131,21 @@ class TelloDrone(Drone):
     def _on_flight_data(self, data: FlightData):
         # Logger.info(f"Tello _on_flight_data: {data}")
         self.last_flight_data = data
-        for listener in self.status_listeners:
-            listener(self.status)
+        self._status = TelloStatus.snapshot(self.last_flight_data, self.last_log_data)
+        self.status_listeners.notify(self._status)
 
     def _on_log_data(self, data: LogData):
         # Logger.info(f"Tello _on_log_data: {data}")
         self.last_log_data = data
-        for listener in self.status_listeners:
-            listener(self.status)
+        self._status = TelloStatus.snapshot(self.last_flight_data, self.last_log_data)
+        self.status_listeners.notify(self._status)
 
     @property
     def status(self) -> Status:
-        return TelloStatus(self.last_flight_data, self.last_log_data)  # TODO: deep copy as this is internally aliased?
+        return self._status
 
     def listen_status(self, callback: Callable[[Status], None]) -> Callable[[], None]:
-        self.status_listeners.append(callback)
-        return lambda: self.status_listeners.remove(callback)
+        return self.status_listeners.add(callback)
 
     def cameras(self) -> List[Camera]:
         return self._cameras
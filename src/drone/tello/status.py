@@ -1,6 +1,8 @@
+import copy
 import math
 from dataclasses import dataclass
-from typing import Dict
+from functools import cached_property
+from typing import Dict, Optional
 
 from tellopy._internal.protocol import FlightData, LogData
 
@@ -8,32 +10,49 @@ from drone.api.linearangular import LinearAngular
 from drone.api.status import Status
 
 
-@dataclass
+@dataclass(frozen=True)
 class TelloStatus(Status):
-    flight_data: FlightData
+    """An immutable snapshot of the status of the drone, as of the last received packets (see `snapshot`).
+
+    It is shared by all status listeners, so each derived property is only computed on its first access, and cached.
+    The returned values must not be modified.
+    """
+
+    flight_data: Optional[FlightData]
     """The last decoded flight data packet received from the drone."""
-    log_data: LogData
+    log_data: Optional[LogData]
     """The last decoded log data packet received from the drone."""
 
-    @property
+    @staticmethod
+    def snapshot(flight_data: Optional[FlightData], log_data: Optional[LogData]) -> 'TelloStatus':
+        """Creates the status from the last packets, copying the parts that TelloPy updates in place for new packets.
+        """
+        if log_data is not None:  # TelloPy reuses the same LogData (and its MVO and IMU data) for every packet
+            log_data_copy = copy.copy(log_data)
+            log_data_copy.mvo = copy.copy(log_data.mvo)
+            log_data_copy.imu = copy.copy(log_data.imu)
+            log_data = log_data_copy
+        return TelloStatus(flight_data, log_data)
+
+    @cached_property
     def battery(self) -> float:
         if self.flight_data is None:
             return super().battery
         return self.flight_data.battery_percentage / 100  # % -> [0, 1]
 
-    @property
+    @cached_property
     def signal_strength(self) -> float:
         if self.flight_data is None:
             return super().signal_strength
         return self.flight_data.wifi_strength / 100  # % -> [0, 1]
 
-    @property
+    @cached_property
     def temperatures(self) -> Dict[str, float]:
         if self.flight_data is None:
             return super().temperatures
         return {'temp': self.flight_data.temperature_height + 273.15}  # In kelvin TODO: Check values!
 
-    @property
+    @cached_property
     def flying(self) -> bool:
         if self.flight_data is None:
             return super().flying
@@ -43,13 +62,13 @@ class TelloStatus(Status):
         # fly_mode: 6 = stable? (in land or in flight), 11 = going up?
         # return self.flight_data.fly_mode != 6  # Detects flying without motors (fall/carrying in hand)
 
-    @property
+    @cached_property
     def height(self) -> float:
         if self.flight_data is None:
             return super().height
         return self.flight_data.height * .1  # dm -> m
 
-    @property
+    @cached_property
     def position_attitude(self) -> LinearAngular:
         if self.log_data is None:
             return super().position_attitude
@@ -61,7 +80,7 @@ class TelloStatus(Status):
             self.log_data.imu.q0, self.log_data.imu.q1, self.log_data.imu.q2, self.log_data.imu.q3)
         return res
 
-    @property
+    @cached_property
     def velocity(self) -> LinearAngular:
         if self.log_data is None:
             return super().velocity
@@ -74,7 +93,7 @@ class TelloStatus(Status):
         res.yaw = self.log_data.imu.gyro_z  # TODO: Check axes!
         return res
 
-    @property
+    @cached_property
     def acceleration(self) -> LinearAngular:
         if self.log_data is None:
             return super().acceleration
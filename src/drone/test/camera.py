@@ -1,4 +1,4 @@
-from typing import Callable
+from typing import Callable, Optional
 
 import numpy as np
 from kivy import Logger
@@ -10,6 +10,7 @@ from kivy.uix.widget import Widget
 from drone.api.camera import Camera
 from drone.test.renderer3d.collision import raycast_scene
 from drone.test.renderer3d.renderer import MySceneRenderer
+from util.frames import frame_variant, release_frame
 
 
 def _convert_vector(ray_dir: np.ndarray, negate_z: bool = True) -> np.ndarray:
@@ -73,7 +74,16 @@ class TestCamera(Camera):
         # NOTE: resolution is ignored, for photos, only videos modify the resolution (to avoid clashes)
         self._render_frame(callback)
 
-    def listen_video(self, resolution: (int, int), callback: Callable[[np.ndarray], None]) -> Callable[[], None]:
+    def listen_video(self, resolution: (int, int), callback: Callable[[np.ndarray], None],
+                     pixel_format: str = 'rgb24', max_rate: Optional[float] = None) -> Callable[[], None]:
         # TODO: Optimize (share frames) for multiple video listeners!
-        ev = Clock.schedule_interval(lambda dt: self._render_frame(callback), 1 / 30)  # 30 FPS for better performance
+        def on_frame(frame: np.ndarray):
+            variant = frame_variant(frame, pixel_format, resolution)
+            try:
+                callback(variant)
+            finally:
+                release_frame(variant)
+
+        fps = min(30.0, max_rate or 30.0)  # 30 FPS for better performance
+        ev = Clock.schedule_interval(lambda dt: self._render_frame(on_frame), 1 / fps)
         return ev.cancel
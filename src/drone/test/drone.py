@@ -11,6 +11,7 @@ from kivy.clock import Clock
 from drone.api.camera import Camera
 from drone.api.drone import Drone
 from drone.api.linearangular import LinearAngular
+from drone.api.listeners import Listeners
 from drone.api.status import Status
 from drone.test.camera import TestCamera
 from drone.test.status import TestStatus
@@ -35,8 +36,9 @@ class TestDrone(Drone):
         self._camera.setup()
         self._status = TestStatus(camera=self._camera)
         self._status.start_updates()
-        self._status_listeners: List[Callable[[Status], None]] = [lambda s: self._camera.on_status_update(s)]
-        self._status.bind(on_update=lambda _: [listener(self._status) for listener in self._status_listeners])
+        self._status_listeners: Listeners[Callable[[Status], None]] = Listeners('TestStatus')
+        self._status_listeners.add(lambda s: self._camera.on_status_update(s))
+        self._status.bind(on_update=lambda _: self._status_listeners.notify(self._status))
 
     def __del__(self):
         pass
@@ -78,8 +80,7 @@ class TestDrone(Drone):
         return self._status
 
     def listen_status(self, callback: Callable[[Status], None]) -> Callable[[], None]:
-        self._status_listeners.append(callback)
-        return lambda: self._status_listeners.remove(callback)
+        return self._status_listeners.add(callback)
 
     def cameras(self) -> List[Camera]:
         return [self._camera]
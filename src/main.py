@@ -60,5 +60,23 @@ if __name__ == '__main__':
 
         WebcamDetectorApp().run()
 
+    elif arg == 'v':
+        # ===> Benchmark the video decoder on a recorded H.264 stream <===
+        from util.videobench import main as video_benchmark
+
+        video_benchmark(*sys.argv[2:4])
+
+    elif arg == 'r':
+        # ===> Benchmark the whole video pipeline by replaying a recorded flight, headless <===
+        from drone.replay.bench import main as replay_benchmark
+
+        replay_benchmark(*sys.argv[2:7])
+
+    elif arg == 'l':
+        # ===> Benchmark the thread-safe listener registries of the drivers against plain lists <===
+        from drone.api.listenersbench import main as listeners_benchmark
+
+        listeners_benchmark(*sys.argv[2:4])
+
     else:
-        Logger.warning("The first argument is the app to run. Valid values are: m, 3, w (see main.py)")
+        Logger.warning("The first argument is the app to run. Valid values are: m, 3, w, v, r, l (see main.py)")
@@ -0,0 +1,235 @@
+"""Fan-out of video frames to independent subscribers, so that a slow subscriber never stalls the decoder or others."""
+
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Optional, Tuple, Dict
+
+import numpy as np
+from kivy import Logger
+
+from util.frames import FramePool, frame_pixel_format, frame_size, frame_variant, fit_size, retain_frame, \
+    release_frame
+
+DROP_POLICIES = ['oldest', 'newest']
+"""What to drop when a mailbox is full: the oldest queued frame (to always deliver the latest one), or the new one."""
+
+
+class FrameVariants:
+    """A published frame and its variants (pixel format and size), each computed at most once, when the first
+    subscriber that needs it is about to receive it: on its delivery thread, never on the publisher's one.
+
+    It retains the frame (see `util.frames.FramePool`), and each computed variant, until every mailbox that queued it
+    has delivered or dropped it.
+    """
+
+    def __init__(self, frame: np.ndarray, pool: Optional[FramePool] = None):
+        """
+        :param frame: the published frame, retained until the last reference to this object is released (the caller
+            owns the first one).
+        :param pool: where to get the buffers of the variants from.
+        """
+        retain_frame(frame)
+        self.frame = frame
+        self.pool = pool
+        self._lock = threading.Lock()
+        self._refs = 1
+        self._variants: Dict[Tuple[str, Tuple[int, int]], np.ndarray] = {}
+        self._variant_locks: Dict[Tuple[str, Tuple[int, int]], threading.Lock] = {}
+
+    def retain(self):
+        """Adds a reference, e.g. for a mailbox that queued the frame."""
+        with self._lock:
+            self._refs += 1
+
+    def release(self):
+        """Removes a reference, releasing the frame and its variants after the last one."""
+        with self._lock:
+            self._refs -= 1
+            if self._refs > 0:
+                return
+            variants = list(self._variants.values())
+            self._variants.clear()
+        for variant in variants:
+            release_frame(variant)
+        release_frame(self.frame)
+
+    def get(self, pixel_format: Optional[str] = None, resolution: Optional[Tuple[int, int]] = None) -> np.ndarray:
+        """Returns the variant of the frame for a subscriber, computing it if no one did yet (waiting for it if another
+        subscriber is computing it). It stays valid until the caller releases its reference (or retains the variant).
+
+        :param pixel_format: the wanted pixel format, or None to keep the one of the frame.
+        :param resolution: the maximum (width, height), see `util.frames.fit_size`, or None to keep the size.
+        """
+        size, source_pixel_format = frame_size(self.frame), frame_pixel_format(self.frame)
+        pixel_format = pixel_format or source_pixel_format
+        key = (pixel_format, fit_size(size, resolution, 'yuv420p' in (source_pixel_format, pixel_format)))
+        with self._lock:
+            variant_lock = self._variant_locks.setdefault(key, threading.Lock())
+        with variant_lock:
+            with self._lock:
+                variant = self._variants.get(key)
+            if variant is None:
+                variant = frame_variant(self.frame, pixel_format, key[1], self.pool)
+                with self._lock:
+                    self._variants[key] = variant
+        return variant
+
+
+class Mailbox:
+    """A bounded queue of frames for a single subscriber, delivered in order by its own thread.
+
+    Queued frames are retained (see `FrameVariants`) until they are delivered or dropped, and converted to the variant
+    of this subscriber on its thread, just before delivering them (so dropped frames are never converted).
+    """
+
+    def __init__(self, callback: Callable[[np.ndarray], None], pixel_format: Optional[str] = None,
+                 resolution: Optional[Tuple[int, int]] = None, max_rate: Optional[float] = None, size: int = 1,
+                 drop_policy: str = DROP_POLICIES[0], name: str = 'Mailbox'):
+        """
+        :param callback: the function to call with each frame, from the delivery thread.
+        :param pixel_format: the format of the frames for this subscriber, or None to receive them unconverted.
+        :param resolution: the maximum (width, height) of the frames for this subscriber (see `util.frames.fit_size`),
+            or None to receive them at their original size.
+        :param max_rate: the maximum frames per second for this subscriber, or None for no limit.
+        :param size: the maximum number of queued frames.
+        :param drop_policy: what to drop when the mailbox is full, see `DROP_POLICIES`.
+        :param name: the name of the delivery thread, for debugging.
+        """
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f'Unknown drop policy: {drop_policy}')
+        self.callback = callback
+        self.pixel_format = pixel_format
+        self.resolution = resolution
+        self.max_rate = max_rate
+        self._last_put_time = 0.0
+        self.size = max(1, size)
+        self.drop_policy = drop_policy
+        self.name = name
+        self._frames: Deque[FrameVariants] = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        # Stats & debug
+        self.stats_delivered = 0
+        self.stats_dropped = 0
+        # Start the delivery thread
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def wants_frame(self, now: float) -> bool:
+        """Whether a frame published now would not exceed the maximum rate of this subscriber."""
+        # Allow some jitter, so that e.g. a limit of 15 FPS takes every other frame of a 30 FPS source
+        return self.max_rate is None or now - self._last_put_time >= 0.9 / self.max_rate
+
+    def put(self, frame: FrameVariants):
+        """Queues a frame for delivery, dropping a frame if the mailbox is full. It never blocks."""
+        frame.retain()
+        self._last_put_time = time.time()
+        dropped = None
+        with self._cond:
+            if self._closed:
+                dropped = frame
+            elif len(self._frames) >= self.size:
+                self.stats_dropped += 1
+                if self.drop_policy == 'newest':
+                    dropped = frame
+                else:
+                    dropped = self._frames.popleft()
+                    self._frames.append(frame)
+            else:
+                self._frames.append(frame)
+            self._cond.notify()
+        if dropped is not None:
+            dropped.release()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._frames and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    break
+                frame = self._frames.popleft()
+            try:
+                self.callback(frame.get(self.pixel_format, self.resolution))
+            except Exception as e:  # Keep delivering frames, like the decoder did for failing listeners
+                Logger.exception('Mailbox: %s: listener failed: %s' % (self.name, e))
+            finally:
+                frame.release()
+            self.stats_delivered += 1
+
+    def close(self):
+        """Stops the delivery thread (after the current frame, if any) and drops the queued frames."""
+        with self._cond:
+            self._closed = True
+            pending = list(self._frames)
+            self._frames.clear()
+            self._cond.notify()
+        for frame in pending:
+            frame.release()
+
+
+class FrameFanout:
+    """Publishes each frame to the mailbox of every subscriber that wants it (see `Mailbox.max_rate`). Each requested
+    variant (pixel format and size) is computed at most once per frame, see `FrameVariants`.
+
+    Publishing only queues the frame, so the producer (e.g. the decoder thread) runs at its own pace, without paying
+    for any conversion, and each subscriber at its own one, dropping frames if it can't keep up.
+    """
+
+    def __init__(self, name: str = 'Video'):
+        self.name = name
+        self._lock = threading.Lock()
+        self._mailboxes: Tuple[Mailbox, ...] = ()  # Copy-on-write, so that publishing does not lock
+        self._next_id = 0
+        # Stats & debug
+        self.stats_published = 0
+
+    def subscribe(self, callback: Callable[[np.ndarray], None], pixel_format: Optional[str] = None,
+                  resolution: Optional[Tuple[int, int]] = None, max_rate: Optional[float] = None, size: int = 1,
+                  drop_policy: str = DROP_POLICIES[0]) -> Mailbox:
+        """Adds a new subscriber, see `Mailbox` for the parameters.
+
+        :return: the mailbox of the subscriber, to unsubscribe it.
+        """
+        with self._lock:
+            mailbox = Mailbox(callback, pixel_format, resolution, max_rate, size, drop_policy,
+                              f'{self.name}Listener-{self._next_id}')
+            self._next_id += 1
+            self._mailboxes = self._mailboxes + (mailbox,)
+        return mailbox
+
+    def unsubscribe(self, mailbox: Mailbox):
+        """Removes a subscriber and stops its delivery thread."""
+        with self._lock:
+            self._mailboxes = tuple(m for m in self._mailboxes if m is not mailbox)
+        mailbox.close()
+
+    @property
+    def mailboxes(self) -> Tuple[Mailbox, ...]:
+        """The mailboxes of the current subscribers."""
+        return self._mailboxes
+
+    def __len__(self):
+        return len(self._mailboxes)
+
+    def publish(self, frame: np.ndarray, pool: Optional[FramePool] = None):
+        """Queues the frame for all the subscribers. It never blocks.
+
+        :param frame: the frame to publish, which is retained by each mailbox until delivered.
+        :param pool: where to get the buffers of the frame variants from.
+        """
+        now = time.time()
+        variants = FrameVariants(frame, pool)
+        for mailbox in self._mailboxes:
+            if mailbox.wants_frame(now):
+                mailbox.put(variants)
+        variants.release()  # Our reference, the mailboxes retained their own ones
+
+        # Report stats
+        self.stats_published += 1
+        if self.stats_published % 100 == 0:
+            dropped = ', '.join(f'{m.name}: {m.stats_dropped}' for m in self._mailboxes if m.stats_dropped > 0)
+            if dropped:
+                Logger.info('FrameFanout: %s: %d frames published, dropped %s' %
+                            (self.name, self.stats_published, dropped))
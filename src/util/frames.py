@@ -0,0 +1,306 @@
+"""Helpers to work with the video frames published by the decoders, in any of the supported pixel formats."""
+
+import threading
+from collections import deque
+from typing import Optional, Tuple, Dict, Deque
+
+import cv2
+import numpy as np
+
+PIXEL_FORMATS = ['rgb24', 'yuv420p', 'gray']
+"""The supported formats of video frames:
+- rgb24: shape (width, height, 3), with the rows of RGB pixels (the shape is historical, the data is row-major).
+- yuv420p: shape (height * 3 / 2, width), with the full Y plane followed by the quarter-size U and V planes (I420).
+- gray: shape (width, height, 1), with the rows of luminance pixels (like rgb24).
+"""
+
+
+class FramePool:
+    """A fixed-size pool of preallocated frame buffers, recycled with reference counting.
+
+    The producer acquires a free buffer (holding its only reference), fills it and publishes it read-only to all the
+    listeners at once, releasing its reference afterwards. Listeners that keep a frame (or any view of it) after their
+    callback returns must call `retain_frame` and, once done with it, `release_frame`. A buffer is only reused when no
+    references remain, so that steady-state video does not allocate new frame memory and frames need no defensive
+    copies. If all the buffers are in use, new unpooled ones are allocated (see `stats_misses`).
+    """
+
+    _owners: Dict[int, 'FramePool'] = {}  # id(buffer) -> pool, to find the pool of any frame
+    _owners_lock = threading.Lock()
+
+    def __init__(self, capacity: int = 8):
+        """
+        :param capacity: the maximum number of buffers in the pool.
+        """
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._refs: Dict[int, int] = {}  # id(buffer) -> references, for the buffers in use
+        self._in_use: Dict[int, np.ndarray] = {}
+        self._free: Deque[np.ndarray] = deque()  # The least recently released first
+        self._closed = False
+        self.stats_misses = 0  # Buffers allocated outside the pool because all of them were in use
+
+    def acquire(self, shape: Tuple[int, ...]) -> np.ndarray:
+        """Returns a writable uint8 buffer of the given shape, with one reference owned by the caller."""
+        with self._lock:
+            if self._closed:
+                return np.empty(shape, dtype=np.uint8)
+            buffer = next((b for b in self._free if b.shape == shape), None)
+            if buffer is not None:
+                self._free.remove(buffer)
+            elif len(self._in_use) + len(self._free) < self.capacity or self._free:
+                if len(self._in_use) + len(self._free) >= self.capacity:
+                    self._forget(self._free.popleft())  # The frame size changed, drop the oldest free buffer
+                buffer = np.empty(shape, dtype=np.uint8)
+                with FramePool._owners_lock:
+                    FramePool._owners[id(buffer)] = self
+            else:
+                self.stats_misses += 1
+                return np.empty(shape, dtype=np.uint8)
+            buffer.flags.writeable = True
+            self._in_use[id(buffer)] = buffer
+            self._refs[id(buffer)] = 1
+            return buffer
+
+    def _retain(self, buffer: np.ndarray):
+        with self._lock:
+            if id(buffer) in self._refs:
+                self._refs[id(buffer)] += 1
+
+    def _release(self, buffer: np.ndarray):
+        with self._lock:
+            refs = self._refs.get(id(buffer))
+            if refs is None:
+                return  # Not in use, this is a bug of the caller (but it is safe to ignore)
+            if refs > 1:
+                self._refs[id(buffer)] = refs - 1
+            else:
+                del self._refs[id(buffer)]
+                self._free.append(self._in_use.pop(id(buffer)))
+
+    def close(self):
+        """Stops pooling: drops the free buffers, and the frames still in use become regular arrays (retaining or
+        releasing them does nothing), so that the memory of the pool is freed as soon as they are no longer used."""
+        with self._lock:
+            self._closed = True
+            for buffer in list(self._free) + list(self._in_use.values()):
+                self._forget(buffer)
+            self._free.clear()
+            self._in_use.clear()
+            self._refs.clear()
+
+    @staticmethod
+    def _forget(buffer: np.ndarray):
+        with FramePool._owners_lock:
+            del FramePool._owners[id(buffer)]
+
+    @staticmethod
+    def _owner_of(frame: np.ndarray) -> (Optional['FramePool'], np.ndarray):
+        buffer = frame if frame.base is None else frame.base  # Views always point to the array that owns the data
+        return FramePool._owners.get(id(buffer)), buffer
+
+
+def retain_frame(frame: np.ndarray):
+    """Keeps a frame (or any view of it) valid after the listener's callback returns, until `release_frame`.
+
+    It does nothing for frames that do not belong to a `FramePool`.
+    """
+    pool, buffer = FramePool._owner_of(frame)
+    if pool is not None:
+        pool._retain(buffer)
+
+
+def release_frame(frame: np.ndarray):
+    """Releases a reference to a frame, acquired from a `FramePool` or with `retain_frame`."""
+    pool, buffer = FramePool._owner_of(frame)
+    if pool is not None:
+        pool._release(buffer)
+
+
+def _new_frame(shape: Tuple[int, ...], pool: Optional[FramePool]) -> np.ndarray:
+    return pool.acquire(shape) if pool is not None else np.empty(shape, dtype=np.uint8)
+
+
+def frame_view(buffer, size: (int, int), line_size: int, pool: Optional[FramePool] = None) -> np.ndarray:
+    """Wraps a decoded RGB buffer as a read-only np.ndarray of (width, height, 3), without copying it if possible.
+
+    The array keeps a reference to the buffer, so it stays valid for as long as the array (or any view) is referenced,
+    unless rows are padded and the pool is used (see `FramePool`).
+
+    :param buffer: any object that implements the buffer protocol, with the rows of pixels of the image.
+    :param size: the (width, height) of the image.
+    :param line_size: the bytes of each row in the buffer, which may be padded for alignment (requires a copy).
+    :param pool: where to get the buffer for the copy from, if required.
+    """
+    width, height = size
+    frame = np.frombuffer(buffer, dtype=np.uint8)
+    if line_size != width * 3:
+        rows = frame.reshape((-1, line_size))[:height, :width * 3]
+        frame = _new_frame((width, height, 3), pool)
+        frame.reshape((height, width * 3))[...] = rows
+    frame = frame.reshape(-1)[:width * height * 3].reshape((width, height, 3))
+    frame.flags.writeable = False
+    return frame
+
+
+def writable_frame(frame: np.ndarray) -> np.ndarray:
+    """Implements copy-on-write for the frames shared by all video listeners.
+
+    :param frame: the frame received by a listener.
+    :return: the same frame if it may be modified in-place, or a private copy of it otherwise.
+    """
+    return frame if frame.flags.writeable else frame.copy()
+
+
+def frame_pixel_format(frame: np.ndarray) -> str:
+    """Returns the pixel format of a video frame (see `PIXEL_FORMATS`), which is determined by its shape."""
+    if frame.ndim == 3:
+        return 'rgb24' if frame.shape[2] == 3 else 'gray'
+    return 'yuv420p'
+
+
+def frame_size(frame: np.ndarray) -> (int, int):
+    """Returns the (width, height) of a video frame of any of the `PIXEL_FORMATS`."""
+    if frame.ndim == 3:
+        return frame.shape[0], frame.shape[1]
+    return frame.shape[1], frame.shape[0] * 2 // 3
+
+
+def yuv420p_planes(frame: np.ndarray) -> (np.ndarray, np.ndarray, np.ndarray):
+    """Returns views of the Y (height, width), U and V (height / 2, width / 2) planes of a yuv420p frame."""
+    width, height = frame_size(frame)
+    flat = frame.reshape(-1)
+    y_len, c_len = width * height, (width // 2) * (height // 2)
+    return (flat[:y_len].reshape((height, width)),
+            flat[y_len:y_len + c_len].reshape((height // 2, width // 2)),
+            flat[y_len + c_len:y_len + 2 * c_len].reshape((height // 2, width // 2)))
+
+
+def yuv420p_from_planes(planes: list, size: (int, int), line_sizes: list, pool: Optional[FramePool] = None) \
+        -> np.ndarray:
+    """Joins the (possibly padded) planes of a decoded yuv420p image into a read-only yuv420p frame.
+
+    :param planes: the Y, U and V planes, as objects that implement the buffer protocol.
+    :param size: the (width, height) of the image, which must be even.
+    :param line_sizes: the bytes of each row of each plane.
+    :param pool: where to get the buffer of the frame from.
+    """
+    width, height = size
+    frame = _new_frame((height * 3 // 2, width), pool)
+    for dst, src, line_size in zip(yuv420p_planes(frame), planes, line_sizes):
+        rows, cols = dst.shape
+        dst[...] = np.frombuffer(src, dtype=np.uint8)[:rows * line_size].reshape((rows, line_size))[:, :cols]
+    frame.flags.writeable = False
+    return frame
+
+
+def convert_frame(frame: np.ndarray, pixel_format: str, pool: Optional[FramePool] = None) -> np.ndarray:
+    """Converts a video frame to the given pixel format (see `PIXEL_FORMATS`), if it is not already in it.
+
+    :param frame: the frame to convert.
+    :param pixel_format: the wanted pixel format.
+    :param pool: where to get the buffer of the converted frame from.
+    :return: the same frame, or a new read-only frame in the requested format (the caller owns a reference to it).
+    """
+    source_pixel_format = frame_pixel_format(frame)
+    if source_pixel_format == pixel_format:
+        return frame
+    width, height = frame_size(frame)
+    if source_pixel_format == 'yuv420p' and pixel_format == 'gray':
+        # The Y plane is the grayscale image, so only a (retained) view is needed
+        retain_frame(frame)
+        return frame.reshape(-1)[:width * height].reshape((width, height, 1))
+    elif source_pixel_format == 'gray' and pixel_format == 'yuv420p':
+        converted = _new_frame((height * 3 // 2, width), pool)
+        converted.reshape(-1)[:width * height] = frame.reshape(-1)
+        converted.reshape(-1)[width * height:] = 128  # No color
+    else:
+        conversion = {
+            ('yuv420p', 'rgb24'): cv2.COLOR_YUV2RGB_I420, ('rgb24', 'yuv420p'): cv2.COLOR_RGB2YUV_I420,
+            ('rgb24', 'gray'): cv2.COLOR_RGB2GRAY, ('gray', 'rgb24'): cv2.COLOR_GRAY2RGB,
+        }[(source_pixel_format, pixel_format)]
+        source = frame if source_pixel_format == 'yuv420p' else frame.reshape((height, width, -1))
+        converted = _new_frame(_frame_shape(pixel_format, width, height), pool)
+        destination = converted if pixel_format == 'yuv420p' else converted.reshape((height, width, -1))
+        result = cv2.cvtColor(source, conversion, dst=destination)
+        if result is not destination:  # OpenCV did not write to the given buffer
+            converted.reshape(-1)[...] = result.reshape(-1)
+    converted.flags.writeable = False
+    return converted
+
+
+def _frame_shape(pixel_format: str, width: int, height: int) -> Tuple[int, ...]:
+    if pixel_format == 'yuv420p':
+        return height * 3 // 2, width
+    return width, height, 3 if pixel_format == 'rgb24' else 1
+
+
+def fit_size(size: (int, int), max_size: Optional[Tuple[int, int]], even: bool = False) -> (int, int):
+    """Returns the size scaled down (never up) to fit in max_size, keeping the aspect ratio.
+
+    :param size: the (width, height) to fit.
+    :param max_size: the maximum (width, height), or None for no limit.
+    :param even: whether to round the result down to even numbers (required by yuv420p).
+    """
+    width, height = size
+    if max_size is not None and (width > max_size[0] or height > max_size[1]):
+        scale = min(max_size[0] / width, max_size[1] / height)
+        width, height = max(1, int(width * scale)), max(1, int(height * scale))
+    if even:
+        width, height = max(2, width // 2 * 2), max(2, height // 2 * 2)
+    return width, height
+
+
+def frame_variant(frame: np.ndarray, pixel_format: str, max_size: Optional[Tuple[int, int]] = None,
+                  pool: Optional[FramePool] = None) -> np.ndarray:
+    """Returns the frame in the given pixel format, scaled down to fit in max_size (see `fit_size`).
+
+    Frames are scaled before converting them, which is cheaper as the conversion processes fewer pixels.
+
+    :param frame: the frame to convert.
+    :param pixel_format: the wanted pixel format, see `PIXEL_FORMATS`.
+    :param max_size: the maximum (width, height) of the result, or None to keep the size.
+    :param pool: where to get the buffers of the new frames from.
+    :return: the same frame or a new read-only frame, which the caller always owns a reference to.
+    """
+    size = frame_size(frame)
+    source_pixel_format = frame_pixel_format(frame)
+    new_size = fit_size(size, max_size, even=source_pixel_format == 'yuv420p' or pixel_format == 'yuv420p')
+    if new_size == size:
+        converted = convert_frame(frame, pixel_format, pool)
+        if converted is frame:
+            retain_frame(frame)  # Always return an owned reference
+        return converted
+    width, height = new_size
+    scaled = _new_frame(_frame_shape(source_pixel_format, width, height), pool)
+    if source_pixel_format == 'yuv420p':
+        for dst, src in zip(yuv420p_planes(scaled), yuv420p_planes(frame)):
+            dst[...] = cv2.resize(src, (dst.shape[1], dst.shape[0]), interpolation=cv2.INTER_AREA)
+    else:
+        channels = frame.shape[2]
+        scaled.reshape((height, width, channels))[...] = cv2.resize(
+            frame.reshape((size[1], size[0], channels)), (width, height),
+            interpolation=cv2.INTER_AREA).reshape((height, width, channels))
+    scaled.flags.writeable = False
+    converted = convert_frame(scaled, pixel_format, pool)
+    if converted is not scaled:
+        release_frame(scaled)
+    return converted
+
+
+def yuv420p_to_rgb(frame: np.ndarray, max_size: Optional[Tuple[int, int]] = None) -> np.ndarray:
+    """Converts a yuv420p frame to an RGB image in the [height, width, channels(3)] format used by AI algorithms.
+
+    :param frame: the yuv420p frame.
+    :param max_size: the maximum (width, height) of the result. The planes are downscaled (keeping the aspect ratio)
+    before the conversion, which is much cheaper than converting the full frame.
+    """
+    width, height = frame_size(frame)
+    if max_size is not None and (width > max_size[0] or height > max_size[1]):
+        scale = min(max_size[0] / width, max_size[1] / height)
+        small_width, small_height = max(2, int(width * scale) // 2 * 2), max(2, int(height * scale) // 2 * 2)
+        small = np.empty((small_height * 3 // 2, small_width), dtype=np.uint8)
+        for dst, src in zip(yuv420p_planes(small), yuv420p_planes(frame)):
+            dst[...] = cv2.resize(src, (dst.shape[1], dst.shape[0]), interpolation=cv2.INTER_AREA)
+        frame = small
+    return cv2.cvtColor(frame, cv2.COLOR_YUV2RGB_I420)
@@ -0,0 +1,90 @@
+"""Minimal helpers to work with H.264 Annex B byte streams (as sent by most drones) without decoding them."""
+
+from typing import List, Iterator, Tuple, Optional
+
+START_CODE = b'\x00\x00\x01'  # The 4-byte start code is the same one, preceded by a zero byte
+
+NAL_SLICE = 1
+NAL_IDR_SLICE = 5
+NAL_SPS = 7
+NAL_PPS = 8
+NAL_AUD = 9
+
+
+def iter_nal_units(data: bytes) -> Iterator[Tuple[int, int]]:
+    """Finds the NAL units in the data.
+
+    :param data: the Annex B byte stream.
+    :return: the (offset of the start code, NAL unit type) of each NAL unit, in order.
+    """
+    pos = data.find(START_CODE)
+    while pos >= 0 and pos + 3 < len(data):
+        offset = pos - 1 if pos > 0 and data[pos - 1] == 0 else pos  # Include the 4-byte start code
+        yield offset, data[pos + 3] & 0x1F
+        pos = data.find(START_CODE, pos + 3)
+
+
+def split_access_units(data: bytes) -> List[bytes]:
+    """Splits a byte stream into access units (the NAL units of each frame), e.g. to feed them at a given rate.
+
+    An access unit starts at each delimiter or parameter set, or at the first slice that follows another slice.
+    This is enough for the streams of drones, which only contain one slice per frame.
+
+    :param data: the Annex B byte stream.
+    :return: the access units, in order.
+    """
+    starts = []
+    previous_was_slice = True
+    for offset, nal_type in iter_nal_units(data):
+        is_slice = nal_type in (NAL_SLICE, NAL_IDR_SLICE)
+        if nal_type in (NAL_AUD, NAL_SPS) or (is_slice and previous_was_slice):
+            starts.append(offset)
+        previous_was_slice = is_slice or (previous_was_slice and nal_type not in (NAL_AUD, NAL_SPS, NAL_PPS))
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    return [data[start:end] for start, end in zip(starts, starts[1:] + [len(data)]) if end > start]
+
+
+class NalCoalescer:
+    """Accumulates a byte stream in a preallocated buffer and returns it in chunks that end at NAL unit boundaries.
+
+    Consumers like decoders then get fewer and larger calls, with no added latency: their parsers can't finish a NAL
+    unit until the start code of the next one arrives anyway.
+    """
+
+    def __init__(self, capacity: int = 1 << 20):
+        """
+        :param capacity: the initial size of the buffer, which grows if a NAL unit does not fit.
+        """
+        self._buffer = bytearray(capacity)
+        self._end = 0
+
+    def push(self, data: bytes) -> Optional[bytes]:
+        """Appends the next bytes of the stream.
+
+        :return: all the complete NAL units buffered so far, or None if there are none yet.
+        """
+        old_end, new_end = self._end, self._end + len(data)
+        if new_end > len(self._buffer):
+            self._buffer.extend(bytes(max(len(data), len(self._buffer))))
+        self._buffer[old_end:new_end] = data
+        self._end = new_end
+
+        # The buffer only starts with a start code, so a new boundary can only be in (or right before) the new data
+        boundary = self._buffer.rfind(START_CODE, max(0, old_end - len(START_CODE)), new_end)
+        if boundary > 0 and self._buffer[boundary - 1] == 0:
+            boundary -= 1  # Keep the 4-byte start code together
+        if boundary <= 0:
+            return None
+        with memoryview(self._buffer) as view:
+            chunk = bytes(view[:boundary])
+            tail = bytes(view[boundary:new_end])  # The incomplete NAL unit, which is usually small
+        self._buffer[:len(tail)] = tail
+        self._end = len(tail)
+        return chunk
+
+    def flush(self) -> bytes:
+        """Returns the remaining buffered bytes (e.g. when the stream ends), emptying the buffer."""
+        chunk = bytes(self._buffer[:self._end])
+        self._end = 0
+        return chunk
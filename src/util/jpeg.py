@@ -0,0 +1,66 @@
+"""Keeps photos as the JPEG bytes received from the camera, decoding them only when (and as little as) needed."""
+
+import io
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from util.metrics import Metrics
+
+PHOTO_WORKERS = ThreadPoolExecutor(max_workers=2, thread_name_prefix='PhotoWorker')
+"""The worker pool for the slow photo tasks (decoding and saving), so that they never run on the receiving thread."""
+
+
+class JpegPhoto:
+    """A photo as received from the camera, in JPEG format.
+
+    It can be saved as is (without re-encoding it), and decoded to pixels at a reduced size much faster than at full
+    size: PIL's draft mode makes the JPEG decoder skip the DCT coefficients that a 1/2, 1/4 or 1/8 scale doesn't need.
+    """
+
+    def __init__(self, data: bytes):
+        """
+        :param data: the bytes of the JPEG file.
+        """
+        self.data = data
+        self._size: Optional[Tuple[int, int]] = None
+
+    @property
+    def size(self) -> (int, int):
+        """The (width, height) of the photo, read from its header without decoding it."""
+        if self._size is None:
+            with Image.open(io.BytesIO(self.data), formats=['jpeg']) as img:
+                self._size = img.size
+        return self._size
+
+    def decode(self, resolution: Optional[Tuple[int, int]] = None) -> np.ndarray:
+        """Decodes the photo to RGB pixels, with shape (height, width, 3).
+
+        :param resolution: the minimum (width, height) wanted, e.g. for a preview: the photo is decoded at the smallest
+            JPEG scale that is at least this size, keeping its aspect ratio. None to decode it at full size.
+        :return: the decoded pixels.
+        """
+        start_time = time.perf_counter()
+        with Image.open(io.BytesIO(self.data), formats=['jpeg']) as img:
+            if resolution is not None:
+                img.draft('RGB', resolution)
+            # noinspection PyTypeChecker
+            frame = np.asarray(img.convert('RGB'))
+        Metrics.instance().metric('photo.decode_time' if resolution is None else 'photo.preview_time', 'ms').record(
+            (time.perf_counter() - start_time) * 1000)
+        return frame
+
+    def decode_async(self, resolution: Optional[Tuple[int, int]] = None) -> Future:
+        """Like `decode`, but in the `PHOTO_WORKERS` pool.
+
+        :return: the future decoded pixels.
+        """
+        return PHOTO_WORKERS.submit(self.decode, resolution)
+
+    def save(self, path: str):
+        """Writes the original JPEG bytes to a file, without re-encoding them."""
+        with open(path, 'wb') as f:
+            f.write(self.data)
@@ -0,0 +1,133 @@
+"""Named runtime metrics (e.g. of the video pipeline), recorded by any component and read by logs, UI or benchmarks."""
+
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class Metric:
+    """The recent samples of a value, e.g. the decoding time of each frame."""
+
+    def __init__(self, name: str, unit: str = '', window: int = 256):
+        """
+        :param name: the name of the metric.
+        :param unit: the unit of the samples, for display.
+        :param window: how many of the most recent samples to summarize.
+        """
+        self.name = name
+        self.unit = unit
+        self._samples = np.zeros(window, dtype=np.float64)
+        self._lock = threading.Lock()
+        self.count = 0
+        """The total number of recorded samples."""
+
+    def record(self, value: float):
+        with self._lock:
+            self._samples[self.count % len(self._samples)] = value
+            self.count += 1
+
+    def summary(self) -> Dict[str, float]:
+        """Returns the last value and the mean, 95th percentile and maximum of the recent samples."""
+        with self._lock:
+            samples = self._samples[:min(self.count, len(self._samples))].copy()
+            last = self._samples[(self.count - 1) % len(self._samples)] if self.count > 0 else np.nan
+        if len(samples) == 0:
+            return {'count': 0, 'last': np.nan, 'mean': np.nan, 'p95': np.nan, 'max': np.nan}
+        return {'count': self.count, 'last': float(last), 'mean': float(np.mean(samples)),
+                'p95': float(np.percentile(samples, 95)), 'max': float(np.max(samples))}
+
+    def __str__(self):
+        s = self.summary()
+        return '%s: mean %.2f%s, p95 %.2f%s, max %.2f%s' % (
+            self.name, s['mean'], self.unit, s['p95'], self.unit, s['max'], self.unit)
+
+
+class Rate:
+    """Counts events (e.g. reads of a stream) and records their rate per second into a metric, once per window."""
+
+    def __init__(self, metric: Metric, window: float = 1.0):
+        """
+        :param metric: where to record the rates.
+        :param window: the seconds to count events before recording their rate.
+        """
+        self.metric = metric
+        self.window = window
+        self._count = 0
+        self._window_start = time.time()
+
+    def tick(self, count: int = 1):
+        self._count += count
+        now = time.time()
+        if now - self._window_start >= self.window:
+            self.metric.record(self._count / (now - self._window_start))
+            self._count = 0
+            self._window_start = now
+
+
+class Histogram:
+    """The counts of a value in fixed buckets since the start, e.g. the number of frames dropped at once."""
+
+    def __init__(self, name: str, edges: List[float]):
+        """
+        :param name: the name of the metric.
+        :param edges: the lower bound of each bucket, in increasing order. Lower values go to the first bucket.
+        """
+        self.name = name
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = np.zeros(len(edges), dtype=np.int64)
+
+    def record(self, value: float):
+        self.counts[max(0, int(np.searchsorted(self.edges, value, side='right')) - 1)] += 1
+
+    def summary(self) -> Dict[str, float]:
+        """Returns the count of each bucket, keyed by its lower bound."""
+        return {'%g' % edge: int(count) for edge, count in zip(self.edges, self.counts)}
+
+    def __str__(self):
+        return '%s: %s' % (self.name, ', '.join('%s+: %d' % item for item in self.summary().items()))
+
+
+class Metrics:
+    """The registry of all metrics, by name. Getting a metric that does not exist yet creates it."""
+
+    _instance: Optional['Metrics'] = None
+
+    @staticmethod
+    def instance() -> 'Metrics':
+        """Returns the singleton instance of the registry."""
+        if Metrics._instance is None:
+            Metrics._instance = Metrics()
+        return Metrics._instance
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def metric(self, name: str, unit: str = '', window: int = 256) -> Metric:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Metric(name, unit, window)
+            return self._metrics[name]
+
+    def rate(self, name: str, window: float = 1.0) -> Rate:
+        """Returns a new counter of events, that records their rate into the metric of the given name."""
+        return Rate(self.metric(name, '/s'), window)
+
+    def histogram(self, name: str, edges: List[float]) -> Histogram:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Histogram(name, edges)
+            return self._metrics[name]
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Returns the summary of every metric, by name."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {m.name: m.summary() for m in metrics}
+
+    def __str__(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '; '.join(str(m) for m in metrics)
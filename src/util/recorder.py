@@ -0,0 +1,149 @@
+"""Records a live H.264 stream to a video file as it is received, without re-encoding it."""
+
+import io
+import os
+import threading
+import time
+from collections import deque
+from fractions import Fraction
+from typing import Deque, Optional, Tuple
+
+from kivy import Logger
+
+from util.h264 import iter_nal_units, split_access_units, NAL_SPS, NAL_IDR_SLICE
+
+CONTAINERS = ['mkv', 'mp4']
+"""The supported containers: Matroska files are still readable if the app is killed while recording, MP4 ones aren't.
+"""
+_CONTAINER_FORMATS = {'mkv': 'matroska', 'mp4': 'mp4'}
+
+
+class H264Recorder(threading.Thread):
+    """Muxes the raw bytes of a live H.264 Annex B stream into a container, timestamping each access unit (frame) with
+    the time it was received.
+
+    `write` only queues the bytes, so it can be called from the thread that feeds the decoder at almost no cost: this
+    thread splits them into access units and writes them to a buffered file. The recording starts at the first SPS, so
+    that the file can be decoded from its beginning, and the stream parameters are read from it.
+    """
+
+    TIME_BASE = Fraction(1, 90000)
+    """The time base of the timestamps, the usual one for video streams."""
+
+    def __init__(self, path: str, container: Optional[str] = None, buffer_size: int = 1 << 20):
+        """
+        :param path: the video file to write, which is overwritten.
+        :param container: the container format (see `CONTAINERS`), or None to guess it from the extension of path.
+        :param buffer_size: the size in bytes of the write buffer of the file.
+        """
+        super().__init__(name='H264Recorder', daemon=True)
+        self.path = path
+        self.container = container or os.path.splitext(path)[1][1:].lower()
+        if self.container not in CONTAINERS:
+            raise ValueError(f'Unknown container: {self.container}')
+        self.buffer_size = buffer_size
+        self._chunks: Deque[Tuple[float, bytes]] = deque()
+        self._cond = threading.Condition()
+        self._closing = False
+        # Output, opened on the first SPS
+        self._file: Optional[io.BufferedWriter] = None
+        self._output = None
+        self._stream = None
+        self._start_time = 0.0
+        self._last_pts = -1
+        # Stats & debug
+        self.stats_frames = 0
+        self.stats_skipped = 0
+        self.stats_bytes = 0
+
+    def write(self, data: bytes):
+        """Queues the next bytes of the stream to be recorded. It never blocks."""
+        with self._cond:
+            if not self._closing:
+                self._chunks.append((time.time(), data))
+                self._cond.notify()
+
+    def close(self, timeout: Optional[float] = None):
+        """Stops recording, after writing all the queued bytes and finalizing the file in the background.
+
+        :param timeout: the seconds to wait for the file to be finalized, or None to return immediately. This thread is
+            a daemon, so it must be waited for when the app exits, or the file would be truncated (or unreadable).
+        """
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        if timeout is not None and self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+            if self.is_alive():
+                Logger.warning('H264Recorder: %s was not finalized after %.1fs' % (self.path, timeout))
+
+    def run(self):
+        Logger.info('H264Recorder: recording to %s' % self.path)
+        pending, pending_time = b'', 0.0  # The last access unit, which is not complete until the next one starts
+        try:
+            while True:
+                with self._cond:
+                    while not self._chunks and not self._closing:
+                        self._cond.wait()
+                    if not self._chunks:
+                        break
+                    chunk_time, data = self._chunks.popleft()
+                if not pending:
+                    pending_time = chunk_time
+                access_units = split_access_units(pending + data)
+                for i, access_unit in enumerate(access_units[:-1]):
+                    self._write_access_unit(access_unit, pending_time if i == 0 else chunk_time)
+                if len(access_units) > 1:
+                    pending_time = chunk_time
+                pending = access_units[-1] if access_units else b''
+            if pending:
+                self._write_access_unit(pending, pending_time)
+        except Exception as e:  # Never break the video stream, only this recording
+            Logger.exception('H264Recorder: recording to %s failed: %s' % (self.path, e))
+        finally:
+            self._close_output()
+
+    def _write_access_unit(self, access_unit: bytes, received_time: float):
+        nal_types = [nal_type for _, nal_type in iter_nal_units(access_unit)]
+        if self._output is None:
+            if NAL_SPS not in nal_types:
+                self.stats_skipped += 1  # Can't be decoded without the previous parameter sets
+                return
+            self._open_output(access_unit)
+            self._start_time = received_time
+
+        import av
+        packet = av.Packet(access_unit)
+        packet.stream = self._stream
+        packet.time_base = self.TIME_BASE
+        pts = max(self._last_pts + 1, int((received_time - self._start_time) / self.TIME_BASE))
+        packet.pts, packet.dts = pts, pts  # Drones don't use B-frames, so frames are decoded in presentation order
+        packet.is_keyframe = NAL_IDR_SLICE in nal_types
+        self._output.mux(packet)
+        self._last_pts = pts
+        self.stats_frames += 1
+        self.stats_bytes += len(access_unit)
+
+    def _open_output(self, first_access_unit: bytes):
+        """Opens the container, copying the stream parameters from probing the first access unit (no encoder needed).
+        """
+        import av
+        with av.open(io.BytesIO(first_access_unit), format='h264') as probe:
+            template = probe.streams.video[0]
+            self._file = open(self.path, 'wb', buffering=self.buffer_size)
+            self._output = av.open(self._file, 'w', format=_CONTAINER_FORMATS[self.container])
+            if hasattr(self._output, 'add_stream_from_template'):
+                self._stream = self._output.add_stream_from_template(template)
+            else:  # PyAV < 13
+                self._stream = self._output.add_stream(template=template)
+        self._stream.time_base = self.TIME_BASE
+        Logger.info('H264Recorder: recording %dx%d video after skipping %d frames' % (
+            self._stream.width, self._stream.height, self.stats_skipped))
+
+    def _close_output(self):
+        if self._output is not None:
+            self._output.close()  # Writes the trailer
+        if self._file is not None:
+            self._file.close()
+        Logger.info('H264Recorder: recorded %d frames (%.1f MB) to %s' % (
+            self.stats_frames, self.stats_bytes / 1e6, self.path))
@@ -0,0 +1,93 @@
+"""Asks a live H.264 source for new sync points only when the decoder needs them, instead of continuously."""
+
+import time
+from typing import Callable, Optional
+
+from kivy import Logger
+
+from util.h264 import iter_nal_units, NAL_IDR_SLICE
+from util.metrics import Metrics
+
+
+class KeyframeRequester:
+    """Requests a sync point (SPS/PPS and an IDR frame) when the decoder is starved (data is fed but no frame is
+    decoded for a while) or reports errors, retrying with exponential backoff until a frame is decoded again.
+
+    Every request costs an uplink packet, and every keyframe inflates the bitrate of the stream, so a healthy stream
+    is left alone. Call `on_data`, `on_frame` and `on_error` as the stream progresses, and `poll` regularly.
+    """
+
+    def __init__(self, request: Callable[[], None], starvation_timeout: float = 0.3, min_interval: float = 0.2,
+                 max_interval: float = 5.0):
+        """
+        :param request: the function that asks the source for a sync point.
+        :param starvation_timeout: the seconds without decoded frames, while data is fed, to consider it starved.
+        :param min_interval: the seconds between the first requests of a recovery, doubled after each one.
+        :param max_interval: the maximum seconds between requests.
+        """
+        self.request = request
+        self.starvation_timeout = starvation_timeout
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._last_frame_time = time.time()
+        self._last_data_time = 0.0
+        self._errors = 0  # Since the last keyframe
+        self._interval = min_interval
+        self._next_request_time = 0.0
+        self._recovery_start: Optional[float] = None
+        self._last_keyframe_time: Optional[float] = None
+        # Stats & debug (see `util.metrics`)
+        self.stats_requests = 0
+        metrics = Metrics.instance()
+        self.metric_recovery_time = metrics.metric('video.recovery_time', 'ms')
+        """The time from detecting a broken stream until a frame is decoded again."""
+        self.metric_keyframe_interval = metrics.metric('video.keyframe_interval', 's')
+        """The time between the keyframes of the stream (its inverse is the keyframe rate)."""
+
+    def on_data(self, data: bytes):
+        """Accounts for the next bytes of the stream, to measure the keyframe rate."""
+        now = time.time()
+        if now - self._last_data_time > self.starvation_timeout:
+            self._last_frame_time = max(self._last_frame_time, now)  # The stream was paused, not starved
+        self._last_data_time = now
+        if any(nal_type == NAL_IDR_SLICE for _, nal_type in iter_nal_units(data)):
+            if self._last_keyframe_time is not None:
+                self.metric_keyframe_interval.record(now - self._last_keyframe_time)
+            self._last_keyframe_time = now
+            self._errors = 0  # The decoder can start over from this keyframe
+
+    def on_frame(self):
+        """Accounts for a decoded frame, which means that the stream is (again) healthy unless there were errors."""
+        now = time.time()
+        self._last_frame_time = now
+        if self._recovery_start is not None and self._errors == 0:
+            self.metric_recovery_time.record((now - self._recovery_start) * 1000)
+            self._recovery_start = None
+            self._interval = self.min_interval
+
+    def on_error(self, count: int = 1):
+        """Accounts for decoding errors, which mean that the following frames are corrupted until the next keyframe."""
+        self._errors += count
+
+    def poll(self):
+        """Requests a sync point if the stream is broken and the backoff interval elapsed. Call it after `on_data`."""
+        now = time.time()
+        starved = now - self._last_frame_time > self.starvation_timeout
+        if not (starved or self._errors > 0) or now < self._next_request_time:
+            return
+        if self._recovery_start is None:
+            self._recovery_start = now
+            Logger.info('KeyframeRequester: stream broken (%s), requesting a sync point' % (
+                'starved' if starved else '%d errors' % self._errors))
+        self.request()
+        self.stats_requests += 1
+        self._next_request_time = now + self._interval
+        self._interval = min(self._interval * 2, self.max_interval)
+
+    def reset(self):
+        """Forgets the previous state, e.g. when the decoder is (re)started and is not expected to decode yet."""
+        self._last_frame_time = time.time()
+        self._errors = 0
+        self._interval = self.min_interval
+        self._next_request_time = 0.0
+        self._recovery_start = None
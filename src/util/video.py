@@ -1,15 +1,111 @@
+import functools
 import socket
 import threading
 import time
 import weakref
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, List, Optional
 
 import numpy as np
-from ffpyplayer.player import MediaPlayer
-from ffpyplayer.tools import emit_library_info
 from kivy import Logger
 from kivy.clock import Clock
 from kivy.event import EventDispatcher
 
+from util.frames import PIXEL_FORMATS, FramePool, frame_view, release_frame, yuv420p_from_planes
+from util.metrics import Metrics
+
+THREAD_TYPES = ['auto', 'slice', 'frame']
+"""How the decoder splits the work among threads: slice threading adds no latency but only helps if the stream has
+several slices per frame, while frame threading scales better but delays each frame by one frame per extra thread."""
+
+
+@dataclass
+class VideoDecoderOptions:
+    """The options of the FFmpeg H.264 decoder, see `DECODER_PRESETS`."""
+
+    threads: int = 0
+    """The number of decoding threads, or 0 for automatic (based on the number of CPUs)."""
+
+    thread_type: str = THREAD_TYPES[0]
+    """How to split the work among the threads, see `THREAD_TYPES`."""
+
+    low_delay: bool = False
+    """Output each frame as soon as it is decoded, and don't buffer the input to probe the stream."""
+
+    probe_size: int = 5000000
+    """How many bytes of the stream to probe for its parameters before decoding (only for ffpyplayer)."""
+
+    def ffmpeg_options(self) -> Dict[str, str]:
+        """Returns the options for the FFmpeg libraries (codec and format), as strings."""
+        options = {
+            'threads': str(self.threads) if self.threads > 0 else 'auto',
+            'thread_type': 'slice+frame' if self.thread_type == 'auto' else self.thread_type,
+            'probesize': str(self.probe_size),
+        }
+        if self.low_delay:
+            options.update({'flags': 'low_delay', 'fflags': 'nobuffer', 'analyzeduration': '0'})
+        return options
+
+
+DECODER_PRESETS = {
+    'default': VideoDecoderOptions(),
+    'low latency': VideoDecoderOptions(threads=0, thread_type='slice', low_delay=True, probe_size=32),
+    'throughput': VideoDecoderOptions(threads=0, thread_type='frame', low_delay=False, probe_size=5000000),
+}
+"""Decoder options: the defaults of FFmpeg (as used before these options existed), the lowest latency for live video
+(opt-in, as a tiny probe may fail to open some streams) and the most decoded frames per second (e.g. to benchmark)."""
+
+_FFPYPLAYER_ERROR_LEVELS = ['panic', 'fatal', 'error']
+_ffpyplayer_sources: 'weakref.WeakSet[StreamingVideoSource]' = weakref.WeakSet()
+"""The live ffpyplayer sources, which receive the decoding errors of its global log, see `_on_ffpyplayer_log`."""
+_ffpyplayer_log_lock = threading.Lock()
+_ffpyplayer_log_installed = False
+_ffpyplayer_log_previous: Optional[Callable[[str, str], None]] = None  # e.g. the one of Kivy's ffpyplayer providers
+
+
+def _install_ffpyplayer_log():
+    """Installs `_on_ffpyplayer_log` as the (process-global) log callback of ffpyplayer, once, chaining to the
+    previous one."""
+    global _ffpyplayer_log_installed, _ffpyplayer_log_previous
+    from ffpyplayer.tools import set_log_callback
+    with _ffpyplayer_log_lock:
+        if not _ffpyplayer_log_installed:
+            _ffpyplayer_log_previous = set_log_callback(_on_ffpyplayer_log)  # Returns the previous callback
+            _ffpyplayer_log_installed = True
+
+
+def _on_ffpyplayer_log(message: str, level: str):
+    """The log callback of ffpyplayer, which only reports decoding errors in its log. As the messages can't be told
+    apart by source, each error of the H.264 decoder is reported to every live ffpyplayer source. Every message is
+    also passed to the previous callback, if any."""
+    if _ffpyplayer_log_previous is not None:
+        _ffpyplayer_log_previous(message, level)
+    if level not in _FFPYPLAYER_ERROR_LEVELS:
+        return
+    message = message.strip()
+    if _ffpyplayer_log_previous is None:  # Otherwise, it already logged it
+        Logger.warning('Video: ffpyplayer: %s' % message)
+    if '[h264' in message:  # Not the demuxer or the loopback socket
+        for source in list(_ffpyplayer_sources):
+            if source.closing is False:  # Neither closing nor stopped
+                source.dispatch('on_video_error', RuntimeError(message))
+
+
+@functools.lru_cache(maxsize=None)
+def pyav_available() -> bool:
+    """Whether PyAV (the optional `av` package, see the pyav extra of the project) can be imported, checked once."""
+    try:
+        import av  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def available_decoders() -> List[str]:
+    """Returns the `StreamingVideoSource.DECODERS` that can be used, as their packages are installed."""
+    return [decoder for decoder in StreamingVideoSource.DECODERS if decoder != 'pyav' or pyav_available()]
+
 
 class StreamingVideoSource(threading.Thread, EventDispatcher):
     """This class provides a simple way to decode any streaming video source into python arrays for each (video) frame.
@@ -18,20 +114,86 @@ class StreamingVideoSource(threading.Thread, EventDispatcher):
     See :func:`util.video.StreamingVideoSource.on_video_frame` for more details.
     """
 
-    # TODO: Take ideas from VideoFFPy (e.g. yuv420p rendering through shader!)
+    DECODERS = ['ffpyplayer', 'pyav']
+    """The decoder backends. ffpyplayer reads the data from a loopback socket, while pyav (PyAV, which must be installed
+    separately, see `available_decoders`) parses and decodes the fed data in-process."""
+
+    WAKE_MODES = ['event', 'poll']
+    """How the video thread waits for new frames. event sleeps until new data is fed or the decoder's next frame is
+    due, while poll checks for new frames every 10ms (the original behavior, kept for benchmarking)."""
+
+    MAX_DRAINED = 32
+    """The most decoded frames that low latency mode drains at once from ffpyplayer, so that a decoder that is always
+    ahead (e.g. at a high playback speed) can't starve the listeners."""
 
-    def __init__(self, playback_speed=1.0):
+    default_decoder = DECODERS[0]
+    """The decoder backend used when none is given, which the app sets from its settings."""
+
+    default_options = DECODER_PRESETS['default']
+    """The decoder options used when none are given, which the app sets from its settings."""
+
+    def __init__(self, playback_speed=1.0, decoder: Optional[str] = None, low_latency: bool = False,
+                 wake_mode: str = WAKE_MODES[0], pixel_format: str = 'rgb24',
+                 options: Optional[VideoDecoderOptions] = None):
         """
         Set up the :class:`Video` player.
 
         :param playback_speed: The speed to play the video at. Useful to catch up to livestreams.
+        :param decoder: The decoder backend to use (see `DECODERS`), or None for `default_decoder`.
+        :param low_latency: Drain all the decoded frames that are ready and only publish the newest one, dropping the
+        stale ones. This keeps the latency of live sources constant even if some listener is temporarily slow.
+        :param wake_mode: How to wait for new frames, see `WAKE_MODES`.
+        :param pixel_format: The format of the published frames, see `util.frames.PIXEL_FORMATS`. yuv420p skips the
+        CPU conversion to RGB (which the UI may do on the GPU).
+        :param options: The options of the decoder, or None for `default_options`.
         """
         super(StreamingVideoSource, self).__init__(daemon=False)
         # Parameters
         self.playback_speed = playback_speed
+        self.decoder = decoder = decoder or StreamingVideoSource.default_decoder
+        self.low_latency = low_latency
+        if wake_mode not in StreamingVideoSource.WAKE_MODES:
+            raise ValueError(f'Unknown video wake mode: {wake_mode}')
+        self.wake_mode = wake_mode
+        if pixel_format not in PIXEL_FORMATS:
+            raise ValueError(f'Unknown video pixel format: {pixel_format}')
+        self.pixel_format = pixel_format
+        self.options = options or StreamingVideoSource.default_options
+        if self.options.thread_type not in THREAD_TYPES:
+            raise ValueError(f'Unknown video decoder thread type: {self.options.thread_type}')
+        self.frame_pool = FramePool()  # For the frames that can't wrap the decoder's buffers
         # Events
         self.register_event_type('on_video_frame')
+        self.register_event_type('on_video_error')
+        # Decoder backends
+        self.player = None
+        self.codec = None
+        self.closing = False
+        if decoder == 'ffpyplayer':
+            self._init_ffpyplayer()
+        elif decoder == 'pyav':
+            self._init_pyav()
+        else:
+            raise ValueError(f'Unknown video decoder: {decoder}')
+        # Stats & debug (see `util.metrics`)
+        metrics = Metrics.instance()
+        self.metric_decode_time = metrics.metric('video.decode_time', 'ms')
+        """The time to get each decoded frame ready to publish (for ffpyplayer, which decodes on its own thread,
+        only to retrieve and wrap it)."""
+        self.metric_publish_time = metrics.metric('video.publish_time', 'ms')
+        """The time to run the listeners of each frame."""
+        self.metric_queue_depth = metrics.metric('video.queue_depth', ' frames')
+        """The number of decoded frames that were ready at once."""
+        self.metric_dropped = metrics.histogram('video.dropped', [0, 1, 2, 4, 8, 16])
+        """How many stale frames were dropped at once to catch up (only with low_latency)."""
+        # Releases the decoder in case the user forgets to call close() (it must not reference self)
+        self._finalizer = weakref.finalize(self, StreamingVideoSource._release, self.player, self.frame_pool,
+                                           [getattr(self, 'out', None), getattr(self, 'socket_out', None)])
 
+    def _init_ffpyplayer(self):
+        """Starts the ffpyplayer decoder, which reads the fed data from a loopback socket."""
+        from ffpyplayer.player import MediaPlayer
+        from ffpyplayer.tools import emit_library_info
         # Register a socket to feed data to the video decoder
         self.socket_out = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket_out.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # Don't wait before sending data
@@ -41,81 +203,180 @@ class StreamingVideoSource(threading.Thread, EventDispatcher):
         self.socket_out.listen(1)
         # Start the video decoder and connect it to the socket
         # noinspection PyUnresolvedReferences,PyArgumentList
-        self.player = MediaPlayer(self.socket_address, ff_opts={  # TODO: configure more ffmpeg options
-            'framedrop': True, 'stats': True, 'fast': True, 'an': True,
+        self.player = MediaPlayer(self.socket_address, ff_opts={
+            'framedrop': True, 'fast': True, 'an': True,
             # Apply a video filter to catch up to live source as long as more frames are available.
             'vf': ['setpts=' + str(1 / self.playback_speed) + '*PTS'],
-        })
-        self.player.set_output_pix_fmt('rgb24')  # Should be the default, but just in case
-        self.closing = False
+        }, lib_opts=self.options.ffmpeg_options())
+        self.player.set_output_pix_fmt(self.pixel_format)
+        self._fed = threading.Event()  # Set when data is fed, to wake up the idle video thread
+        self._fed_time = 0.0
         # Accept the connection (should be queued) from the video decoder to be able to feed data
         self.out, client_address = self.socket_out.accept()
-        # Stats & debug
-        self.stats_frame_time = 0
-        self.stats_frame_time_counter = 0
+        _install_ffpyplayer_log()  # To report its decoding errors, see on_video_error
+        _ffpyplayer_sources.add(self)
         emit_library_info()
-        # Finalizer (in case the user forgets to call del)
-        weakref.finalize(self, self.__del__)
+
+    def _init_pyav(self):
+        """Creates the in-process PyAV decoder, which avoids the loopback socket and its kernel copies."""
+        import av
+        self.codec = av.CodecContext.create('h264', 'r')
+        self.codec.thread_count = self.options.threads
+        thread_type = self.options.thread_type
+        self.codec.thread_type = 'AUTO' if thread_type == 'auto' else thread_type.upper()
+        if self.options.low_delay:
+            self.codec.options = {'flags': 'low_delay'}
+        self._pending: Deque[bytes] = deque()
+        self._pending_cond = threading.Condition()
+        Logger.info('Video: using PyAV %s' % av.__version__)
 
     def feed(self, bs: bytes):
         """Provides the given video source bytes to the decoder, that will produce events when each frame is available.
 
         :param bs: the next block of data to decode
         """
-        self.out.sendall(bs)
+        if self.codec is not None:
+            with self._pending_cond:
+                self._pending.append(bs)
+                self._pending_cond.notify()
+        else:
+            try:
+                self.out.sendall(bs)
+            except OSError:
+                if self.closing is False:
+                    raise
+                return  # Closed concurrently, see close()
+            self._fed_time = time.time()
+            self._fed.set()
 
     def run(self):
         """The video thread that produces frame events. Call start() to start this thread.
         """
+        if self.codec is not None:
+            self._run_pyav()
+        else:
+            self._run_ffpyplayer()
+        # Inform that the thread finished, releasing the decoder if close() was called from this thread (a listener)
+        closed, self.closing = self.closing, None
+        if closed:
+            self._finalizer()
 
+    def _run_ffpyplayer(self):
         # Start reading video frames and sending them to the main thread
         while not self.closing:
             # Read frame from source
             start_time = Clock.time()
-            frame, val = self.player.get_frame()  # FIXME: Catchup to the latest frame!
+            frame, val = self.player.get_frame()
             if val == 'eof':
                 break  # EOF todo: notify/handle this
             elif frame is None:
-                time.sleep(0.01)  # FIXME: Better solution than this to wait between frames?
+                self._wait_ffpyplayer(val)
                 continue  # No new frame yet
 
-            # Convert frame to np.ndarray of (width, height, 3)
+            # Catch up to the latest frame: while the next one is already due (no delay left), this one is stale
+            queue_depth = 1
+            while self.low_latency and not isinstance(val, str) and val <= 0 and queue_depth < self.MAX_DRAINED:
+                next_frame, val = self.player.get_frame()
+                if next_frame is None:  # Nothing ready yet (val is the delay until the next frame), 'eof' or 'paused'
+                    break
+                frame = next_frame
+                queue_depth += 1
+            self._update_queue_stats(queue_depth, queue_depth - 1 if self.low_latency else None)
+
+            # Wrap the frame's buffer (without copying it) as a np.ndarray of (width, height, 3), or join the planes
             frame_size = frame[0].get_size()
-            frame = np.array(frame[0].to_memoryview()[0]).reshape((frame_size[0], frame_size[1], 3))
-
-            # Run all listeners before publishing the frame. Bind is applied in reverse order.
-            # They may modify the frame in-place, but should do long-running operations in a separate thread.
-            self.dispatch('on_video_frame', frame)
-
-            # Update and report stats
-            self.stats_frame_time = (Clock.time() - start_time) * 0.5 + self.stats_frame_time * 0.5
-            self.stats_frame_time_counter += 1
-            if self.stats_frame_time_counter % 100 == 0:
-                Logger.info('Video: Avg frame time: %.3f (%.1f max FPS)' %
-                            (self.stats_frame_time, 1 / self.stats_frame_time))
-                self.stats_frame_time_counter = 0
-
-        # Inform that the thread finished
-        self.closing = None
-
-    def run_av(self):
-        """Version using PyAV instead of ffpyplayer. It can be installed on all platforms (after some hacks), but cannot
-        run in any platform (AFAIK).
+            if self.pixel_format == 'yuv420p':
+                frame = yuv420p_from_planes(
+                    frame[0].to_memoryview(), frame_size, frame[0].get_linesizes(), self.frame_pool)
+            else:
+                frame = frame_view(frame[0].to_memoryview()[0], frame_size, frame[0].get_linesizes()[0],
+                                   self.frame_pool)  # Rows may be padded for alignment, which requires a copy
+
+            self._publish(frame, start_time)
+
+    def _wait_ffpyplayer(self, val):
+        """Waits until the decoder may have a new frame ready.
+
+        :param val: the value returned by `get_frame` with no frame, which is the delay until the next frame is due.
+        """
+        if self.wake_mode == 'poll':
+            time.sleep(0.01)
+            return
+        self._fed.clear()  # Before checking the last feed time, so that no feed is missed
+        if time.time() - self._fed_time < 0.5:
+            # Data is being decoded, so follow the pacing hint of the decoder (which is at most its refresh rate), but
+            # wake up as soon as more data is fed, as it may complete the next frame
+            timeout = min(max(val, 0.001), 0.01) if isinstance(val, float) else 0.01
+        else:
+            # Idle: sleep until more data is fed (with a timeout to also check the closing condition)
+            timeout = 0.25
+        self._fed.wait(timeout)
+        self._fed.clear()
+
+    def _run_pyav(self):
+        """Parses the fed data into packets and decodes them in-process, as soon as they are available.
         """
         import av
-        Logger.info('Video: starting container')
-        container = av.open(self.socket_address, mode='r', format='h264', options={'framedrop': '1'})
-        Logger.info('Video: container ready')
-        for frame in container.decode(video=0):
-            Logger.info('Video: container gave frame')
-            if self.closing:
-                break  # No more listeners!
-            frame_ndarray = frame.to_ndarray()
-            self.dispatch('on_video_frame', frame_ndarray)
-        Logger.info('Video: container closing')
-        container.close()
-        # Inform that the thread finished
-        self.closing = None
+        while not self.closing:
+            # Wait for more data to be fed
+            with self._pending_cond:
+                while self.wake_mode == 'event' and not self._pending and not self.closing:
+                    self._pending_cond.wait(0.5)  # Timeout to also check the closing condition
+                data = b''.join(self._pending)
+                self._pending.clear()
+            if not data:
+                if self.wake_mode == 'poll':
+                    time.sleep(0.01)
+                continue
+
+            # Parse the data into packets and decode them
+            start_time = Clock.time()
+            frames = []
+            try:
+                for packet in self.codec.parse(data):
+                    frames.extend(self.codec.decode(packet))
+            except av.error.FFmpegError as e:
+                Logger.warning('Video: decoding error: %s' % e)  # Corrupted data, the next sync point will fix it
+                self.dispatch('on_video_error', e)
+
+            # Only convert and publish the newest frame if catching up, as the others are already stale
+            if not frames:
+                continue
+            decode_time = (Clock.time() - start_time) / len(frames)  # The share of each frame
+            if self.low_latency:
+                self._update_queue_stats(len(frames), len(frames) - 1)
+                frames = frames[-1:]
+            else:
+                self._update_queue_stats(len(frames), None)
+            for frame in frames:
+                start_time = Clock.time() - decode_time
+                frame = frame.reformat(format=self.pixel_format)  # No-op for yuv420p, which is the usual H.264 output
+                if self.pixel_format == 'yuv420p':
+                    frame_ndarray = yuv420p_from_planes(frame.planes, (frame.width, frame.height),
+                                                        [plane.line_size for plane in frame.planes], self.frame_pool)
+                else:
+                    # Convert frame to np.ndarray of (width, height, 3), like ffpyplayer, wrapping the converted buffer
+                    plane = frame.planes[0]
+                    frame_ndarray = frame_view(plane, (frame.width, frame.height), plane.line_size, self.frame_pool)
+                self._publish(frame_ndarray, start_time)
+
+    def _update_queue_stats(self, queue_depth: int, dropped: Optional[int]):
+        """Accounts for the decoded frames that were ready at once and the stale ones that were dropped (if any
+        could be dropped)."""
+        self.metric_queue_depth.record(queue_depth)
+        if dropped is not None:
+            self.metric_dropped.record(dropped)
+
+    def _publish(self, frame: np.ndarray, start_time: float):
+        """Notifies the listeners of a new decoded frame and updates the stats."""
+        publish_time = Clock.time()
+        self.metric_decode_time.record((publish_time - start_time) * 1000)
+
+        # Run all listeners before publishing the frame. Bind is applied in reverse order.
+        # They should do long-running operations in a separate thread, retaining the frame (see `FramePool`).
+        self.dispatch('on_video_frame', frame)
+        release_frame(frame)  # The decoder's reference, the buffer is recycled once the listeners release it
+        self.metric_publish_time.record((Clock.time() - publish_time) * 1000)
 
     def on_video_frame(self, frame: np.ndarray):
         """
@@ -125,25 +386,52 @@ class StreamingVideoSource(threading.Thread, EventDispatcher):
         Note that this event is dispatched from the video thread, so you should not do long-running operations in it.
 
         :param frame: the numpy.ndarray that represents the frame with a shape of (width, height, 3) representing
-        the red, green and blue channels for each pixel.
+        the red, green and blue channels for each pixel (or a yuv420p frame, see `util.frames.PIXEL_FORMATS`). It is a
+        read-only view of the decoder's buffer (or a buffer of `frame_pool`), which is only valid until this callback
+        returns unless it is retained (see `util.frames.retain_frame`). Use `util.frames.writable_frame` to modify it.
         """
         pass
 
-    def __del__(self):
-        """Cleans up the resources.
+    def on_video_error(self, error: Exception):
         """
-        # Wait for the video thread to stop (ugly and possibly racy)
-        if self.closing is not None:
-            Logger.info('Video: waiting for thread to stop')
+        This is the event that is dispatched when the decoder reports an error, from the video thread (or a thread of
+        ffpyplayer). The following frames may be corrupted (or missing) until the next sync point of the stream.
+
+        :param error: the decoding error. ffpyplayer only logs them, so they are read from its log (see
+        `_on_ffpyplayer_log`), which is shared: with several ffpyplayer sources, each of them receives every error.
+        """
+        pass
+
+    def close(self):
+        """Stops the video thread, waiting for it, and releases the decoder. Any data fed afterwards is ignored.
+
+        It may be called more than once, and from the listeners of the video thread (which then releases the decoder
+        when it stops, as it can't wait for itself).
+        """
+        if self.closing is False:
             self.closing = True
-            while self.closing is not None:
-                time.sleep(0.01)
+        _ffpyplayer_sources.discard(self)
+        if self.codec is not None:
+            with self._pending_cond:
+                self._pending_cond.notify()
+        else:
+            self._fed.set()
+        if threading.current_thread() is self:
+            return
+        if self.is_alive():
+            Logger.info('Video: waiting for thread to stop')
+            self.join()
             Logger.info('Video: thread stopped')
+        self._finalizer()
 
-        # Clean up the video player
-        if self.player:
-            self.player.close_player()
-        # Clean up the socket
-        self.out.close()
-        self.socket_out.close()
+    @staticmethod
+    def _release(player, frame_pool: FramePool, sockets):
+        """Releases the decoder, see close(). It is also the finalizer of the video source, so it takes no self."""
+        if player is not None:
+            player.close_player()
+        frame_pool.close()
+        for sock in sockets:
+            if sock is not None:
+                sock.close()
         Logger.info('Video: released')
+
@@ -0,0 +1,68 @@
+"""Benchmarks the decode thread of `StreamingVideoSource`, comparing its wake-up modes on a recorded H.264 stream.
+
+Run it with `python main.py v <video.h264> [decoder]`. For each wake-up mode, it measures the CPU usage while no data
+is fed (idle) and the latency from feeding each access unit at its real rate until the next decoded frame is published.
+"""
+
+import time
+from typing import Dict
+
+import numpy as np
+from kivy import Logger
+
+from util.h264 import split_access_units
+from util.video import StreamingVideoSource
+
+
+def benchmark_wake_mode(access_units: [bytes], decoder: str, wake_mode: str, fps: float = 30.0,
+                        idle_seconds: float = 3.0) -> Dict[str, float]:
+    """Benchmarks one wake-up mode of the decoder.
+
+    :param access_units: the access units (frames) of the H.264 stream to feed.
+    :param decoder: the decoder backend, see `StreamingVideoSource.DECODERS`.
+    :param wake_mode: the wake-up mode, see `StreamingVideoSource.WAKE_MODES`.
+    :param fps: the rate at which the access units are fed, like a live source.
+    :param idle_seconds: how long to measure the CPU usage while no data is fed.
+    :return: the measured stats.
+    """
+    source = StreamingVideoSource(decoder=decoder, wake_mode=wake_mode)
+    last_feed_time = [0.0]
+    latencies = []
+
+    def on_video_frame(_source, _frame: np.ndarray):
+        latencies.append(time.perf_counter() - last_feed_time[0])
+
+    source.bind(on_video_frame=on_video_frame)
+    source.start()
+
+    # Idle CPU usage (of the whole process, including the decoder threads)
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    time.sleep(idle_seconds)
+    idle_cpu = (time.process_time() - cpu_start) / (time.perf_counter() - wall_start)
+
+    # Latency and CPU usage while streaming at the real rate
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    for i, access_unit in enumerate(access_units):
+        last_feed_time[0] = time.perf_counter()
+        source.feed(access_unit)
+        time.sleep(max(0.0, wall_start + (i + 1) / fps - time.perf_counter()))
+    time.sleep(0.5)  # Let the decoder flush the last frames
+    streaming_cpu = (time.process_time() - cpu_start) / (time.perf_counter() - wall_start)
+    source.close()
+
+    latencies_ms = np.array(latencies or [np.nan]) * 1000
+    return {
+        'idle_cpu': idle_cpu, 'streaming_cpu': streaming_cpu, 'frames': len(latencies),
+        'latency_mean_ms': float(np.mean(latencies_ms)), 'latency_p95_ms': float(np.percentile(latencies_ms, 95)),
+    }
+
+
+def main(path: str, decoder: str = StreamingVideoSource.DECODERS[0]):
+    with open(path, 'rb') as f:
+        access_units = split_access_units(f.read())
+    Logger.info('VideoBench: %d access units read from %s' % (len(access_units), path))
+    for wake_mode in StreamingVideoSource.WAKE_MODES:
+        stats = benchmark_wake_mode(access_units, decoder, wake_mode)
+        Logger.info('VideoBench: %s/%s: idle CPU %.1f%%, streaming CPU %.1f%%, %d frames, latency mean %.1fms, '
+                    'p95 %.1fms' % (decoder, wake_mode, stats['idle_cpu'] * 100, stats['streaming_cpu'] * 100,
+                                    stats['frames'], stats['latency_mean_ms'], stats['latency_p95_ms']))